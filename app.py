@@ -1,31 +1,84 @@
 import os
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from dotenv import load_dotenv
+from jinja2 import pass_context
+from markupsafe import Markup
 import json
-import csv
-import io
-from collections import defaultdict
-from sqlalchemy import func, and_, or_
-from werkzeug.utils import secure_filename
+from collections import defaultdict, OrderedDict
+from sqlalchemy import func, and_, or_, event, inspect, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, aliased, joinedload, load_only
+from sqlalchemy.exc import IntegrityError
+from werkzeug.middleware.proxy_fix import ProxyFix
 import uuid
-import requests # Added for API calls
+import secrets
+import hmac
+import mimetypes
+import threading
+import base64
+import time
+import math
+import click
+import logging
+from notifications import Broadcaster, Notification, SENDERS, percentile
+from shared_state import SQLiteState, open_shared_state
+from metrics import Registry
+from webhooks import Delivery, WebhookClient, backoff_seconds
+
+# Fast JSON encoders for the REST API; both are optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///bloodlink.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///bloodlink.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-
-# Create upload directory if it doesn't exist
-os.makedirs(os.path.join(app.root_path, app.config['UPLOAD_FOLDER']), exist_ok=True)
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 256))  # rendered dashboard blocks kept in memory
+app.config['EMERGENCY_SENDER'] = os.environ.get('EMERGENCY_SENDER', 'local')  # see notifications.SENDERS
+app.config['EMERGENCY_WEBHOOK_URL'] = os.environ.get('EMERGENCY_WEBHOOK_URL', '')
+app.config['EMERGENCY_WEBHOOK_TOKEN'] = os.environ.get('EMERGENCY_WEBHOOK_TOKEN', '')
+app.config['EMERGENCY_WORKERS'] = int(os.environ.get('EMERGENCY_WORKERS', 8))
+app.config['EMERGENCY_DISPATCH_ASYNC'] = True  # set False to broadcast inside the request (tests)
+# A queued or sending broadcast without progress for this long lost its worker (restart, max_requests) and may be retried
+app.config['EMERGENCY_STALL_SECONDS'] = int(os.environ.get('EMERGENCY_STALL_SECONDS', 300))
+app.config['SHARED_STATE'] = os.environ.get('SHARED_STATE', 'memory')  # rate limit buckets; use 'sqlite' with more than one worker process
+app.config['SLOW_QUERY_SECONDS'] = float(os.environ.get('SLOW_QUERY_SECONDS', 0.1))  # logged with EXPLAIN output
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))  # lazy loads of one relationship per request
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')  # when set, /metrics requires "Authorization: Bearer <token>"
+app.config['WEBHOOK_BATCH_SIZE'] = int(os.environ.get('WEBHOOK_BATCH_SIZE', 100))  # events per delivery
+app.config['WEBHOOK_TIMEOUT'] = float(os.environ.get('WEBHOOK_TIMEOUT', 10))
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+# Reverse proxies in front of the app; their X-Forwarded-For/-Proto give the client address and scheme
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+app.config['SHARED_STATE_PATH'] = os.environ.get('SHARED_STATE_PATH', os.path.join(app.instance_path, 'shared_state.db'))
+# In-memory arrays for donor matching; unset means on unless PARTITIONING=state (see donor_snapshot_enabled)
+app.config['DONOR_SNAPSHOT'] = {'1': True, '0': False}.get(os.environ.get('DONOR_SNAPSHOT'))
+app.config['PARTITIONING'] = os.environ.get('PARTITIONING', 'off')  # 'state' serves donor search from per-state shards
+app.config['SHARD_DIR'] = os.environ.get('SHARD_DIR', os.path.join(app.instance_path, 'shards'))
+# How long a rebalance keeps the previous shard generation for writes still in flight
+app.config['SHARD_SWITCH_GRACE_SECONDS'] = float(os.environ.get('SHARD_SWITCH_GRACE_SECONDS', 10))
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 730))  # older usage/donations move to archive_chunks
+app.config['ARCHIVE_BATCH_SIZE'] = int(os.environ.get('ARCHIVE_BATCH_SIZE', 5000))  # records moved per transaction
+
+# Rate limit buckets shared by all worker processes, and data-version counters shared by every
+# process including CLI jobs, so their changes invalidate the server's caches (see shared_state.py)
+shared_state = open_shared_state(app.config['SHARED_STATE'], app.config['SHARED_STATE_PATH'])
+data_versions = shared_state if isinstance(shared_state, SQLiteState) else SQLiteState(app.config['SHARED_STATE_PATH'])
 
 # Initialize extensions
 db = SQLAlchemy(app)
@@ -34,6 +87,280 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Request and database instrumentation, exported on /metrics
+metrics_registry = Registry()
+http_requests = metrics_registry.counter(
+    'bloodlink_http_requests_total', 'HTTP requests by route, method and status.', ('route', 'method', 'status'))
+http_request_seconds = metrics_registry.histogram(
+    'bloodlink_http_request_duration_seconds', 'Time spent handling requests.', ('route', 'method'))
+request_db_queries = metrics_registry.histogram(
+    'bloodlink_request_db_queries', 'Database queries issued per request.', ('route',),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 250))
+db_query_seconds = metrics_registry.histogram(
+    'bloodlink_db_query_duration_seconds', 'Time spent in single database queries.')
+slow_queries = metrics_registry.counter(
+    'bloodlink_slow_queries_total', 'Queries slower than SLOW_QUERY_SECONDS.', ('route',))
+n_plus_one_detected = metrics_registry.counter(
+    'bloodlink_n_plus_one_total', 'Requests that lazy loaded one relationship N_PLUS_ONE_THRESHOLD times or more.',
+    ('route', 'relationship'))
+chatbot_answers = metrics_registry.counter(
+    'bloodlink_chatbot_answers_total', 'Chatbot replies by where the answer came from.', ('source',))
+
+sql_logger = logging.getLogger('bloodlink.sql')
+
+def current_route():
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+    return 'none'
+
+def explain_query(connection, statement, parameters):
+    # Runs on the raw DB-API connection so it does not re-enter the cursor events
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.dialect.name == 'sqlite' else 'EXPLAIN '
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return '\n'.join(' '.join(str(col) for col in row) for row in cursor.fetchall())
+    except Exception as e:
+        return f'EXPLAIN failed: {e}'
+    finally:
+        cursor.close()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    db_query_seconds.observe(elapsed)
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+    if elapsed >= app.config['SLOW_QUERY_SECONDS']:
+        slow_queries.inc(route=current_route())
+        plan = '' if executemany or not statement.lstrip().upper().startswith('SELECT') \
+            else explain_query(conn, statement, parameters)
+        sql_logger.warning('Slow query (%.1f ms) on %s\n%s\nparameters: %.1000s\n%s',
+                           elapsed * 1000, current_route(), statement, repr(parameters), plan)
+
+@event.listens_for(Session, 'do_orm_execute')
+def count_lazy_loads(orm_execute_state):
+    # Relationship loads triggered by attribute access, e.g. record.hospital.name in a template loop
+    if not (orm_execute_state.is_relationship_load and has_request_context() and 'lazy_loads' in g):
+        return
+    path = orm_execute_state.loader_strategy_path
+    if path is None or orm_execute_state.lazy_loaded_from is None:
+        return
+    relationship = f'{path[-2].class_.__name__}.{path[-1].key}' if len(path) >= 2 else str(path)
+    g.lazy_loads[relationship] += 1
+
+_app_ready = False
+_app_ready_lock = threading.Lock()
+
+@app.before_request
+def ensure_app_ready():
+    # `flask --app app run` and servers pointed at app:app serve this module's app without calling
+    # create_app(); give them the same setup before their first request. Registered first, so it
+    # runs before every other hook; the proxy fix applies from the next request on
+    if not _app_ready:
+        with _app_ready_lock:
+            if not _app_ready:
+                create_app()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+    g.lazy_loads = defaultdict(int)
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    route = current_route()
+    http_requests.inc(route=route, method=request.method, status=response.status_code)
+    http_request_seconds.observe(elapsed, route=route, method=request.method)
+    request_db_queries.observe(g.db_queries, route=route)
+    for relationship, count in g.lazy_loads.items():
+        if count >= app.config['N_PLUS_ONE_THRESHOLD']:
+            n_plus_one_detected.inc(route=route, relationship=relationship)
+            sql_logger.warning('Possible N+1 on %s: %s lazy loaded %d times', route, relationship, count)
+    response.headers['Server-Timing'] = (f'app;dur={elapsed * 1000:.1f}, '
+                                         f'db;dur={g.db_seconds * 1000:.1f};desc="{g.db_queries} queries"')
+    return response
+
+# Pages the service worker keeps for offline use (see static/sw.js). They hold one account's
+# data, so they carry an opaque account tag and the worker drops its copies when the tag changes.
+OFFLINE_PAGE_ENDPOINTS = {'dashboard', 'hospital_dashboard', 'dashboard_stats'}
+
+def account_tag():
+    # Tells accounts apart without showing the worker (or anyone reading its storage) an id
+    account = f'{current_user.role}:{current_user.id}'.encode()
+    return hmac.new(app.secret_key.encode(), account, 'sha256').hexdigest()[:32]
+
+@app.after_request
+def tag_offline_pages(response):
+    if request.endpoint in OFFLINE_PAGE_ENDPOINTS and current_user.is_authenticated:
+        response.headers['X-BloodLink-Account'] = account_tag()
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+    return response
+
+@app.route('/api/offline-account')
+def offline_account():
+    # The service worker only replays queued writes while the account that queued them is signed in
+    response = jsonify({'account': account_tag() if current_user.is_authenticated else None})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+rate_limited = metrics_registry.counter(
+    'bloodlink_rate_limited_total', 'Requests rejected by the rate limiter.', ('endpoint', 'key'))
+
+# Token buckets per endpoint: key type -> (requests, per seconds); the full amount may be used as a burst.
+# "ip" is the client address, "account" the logged-in user. Logins are only limited per address:
+# a bucket keyed on the submitted email would let anyone lock a hospital out of its account.
+RATE_LIMITS = {
+    'login': {'ip': (20, 60)},
+    'hospital_login': {'ip': (20, 60)},
+    'register': {'ip': (5, 300)},
+    'chatbot_api': {'ip': (30, 60), 'account': (10, 60)},
+}
+RATE_LIMITED_TEMPLATES = {
+    'login': 'login.html',
+    'hospital_login': 'hospital_login.html',
+    'register': 'register.html',
+}
+
+def rate_limit_account():
+    if current_user.is_authenticated:
+        return f'{current_user.role}:{current_user.id}'
+    return None
+
+@app.before_request
+def enforce_rate_limits():
+    # Runs before the view, so rejected requests never reach bcrypt or the chatbot provider
+    limits = RATE_LIMITS.get(request.endpoint)
+    if not limits or request.method != 'POST' or not app.config['RATE_LIMIT_ENABLED']:
+        return None
+
+    keys = {'ip': request.remote_addr or 'unknown', 'account': rate_limit_account()}
+    for key_type, (count, per) in limits.items():
+        if keys[key_type] is None:
+            continue
+        bucket = shared_state.token_bucket(f'rate:{request.endpoint}:{key_type}:{keys[key_type]}', count / per, count)
+        if bucket.try_acquire():
+            continue
+
+        rate_limited.inc(endpoint=request.endpoint, key=key_type)
+        retry_after = str(math.ceil(per / count))
+        if request.endpoint in RATE_LIMITED_TEMPLATES:
+            flash('Too many attempts. Please wait a minute and try again.', 'error')
+            response = app.make_response((render_template(RATE_LIMITED_TEMPLATES[request.endpoint]), 429))
+        else:
+            response = jsonify({'error': 'Too many requests, please slow down.'})
+            response.status_code = 429
+        response.headers['Retry-After'] = retry_after
+        return response
+    return None
+
+# Fingerprinted static assets produced by build_assets.py (optional).
+# When static/build/manifest.json exists, url_for('static', ...) and /sw.js use the hashed files.
+ASSET_BUILD_DIR = 'build'
+ASSET_MAX_AGE = 365 * 24 * 60 * 60  # hashed files never change, cache them for a year
+
+def load_asset_manifest():
+    manifest_path = os.path.join(app.static_folder, ASSET_BUILD_DIR, 'manifest.json')
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {'version': None, 'files': {}}
+    manifest.setdefault('files', {})
+    return manifest
+
+asset_manifest = load_asset_manifest()
+
+@app.url_defaults
+def hashed_static_url(endpoint, values):
+    if endpoint == 'static':
+        hashed = asset_manifest['files'].get(values.get('filename'))
+        if hashed:
+            values['filename'] = hashed
+
+def send_static_asset(filename):
+    # Replaces Flask's static view: hashed build files are served precompressed with far-future headers
+    if not filename.startswith(ASSET_BUILD_DIR + '/'):
+        return send_from_directory(app.static_folder, filename)
+
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.isfile(os.path.join(app.static_folder, filename + suffix)):
+            response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(app.static_folder, filename, max_age=ASSET_MAX_AGE)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.immutable = True
+    return response
+
+app.view_functions['static'] = send_static_asset
+
+@app.context_processor
+def inject_asset_manifest():
+    return {'asset_manifest': asset_manifest['files']}
+
+# Translation catalogs, loaded once at startup and rendered server-side through the |t filter
+DEFAULT_LANGUAGE = 'en'
+LANGUAGE_COOKIE = 'lang'
+LANGUAGE_LABELS = {'en': 'EN', 'kn': 'ಕನ್ನಡ', 'hi': 'हिं'}
+# Messages built in scripts.js (validation, toasts); only these are sent to the browser
+CLIENT_TRANSLATION_KEYS = (
+    'chatbot_error', 'confirm_remove_report', 'error_removing_report', 'file_too_large',
+    'invalid_age', 'invalid_email', 'invalid_file_type', 'invalid_phone',
+    'password_too_short', 'report_removed', 'required_field',
+)
+
+def load_translation_catalogs():
+    catalogs = {}
+    i18n_dir = os.path.join(app.static_folder, 'i18n')
+    for filename in sorted(os.listdir(i18n_dir)):
+        lang, ext = os.path.splitext(filename)
+        if ext == '.json':
+            with open(os.path.join(i18n_dir, filename), encoding='utf-8') as f:
+                catalogs[lang] = json.load(f)
+    return catalogs
+
+translation_catalogs = load_translation_catalogs()
+
+def get_language():
+    if 'language' not in g:
+        lang = request.cookies.get(LANGUAGE_COOKIE)
+        if lang not in translation_catalogs:
+            lang = request.accept_languages.best_match(list(translation_catalogs)) or DEFAULT_LANGUAGE
+        g.language = lang
+    return g.language
+
+def translate(key, lang=None):
+    catalog = translation_catalogs.get(lang or get_language(), {})
+    return catalog.get(key) or translation_catalogs.get(DEFAULT_LANGUAGE, {}).get(key, key)
+
+@app.template_filter('t')
+@pass_context  # also stops Jinja from folding '...'|t into the compiled template in one language
+def translate_filter(context, key):
+    return translate(key, context.get('current_lang'))
+
+@app.context_processor
+def inject_language():
+    lang = get_language()
+    return {
+        'current_lang': lang,
+        'current_lang_label': LANGUAGE_LABELS.get(lang, lang.upper()),
+        'client_translations': {key: translate(key, lang) for key in CLIENT_TRANSLATION_KEYS},
+    }
+
 # Allowed file extensions for blood test reports
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 
@@ -46,14 +373,27 @@ class ChatbotAdapter:
         self.provider = os.environ.get('MEDICAL_CHATBOT_PROVIDER', 'huggingface')
         self.api_key = os.environ.get('MEDICAL_CHATBOT_API_KEY', '')
         self.base_url = "https://api-inference.huggingface.co/models/"
+        # Minimum cosine similarity for a local answer; below it the question goes to the remote model
+        self.retrieval_threshold = float(os.environ.get('CHATBOT_RETRIEVAL_THRESHOLD', 0.3))
+        self._answer_index = None
+        # Threads that arrive mid-build wait for the index rather than skipping to the remote model
+        self._answer_index_lock = threading.Lock()
         
     def send(self, message: str, user_context: dict) -> str:
         try:
             # Check for direct medical keywords first to use our custom safe responses
             # This ensures we prioritize our safe, verified answers over AI generation for critical topics
             if self._should_use_fallback(message):
+                chatbot_answers.inc(source='keyword')
                 return self._get_medical_response(message)
 
+            # A close match among our own answers is instant; the remote model takes seconds
+            answer = self._retrieve(message)
+            if answer:
+                chatbot_answers.inc(source='retrieval')
+                return answer
+
+            chatbot_answers.inc(source='remote')
             # Use free Hugging Face Inference API for general medical questions
             if self.provider == 'huggingface':
                 return self._query_huggingface(message)
@@ -65,6 +405,31 @@ class ChatbotAdapter:
             print(f"Chatbot error: {e}")
             return self._get_medical_response(message)
     
+    def _get_answer_index(self):
+        # Built on the first unmatched question, from the same answers the keyword branches give
+        with self._answer_index_lock:
+            if self._answer_index is None:
+                from chatbot_retrieval import TOPICS, FAQ, AnswerIndex
+                # retrieve=False: a probe always hits its keyword branch, and the lock is held here
+                entries = [(probe, (probe,) + phrasings + (self._get_medical_response(probe, retrieve=False),))
+                           for probe, phrasings in TOPICS]
+                entries += [(answer, phrasings + (answer,)) for phrasings, answer in FAQ]
+                self._answers = [answer for answer, _ in entries]
+                self._answer_is_probe = [i < len(TOPICS) for i in range(len(entries))]
+                self._answer_index = AnswerIndex([texts for _, texts in entries])
+            return self._answer_index
+
+    def _retrieve(self, message: str):
+        """Best canned answer for a question no keyword branch matched, or None below the threshold."""
+        entry, score = self._get_answer_index().search(message)
+        if entry is None or score < self.retrieval_threshold:
+            return None
+        if not self._answer_is_probe[entry]:
+            return self._answers[entry]
+        # Canned topics keep their short / detailed variants
+        ask_why = any(w in message.lower() for w in ['why', 'reason', 'cause', 'explain', 'detail', 'more info', 'how come'])
+        return self._get_medical_response(self._answers[entry] + (' explain' if ask_why else ''))
+
     def _should_use_fallback(self, message: str) -> bool:
         # keywords that trigger our custom logic immediately
         # Added general health keywords: fever, cold, flu, headache, diet, sleep, stress, water
@@ -74,6 +439,7 @@ class ChatbotAdapter:
         return any(k in message.lower() for k in keywords)
 
     def _query_huggingface(self, message: str) -> str:
+        import requests  # loaded on the first remote call, not at startup
         # Use a medical-focused model from Hugging Face
         model_name = "microsoft/DialoGPT-medium"
         url = f"{self.base_url}{model_name}"
@@ -118,6 +484,7 @@ Response:"""
             return self._get_medical_response(message)
     
     def _query_openai(self, message: str) -> str:
+        import requests
         # OpenAI integration (if API key is provided)
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -151,7 +518,7 @@ Response:"""
         
         return self._get_medical_response(message)
     
-    def _get_medical_response(self, message: str) -> str:
+    def _get_medical_response(self, message: str, retrieve: bool = True) -> str:
         """Generate comprehensive blood donation responses based on keywords"""
         message_lower = message.lower()
 
@@ -561,6 +928,9 @@ Response:"""
 
         # Fallback response for unrecognized queries
         else:
+            answer = self._retrieve(message) if retrieve else None
+            if answer:
+                return answer
             return f"""**Health Information Request:**
 
 I understand you're asking about: "{message}"
@@ -583,7 +953,17 @@ For medical emergencies, please contact emergency services immediately.
 
 ⚠️ This chatbot provides general information only."""
 
-chatbot = ChatbotAdapter()
+_chatbot = None
+_chatbot_lock = threading.Lock()
+
+def get_chatbot():
+    # Built on first use so startup does not read provider settings it may never need
+    global _chatbot
+    if _chatbot is None:
+        with _chatbot_lock:
+            if _chatbot is None:
+                _chatbot = ChatbotAdapter()
+    return _chatbot
 
 # Database Models
 class User(UserMixin, db.Model):
@@ -610,12 +990,32 @@ class User(UserMixin, db.Model):
     report_submitted_at = db.Column(db.DateTime)
     approved_by_hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'))
     is_verified_donor = db.Column(db.Boolean, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # incremental API sync
+    next_eligible_at = db.Column(db.DateTime)  # NULL = never donated, eligible now; see update_next_eligible_at
+    # Duplicate detection keys (see dedup.py), kept up to date by set_donor_keys
+    phone_key = db.Column(db.String(15), index=True)
+    name_key = db.Column(db.String(100))
+    name_soundex = db.Column(db.String(4))
+    possible_duplicate_of_id = db.Column(db.Integer, db.ForeignKey('users.id'))  # flagged for review, never merged
     
     # Relationships
     blood_usage = db.relationship('BloodUsage', backref='donor', lazy=True)
     donations = db.relationship('Donation', backref='donor', lazy=True)
     approved_by_hospital = db.relationship('Hospital', foreign_keys=[approved_by_hospital_id], backref='approved_donors')
 
+    __table_args__ = (
+        # Eligible-donor search is a range scan on next_eligible_at within verified donors
+        db.Index('ix_users_verified_next_eligible', 'is_verified_donor', 'next_eligible_at'),
+        # Duplicate candidates: same pincode and same-sounding name
+        db.Index('ix_users_dedup_block', 'pincode', 'name_soundex'),
+    )
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def set_donor_keys(mapper, connection, user):
+    from dedup import donor_keys
+    user.phone_key, user.name_key, user.name_soundex = donor_keys(user.name, user.contact_number)
+
 class Hospital(UserMixin, db.Model):
     __tablename__ = 'hospitals'
     
@@ -628,6 +1028,7 @@ class Hospital(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
     role = db.Column(db.String(20), default='hospital')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # incremental API sync
     
     # Relationships
     blood_usage = db.relationship('BloodUsage', backref='hospital', lazy=True)
@@ -637,8 +1038,8 @@ class BloodUsage(db.Model):
     __tablename__ = 'blood_usage'
     
     id = db.Column(db.Integer, primary_key=True)
-    donor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
+    donor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False, index=True)
     
    
     blood_units = db.Column(db.String(20))      # this for this "1", "0.5", "2 units".
@@ -646,6 +1047,8 @@ class BloodUsage(db.Model):
     notes = db.Column(db.Text)
     
     date = db.Column(db.DateTime, default=datetime.utcnow)
+    idempotency_key = db.Column(db.String(64), unique=True)  # set by the form / offline replay queue
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # incremental API sync
 
     # Relationships (optional )
     #donor = db.relationship('User', foreign_keys=[donor_id])
@@ -655,14 +1058,182 @@ class Donation(db.Model):
     __tablename__ = 'donations'
     
     id = db.Column(db.Integer, primary_key=True)
-    donor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
+    donor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False, index=True)
     
     donation_units = db.Column(db.String(20))      # e.g., "1", "0.5", "2 units"
     donation_type = db.Column(db.String(100))      # e.g., "Whole Blood", "Plasma", "Platelets"
     notes = db.Column(db.Text)
     
     date = db.Column(db.DateTime, default=datetime.utcnow)
+    idempotency_key = db.Column(db.String(64), unique=True)  # set by the form / offline replay queue
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # incremental API sync
+
+class BloodUnit(db.Model):
+    __tablename__ = 'inventory_units'
+
+    id = db.Column(db.Integer, primary_key=True)
+    donation_id = db.Column(db.Integer, db.ForeignKey('donations.id'), nullable=False, index=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
+    blood_group = db.Column(db.String(5), nullable=False)
+    component = db.Column(db.String(50), nullable=False)      # see inventory.SHELF_LIFE_DAYS
+    collected_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), default='available')    # available, allocated, expired
+    usage_id = db.Column(db.Integer, db.ForeignKey('blood_usage.id'), index=True)
+    allocated_at = db.Column(db.DateTime)
+    expiry_flagged_at = db.Column(db.DateTime)                # set by check-inventory when expiry is near
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        # Stock loads and the expiry job scan a hospital's available units by expiry date
+        db.Index('ix_inventory_units_stock', 'hospital_id', 'status', 'blood_group', 'component', 'expires_at'),
+        db.Index('ix_inventory_units_expiry', 'status', 'expires_at'),
+    )
+
+class EmergencyRequest(db.Model):
+    __tablename__ = 'emergency_requests'
+
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False, index=True)
+    blood_group = db.Column(db.String(5), nullable=False)     # recipient's blood group
+    units = db.Column(db.String(20))
+    city = db.Column(db.String(100), nullable=False)
+    state = db.Column(db.String(100), nullable=False)
+    scope = db.Column(db.String(10), default='city')          # "city" or "state"
+    notes = db.Column(db.Text)
+    status = db.Column(db.String(20), default='queued')       # queued, sending, completed, failed
+    recipient_count = db.Column(db.Integer, default=0)
+    sent_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    p95_notify_seconds = db.Column(db.Float)                  # time from dispatch start to delivery
+    last_error = db.Column(db.String(500))                    # why a failed broadcast stopped
+    heartbeat_at = db.Column(db.DateTime)                     # last progress of the running broadcast
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+    hospital = db.relationship('Hospital', backref='emergency_requests')
+
+    def can_retry(self, now=None):
+        # Same condition as retryable_emergency_filter()
+        if self.status == 'failed':
+            return True
+        stalled_before = (now or datetime.utcnow()) - timedelta(seconds=app.config['EMERGENCY_STALL_SECONDS'])
+        return self.status in ('queued', 'sending') and (self.heartbeat_at or self.created_at) < stalled_before
+
+class EmergencyNotification(db.Model):
+    __tablename__ = 'emergency_notifications'
+
+    id = db.Column(db.Integer, primary_key=True)
+    request_id = db.Column(db.Integer, db.ForeignKey('emergency_requests.id'), nullable=False, index=True)
+    donor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    channel = db.Column(db.String(20), nullable=False)
+    recipient = db.Column(db.String(15), nullable=False)
+    status = db.Column(db.String(10), default='queued')       # queued, sent, failed
+    error = db.Column(db.String(255))
+    sent_at = db.Column(db.DateTime)
+
+class DailyRollup(db.Model):
+    """Materialized daily totals per hospital, blood group and donation/usage type.
+
+    Maintained in the same transaction as every create_usage/create_donation
+    and rebuilt in bulk with `flask rebuild-rollups`.
+    """
+    __tablename__ = 'daily_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)           # "donation" or "usage"
+    day = db.Column(db.Date, nullable=False)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
+    state = db.Column(db.String(100), nullable=False)         # copied from the hospital for regional queries
+    city = db.Column(db.String(100), nullable=False)
+    blood_group = db.Column(db.String(5), nullable=False)     # donor's blood group
+    record_type = db.Column(db.String(100), nullable=False, default='')  # donation_type / usage_type
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'day', 'hospital_id', 'blood_group', 'record_type', name='uq_daily_rollups_key'),
+        db.Index('ix_daily_rollups_region', 'kind', 'state', 'day'),
+    )
+
+class OutboxEvent(db.Model):
+    """Change feed entry, written in the same transaction as the change it describes."""
+    __tablename__ = 'outbox_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Delivery order, numbered by the dispatcher once the event is committed (see sequence_outbox_events)
+    sequence = db.Column(db.Integer, unique=True)
+    event_type = db.Column(db.String(50), nullable=False)  # e.g. "donor.approved", "usage.created"
+    resource = db.Column(db.String(20), nullable=False)    # API resource of the payload ("donors", "usages", ...)
+    record_id = db.Column(db.Integer, nullable=False)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), index=True)  # NULL = every hospital may see it
+    payload = db.Column(db.Text, nullable=False)  # JSON with the resource's API fields
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class WebhookSubscription(db.Model):
+    __tablename__ = 'webhook_subscriptions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), unique=True, nullable=False)
+    url = db.Column(db.String(500), nullable=False)
+    secret = db.Column(db.String(64), nullable=False)  # HMAC key for the X-BloodLink-Signature header
+    event_types = db.Column(db.String(300), default='')  # comma separated; empty = all events
+    active = db.Column(db.Boolean, default=True)
+    cursor = db.Column(db.Integer, default=0, nullable=False)  # last acknowledged outbox event sequence
+    failure_count = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime)  # set while backing off after failures
+    last_error = db.Column(db.Text)
+    last_delivered_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def event_type_list(self):
+        return [t for t in (self.event_types or '').split(',') if t]
+
+class TransferSuggestion(db.Model):
+    """Suggested inter-hospital transfer, replaced on every `flask suggest-transfers` run (see transfers.py)."""
+    __tablename__ = 'transfer_suggestions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    blood_group = db.Column(db.String(5), nullable=False)
+    from_hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False, index=True)
+    to_hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False, index=True)
+    units = db.Column(db.Integer, nullable=False)
+    distance = db.Column(db.String(10), nullable=False)  # "city", "state" or "national"
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ArchiveChunk(db.Model):
+    """Compressed usage or donation records of one hospital, moved out by `flask archive-history` (see archive.py)."""
+    __tablename__ = 'archive_chunks'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)           # "donation" or "usage"
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)          # record id range inside the chunk
+    last_id = db.Column(db.Integer, nullable=False)
+    first_date = db.Column(db.DateTime)
+    last_date = db.Column(db.DateTime)
+    row_count = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)       # zlib-compressed JSON rows
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Hospital history and incremental forecast loads read a hospital's chunks past an id
+        db.Index('ix_archive_chunks_hospital', 'kind', 'hospital_id', 'last_id'),
+    )
+
+class ArchiveChunkDonor(db.Model):
+    """Which chunks hold a donor's records, and how many, so donor history skips every other chunk."""
+    __tablename__ = 'archive_chunk_donors'
+
+    chunk_id = db.Column(db.Integer, db.ForeignKey('archive_chunks.id'), primary_key=True)
+    donor_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_archive_chunk_donors_donor', 'donor_id', 'kind'),
+    )
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -697,11 +1268,785 @@ def is_report_pending(user):
     time_diff = datetime.utcnow() - user.report_submitted_at
     return time_diff < timedelta(minutes=30) and user.report_status == 'pending'
 
+# Minimum gap between donations, by donation type (same figures the chatbot gives donors).
+# Whole blood depends on gender: 3 months for men, 4 months for women.
+DONATION_INTERVALS = {
+    'Plasma': timedelta(weeks=4),
+    'Platelets': timedelta(weeks=2),
+    'Double Red Cells': timedelta(days=180),
+}
+WHOLE_BLOOD_INTERVAL_MALE = timedelta(weeks=12)
+WHOLE_BLOOD_INTERVAL_OTHER = timedelta(weeks=16)
+
+def get_donation_interval(donation_type, gender):
+    if donation_type in DONATION_INTERVALS:
+        return DONATION_INTERVALS[donation_type]
+    # Whole blood, and anything unrecorded, uses the conservative whole-blood rule
+    return WHOLE_BLOOD_INTERVAL_MALE if (gender or '').lower() == 'male' else WHOLE_BLOOD_INTERVAL_OTHER
+
+def update_next_eligible_at(donor, donation_type, donation_date):
+    # Backdated entries must never move the date earlier than a later donation already set it
+    next_eligible_at = donation_date + get_donation_interval(donation_type, donor.gender)
+    if donor.next_eligible_at is None or next_eligible_at > donor.next_eligible_at:
+        donor.next_eligible_at = next_eligible_at
+
+def eligible_now_filter(now=None):
+    now = now or datetime.utcnow()
+    return or_(User.next_eligible_at.is_(None), User.next_eligible_at <= now)
+
+# Red cell compatibility: recipient blood group -> donor groups that can give to it
+COMPATIBLE_DONORS = {
+    'O-': ['O-'],
+    'O+': ['O+', 'O-'],
+    'A-': ['A-', 'O-'],
+    'A+': ['A+', 'A-', 'O+', 'O-'],
+    'B-': ['B-', 'O-'],
+    'B+': ['B+', 'B-', 'O+', 'O-'],
+    'AB-': ['AB-', 'A-', 'B-', 'O-'],
+    'AB+': ['AB+', 'AB-', 'A+', 'A-', 'B+', 'B-', 'O+', 'O-'],
+}
+
+# Helper function to add one record to the daily rollup inside the caller's transaction
+def record_rollup(kind, hospital, blood_group, record_type, units_text, when):
+    from forecasting import parse_units
+    values = {
+        'kind': kind, 'day': when.date(), 'hospital_id': hospital.id,
+        'state': hospital.state, 'city': hospital.city, 'blood_group': blood_group,
+        'record_type': record_type or '', 'record_count': 1, 'units': parse_units(units_text),
+    }
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    statement = dialect_insert(DailyRollup).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=['kind', 'day', 'hospital_id', 'blood_group', 'record_type'],
+        set_={'record_count': DailyRollup.record_count + 1,
+              'units': DailyRollup.units + statement.excluded.units})
+    db.session.execute(statement)
+
+# Change feed events; payloads use the same fields as the JSON API
+OUTBOX_EVENT_TYPES = ('donor.registered', 'donor.approved', 'donor.rejected', 'usage.created', 'donation.created')
+
+def add_outbox_event(event_type, resource_name, record, hospital_id=None):
+    # Flushes so the record has its id; the event commits or rolls back together with the caller's change
+    db.session.flush()
+    fields = API_RESOURCES[resource_name]['fields']
+    db.session.add(OutboxEvent(
+        event_type=event_type,
+        resource=resource_name,
+        record_id=record.id,
+        hospital_id=hospital_id,
+        payload=dumps_json({f: getattr(record, f) for f in fields}).decode('utf-8'),
+    ))
+
+# Helper function to read the idempotency key of a write request.
+# The service worker replays queued offline POSTs with an Idempotency-Key header,
+# normal form submits carry the same key in a hidden field.
+def get_idempotency_key():
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key', '')
+    key = key.strip()[:64]
+    return key or None
+
+def submitted_by_current_account():
+    """False when the form was rendered for another account than the one signed in now.
+
+    Forms carry account_tag(); a write queued offline by one hospital and replayed
+    after another signed in on the same browser must not be saved for the second.
+    """
+    tag = request.form.get('account_tag')
+    return not tag or hmac.compare_digest(tag, account_tag())
+
+def record_outcome(status, *messages, endpoint='hospital_dashboard'):
+    """Answer a usage or donation submit: flash the (text, category) messages and redirect.
+
+    Replays from the service worker's offline queue (X-Offline-Replay header) get
+    the messages as JSON with a real status code instead, so the queue only drops
+    a record once the server saved it.
+    """
+    if request.headers.get('X-Offline-Replay'):
+        return jsonify({'messages': [{'text': text, 'category': category} for text, category in messages]}), status
+    for text, category in messages:
+        flash(text, category)
+    return redirect(url_for(endpoint))
+
+# Rendered-fragment cache for the expensive dashboard blocks.
+# Keys include a data version that is bumped after every write touching that data,
+# so stale entries are never read again and simply age out of the LRU.
+# Versions live in the data_versions file, so a write in any worker or CLI job invalidates the caches of every worker
+def bump_data_version(*names):
+    data_versions.incr(*(f'data_version:{name}' for name in names))
+
+def get_data_versions(*names):
+    return data_versions.get_counters(*(f'data_version:{name}' for name in names))
+
+class FragmentCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_render(self, key, render):
+        # render() returns (html, meta); meta carries counts the page shows outside the fragment,
+        # and optionally 'expires_at', a time after which the fragment is rendered again
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None and (value[1].get('expires_at') is None
+                                      or datetime.utcnow() < value[1]['expires_at']):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        # Render outside the lock; two concurrent misses just render the same block twice
+        html, meta = render()
+        value = (Markup(html), meta)
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+# Per-hospital demand/supply series for shortage forecasting (see forecasting.py).
+# Only rows past the last id seen, or written shortly before the last load, are
+# read, and the summary is reused until usage/donation data changes or the day
+# rolls over. forecast_lock only guards the dict: each series has its own lock,
+# and database reads hold neither.
+forecast_series = {}
+forecast_lock = threading.Lock()
+
+def get_hospital_forecast(hospital_id):
+    with forecast_lock:
+        series = forecast_series.get(hospital_id)
+        if series is None:
+            from forecasting import HospitalSeries  # NumPy is only loaded once a forecast is needed
+            series = forecast_series[hospital_id] = HospitalSeries()
+
+    cache_key = (get_data_versions('usage', 'donations'), datetime.utcnow().date())
+    cached = series.cached
+    if cached is not None and cached[0] == cache_key:
+        return cached[1]
+
+    # A transaction that commits late holds a lower id than rows already loaded, so rows
+    # written since shortly before the last load are read again; add() skips counted ids
+    started = datetime.utcnow()
+    recent_since = series.loaded_at - SNAPSHOT_SYNC_OVERLAP if series.loaded_at else None
+    usage_rows = db.session.query(BloodUsage.id, BloodUsage.date, User.blood_group, BloodUsage.blood_units)\
+        .join(User, User.id == BloodUsage.donor_id)\
+        .filter(BloodUsage.hospital_id == hospital_id,
+                new_forecast_rows(BloodUsage, series.last_ids['usage'], recent_since)).all()
+    donation_rows = db.session.query(Donation.id, Donation.date, User.blood_group, Donation.donation_units)\
+        .join(User, User.id == Donation.donor_id)\
+        .filter(Donation.hospital_id == hospital_id,
+                new_forecast_rows(Donation, series.last_ids['supply'], recent_since)).all()
+    # Archived records past the last id too: a new process starts from id 0, and
+    # records can be archived between two loads
+    usage_rows += archived_forecast_rows('usage', hospital_id, series.last_ids['usage'])
+    donation_rows += archived_forecast_rows('donation', hospital_id, series.last_ids['supply'])
+    series.add('usage', usage_rows)
+    series.add('supply', donation_rows)
+
+    summary = series.summary(today=cache_key[1])
+    series.loaded(started, cache_key, summary)
+    return summary
+
+def new_forecast_rows(model, last_id, recent_since):
+    if recent_since is None:
+        return model.id > last_id
+    return or_(model.id > last_id, model.updated_at >= recent_since)
+
+def archived_forecast_rows(kind, hospital_id, after_id):
+    """(id, date, blood_group, units) rows of archived records, like the hot rows above."""
+    records = load_archived(kind, hospital_id=hospital_id, after_id=after_id)
+    if not records:
+        return []
+    groups = donor_blood_groups({record.donor_id for record in records})
+    units_field = 'blood_units' if kind == 'usage' else 'donation_units'
+    return [(record.id, record.date, groups[record.donor_id], getattr(record, units_field))
+            for record in records if record.donor_id in groups]
+
+# Unit inventory per hospital (see inventory.py). Like the forecast series, each
+# process keeps heaps of available units and only loads units newer than the last id seen.
+inventory_stock = {}
+inventory_lock = threading.Lock()
+
+def add_inventory_units(donation, blood_group):
+    """Stock the unit lots of a new donation (already flushed) inside the caller's transaction."""
+    from inventory import component_for, expiry_for, unit_count
+    component = component_for(donation.donation_type)
+    for _ in range(unit_count(donation.donation_units)):
+        db.session.add(BloodUnit(donation_id=donation.id, hospital_id=donation.hospital_id, blood_group=blood_group,
+                                 component=component, collected_at=donation.date,
+                                 expires_at=expiry_for(component, donation.date)))
+
+def get_hospital_stock(hospital_id):
+    with inventory_lock:
+        stock = inventory_stock.get(hospital_id)
+        if stock is None:
+            from inventory import HospitalStock
+            stock = inventory_stock[hospital_id] = HospitalStock()
+    with stock.lock:
+        stock.add(db.session.query(BloodUnit.id, BloodUnit.blood_group, BloodUnit.component, BloodUnit.expires_at)
+                  .filter(BloodUnit.hospital_id == hospital_id, BloodUnit.status == 'available',
+                          BloodUnit.id > stock.last_id).all())
+    return stock
+
+def claim_unit(unit_id, usage_id, now):
+    """Allocate a unit unless it is no longer available; another worker may have used it
+    since it was loaded into this process's heap."""
+    result = db.session.execute(
+        update(BloodUnit)
+        .where(BloodUnit.id == unit_id, BloodUnit.status == 'available')
+        .values(status='allocated', usage_id=usage_id, allocated_at=now, updated_at=now))
+    return result.rowcount == 1
+
+def allocate_units(usage, blood_group):
+    """Assign the first-expiring available units to a usage record inside the caller's transaction.
+
+    Returns (allocated, requested) unit counts.
+    """
+    from inventory import components_for_usage, unit_count
+    now = datetime.utcnow()
+    requested = unit_count(usage.blood_units)
+    stock = get_hospital_stock(usage.hospital_id)
+    with stock.lock:
+        allocated = stock.take(blood_group, components_for_usage(usage.usage_type), requested, now,
+                               lambda unit_id: claim_unit(unit_id, usage.id, now))
+    return len(allocated), requested
+
+def check_inventory(now=None):
+    """Mark units past expiry as expired and flag the ones expiring soon; returns both counts."""
+    from inventory import NEAR_EXPIRY_DAYS, near_expiry_window
+    now = now or datetime.utcnow()
+    expired = BloodUnit.query.filter(BloodUnit.status == 'available', BloodUnit.expires_at <= now)\
+        .update({BloodUnit.status: 'expired', BloodUnit.updated_at: now}, synchronize_session=False)
+    flagged = 0
+    for component in NEAR_EXPIRY_DAYS:
+        flagged += BloodUnit.query.filter(BloodUnit.status == 'available', BloodUnit.component == component,
+                                          BloodUnit.expiry_flagged_at.is_(None),
+                                          BloodUnit.expires_at <= now + near_expiry_window(component))\
+            .update({BloodUnit.expiry_flagged_at: now, BloodUnit.updated_at: now}, synchronize_session=False)
+    db.session.commit()
+    return expired, flagged
+
+def suggest_transfers(now=None):
+    """Replace the transfer suggestions with a fresh plan from current stock and recent demand."""
+    from forecasting import WINDOW_DAYS
+    from transfers import Position, plan_transfers
+    now = now or datetime.utcnow()
+    places = {hospital_id: (city, state)
+              for hospital_id, city, state in db.session.query(Hospital.id, Hospital.city, Hospital.state)}
+
+    expiries = defaultdict(list)
+    units = db.session.query(BloodUnit.hospital_id, BloodUnit.blood_group, BloodUnit.expires_at)\
+        .filter(BloodUnit.status == 'available', BloodUnit.expires_at > now).yield_per(10000)
+    for hospital_id, blood_group, expires_at in units:
+        expiries[(hospital_id, blood_group)].append((expires_at - now) / timedelta(days=1))
+
+    # Mean daily usage and donations over the forecasting window, from the rollups in one query
+    rates = defaultdict(lambda: [0.0, 0.0])
+    since = (now - timedelta(days=WINDOW_DAYS - 1)).date()
+    totals = db.session.query(DailyRollup.kind, DailyRollup.hospital_id, DailyRollup.blood_group,
+                              func.sum(DailyRollup.units))\
+        .filter(DailyRollup.day >= since)\
+        .group_by(DailyRollup.kind, DailyRollup.hospital_id, DailyRollup.blood_group)
+    for kind, hospital_id, blood_group, total in totals:
+        rates[(hospital_id, blood_group)][0 if kind == 'usage' else 1] += total / WINDOW_DAYS
+
+    positions = []
+    for key in set(expiries) | set(rates):
+        hospital_id, blood_group = key
+        if hospital_id in places:
+            positions.append(Position(hospital_id, *places[hospital_id], blood_group, expiries.get(key, []), *rates[key]))
+    transfers = plan_transfers(positions)
+
+    TransferSuggestion.query.delete()
+    db.session.bulk_insert_mappings(TransferSuggestion, [dict(transfer._asdict(), created_at=now)
+                                                         for transfer in transfers])
+    db.session.commit()
+    return transfers
+
+# Region shards (PARTITIONING=state, see sharding.py). The main database stays the
+# system of record; every committed donor, usage and donation change is copied to
+# its shard after the commit, and rebalance_shards rebuilds the shards from scratch.
+_shard_router = None
+shard_router_lock = threading.Lock()
+SHARD_MODELS = {'donors': User, 'blood_usage': BloodUsage, 'donations': Donation}
+SHARD_TABLES = {model: table for table, model in SHARD_MODELS.items()}
+
+def get_shard_router():
+    global _shard_router
+    if app.config['PARTITIONING'] != 'state':
+        return None
+    with shard_router_lock:
+        if _shard_router is None:
+            from sharding import ShardRouter
+            _shard_router = ShardRouter(app.config['SHARD_DIR'])
+        return _shard_router
+
+def iter_shard_rows(connection, table, condition=None, chunk_size=10000):
+    """Yield (state, row) for one shard table, read from the main database in sharding column order."""
+    from sharding import TABLES, format_datetime
+    model = SHARD_MODELS[table]
+    columns = [getattr(model, name) for name in TABLES[table][0]]
+    if table == 'donors':
+        query = select(User.state, *columns).where(User.role == 'user')
+    else:
+        # Activity is partitioned by the recording hospital's state
+        query = select(Hospital.state, *columns).join(Hospital, Hospital.id == model.hospital_id)
+    if condition is not None:
+        query = query.where(condition)
+    for state, *values in connection.execution_options(yield_per=chunk_size).execute(query):
+        yield state, tuple(format_datetime(v) if isinstance(v, datetime) else int(v) if isinstance(v, bool) else v
+                           for v in values)
+
+def sync_shard_table(table, condition=None, delete_ids=()):
+    """Copy matching rows to the shard of their state; delete_ids are first removed from all other shards."""
+    router = get_shard_router()
+    rows_by_shard = defaultdict(list)
+    with db.engine.connect() as connection:
+        for state, row in iter_shard_rows(connection, table, condition):
+            rows_by_shard[router.shard_for(state)].append(row)
+    router.write(table, rows_by_shard, delete_ids)
+
+@event.listens_for(Session, 'after_flush')
+def collect_shard_changes(session, flush_context):
+    if app.config['PARTITIONING'] != 'state':
+        return
+    changes = session.info.setdefault('shard_changes', {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = SHARD_TABLES.get(type(obj))
+        if table is None:
+            continue
+        ids, moved = changes.setdefault(table, (set(), set()))
+        ids.add(obj.id)
+        # Rows that leave their shard: deleted ones and donors whose state changed
+        if obj in session.deleted or (table == 'donors' and inspect(obj).attrs.state.history.deleted):
+            moved.add(obj.id)
+
+@event.listens_for(Session, 'after_commit')
+def copy_changes_to_shards(session):
+    changes = session.info.pop('shard_changes', None)
+    if not changes:
+        return
+    try:
+        for table, (ids, moved) in changes.items():
+            sync_shard_table(table, SHARD_MODELS[table].id.in_(ids), moved)
+    except Exception:
+        # The commit stands; the shard is stale until the next rebalance
+        app.logger.exception('Copying committed changes to region shards failed; run `flask rebalance-shards`')
+
+@event.listens_for(Session, 'after_rollback')
+def discard_shard_changes(session):
+    session.info.pop('shard_changes', None)
+
+def rebalance_shards(max_shards=None, grace_seconds=None):
+    """Assign states to shards by row count, rebuild every shard from the main database and switch to it.
+
+    Rows committed while the new generation is built land in the old one. Once every
+    worker has had grace_seconds (SHARD_SWITCH_GRACE_SECONDS) to see the new map,
+    the rows changed since the rebuild started are copied again and the old
+    generation is deleted. Deletes made during the rebuild are not replayed, so do
+    not run archive-history at the same time.
+    """
+    from sharding import plan_shards, region_key, shard_name
+    router = get_shard_router()
+    loads = defaultdict(int)
+    donor_counts = db.session.query(User.state, func.count(User.id)).filter(User.role == 'user').group_by(User.state)
+    for state, count in donor_counts:
+        loads[region_key(state)] += count
+    for model in (BloodUsage, Donation):
+        activity_counts = db.session.query(Hospital.state, func.count(model.id))\
+            .join(Hospital, Hospital.id == model.hospital_id).group_by(Hospital.state)
+        for state, count in activity_counts:
+            loads[region_key(state)] += count
+    plan = plan_shards(loads, max_shards)
+
+    started = datetime.utcnow()
+    db.session.commit()
+
+    # Built into a new generation while the current one keeps serving reads
+    generation = router.next_generation()
+    copied = {}
+    with db.engine.connect() as connection:
+        for table in SHARD_MODELS:
+            rows_by_shard, copied[table] = defaultdict(list), 0
+            for state, row in iter_shard_rows(connection, table):
+                region = region_key(state)
+                rows_by_shard[plan.get(region) or shard_name(region)].append(row)
+                copied[table] += 1
+                if copied[table] % 10000 == 0:
+                    router.write(table, rows_by_shard, generation=generation)
+                    rows_by_shard = defaultdict(list)
+            router.write(table, rows_by_shard, generation=generation)
+    router.activate(generation, plan)
+
+    # Workers stat the map on every shard call; wait until writes begun under the old map are done
+    grace_seconds = app.config['SHARD_SWITCH_GRACE_SECONDS'] if grace_seconds is None else grace_seconds
+    time.sleep(grace_seconds)
+    # By updated_at, not id: a lower id may commit after a higher one. The overlap covers
+    # transactions that set updated_at just before the copy started but committed after it.
+    changed_since = started - SNAPSHOT_SYNC_OVERLAP
+    for table, model in SHARD_MODELS.items():
+        with db.engine.connect() as connection:
+            changed = [row_id for (row_id,) in
+                       connection.execute(select(model.id).where(model.updated_at >= changed_since))]
+        if changed:
+            sync_shard_table(table, model.id.in_(changed), changed)
+    router.drop_old_generations()
+    return plan, copied
+
+# Columnar snapshot of verified donors for search and emergency matching (see donor_snapshot.py).
+# Each process keeps its own; when another process changed donors, only the donors
+# updated since the last sync are read again.
+_donor_snapshot = None
+donor_snapshot_lock = threading.Lock()
+SNAPSHOT_COLUMNS = (User.id, User.blood_group, User.city, User.state, User.pincode, User.next_eligible_at,
+                    User.is_verified_donor)
+# Re-read overlap, so a transaction committed slightly after its updated_at was set is not missed
+SNAPSHOT_SYNC_OVERLAP = timedelta(seconds=60)
+
+def donor_snapshot_enabled():
+    # The snapshot is loaded from the main database, so by default region shards win and
+    # serve donor search themselves; DONOR_SNAPSHOT=1 puts the snapshot in front of them
+    setting = app.config['DONOR_SNAPSHOT']
+    return app.config['PARTITIONING'] != 'state' if setting is None else setting
+
+def get_donor_snapshot():
+    """The verified-donor snapshot, up to date with all committed changes; None when disabled."""
+    global _donor_snapshot
+    if not donor_snapshot_enabled():
+        return None
+    with donor_snapshot_lock:
+        versions = get_data_versions('donors', 'donations')
+        snapshot = _donor_snapshot
+        if snapshot is not None and snapshot.versions == versions:
+            return snapshot
+        started = datetime.utcnow()
+        query = db.session.query(*SNAPSHOT_COLUMNS).filter(User.role == 'user')
+        if snapshot is None:
+            from donor_snapshot import DonorSnapshot  # NumPy is only loaded once donors are searched
+            snapshot = DonorSnapshot()
+            snapshot.load(query.filter(User.is_verified_donor.is_(True)).yield_per(50000))
+        else:
+            snapshot.apply(query.filter(User.updated_at >= snapshot.synced_at - SNAPSHOT_SYNC_OVERLAP).all())
+        snapshot.versions = versions
+        snapshot.synced_at = started
+        _donor_snapshot = snapshot
+        return snapshot
+
+def patch_donor_snapshot(donor):
+    """Apply a donor change committed by this request, without re-reading other donors."""
+    if _donor_snapshot is None:
+        return
+    with donor_snapshot_lock:
+        _donor_snapshot.apply([tuple(getattr(donor, column.key) for column in SNAPSHOT_COLUMNS)])
+        # Only our own write happened since the last sync, so the snapshot is current again
+        expected = (_donor_snapshot.versions[0] + 1,) + _donor_snapshot.versions[1:]
+        if get_data_versions('donors', 'donations') == expected:
+            _donor_snapshot.versions = expected
+
+def load_donors(ids, chunk_size=10000):
+    # Ids come sorted; chunked to stay under SQLite's bound parameter limit
+    ids = [int(donor_id) for donor_id in ids]
+    donors = []
+    for start in range(0, len(ids), chunk_size):
+        donors.extend(User.query.filter(User.id.in_(ids[start:start + chunk_size])).order_by(User.id).all())
+    return donors
+
+def search_verified_donors(blood_group='', city='', state='', eligible_only=False):
+    """Verified donors for the hospital dashboard search.
+
+    Matched in the donor snapshot when it is enabled, else in the region shards
+    when partitioning is on, else in the main database. Partitioning turns the
+    snapshot off unless DONOR_SNAPSHOT=1 is set explicitly.
+    """
+    snapshot = get_donor_snapshot()
+    if snapshot is not None:
+        return load_donors(snapshot.match([blood_group] if blood_group else None, city, state,
+                                          eligible_at=datetime.utcnow() if eligible_only else None))
+    router = get_shard_router()
+    if router:
+        return router.search_donors(blood_group, city, state, datetime.utcnow() if eligible_only else None)
+    donor_query = filter_verified_donors(User.query, blood_group, city, state)
+    if eligible_only:
+        donor_query = donor_query.filter(eligible_now_filter())
+    return donor_query.all()
+
+def filter_verified_donors(query, blood_group='', city='', state=''):
+    query = query.filter(User.role == 'user', User.is_verified_donor.is_(True))
+    if blood_group:
+        query = query.filter(User.blood_group == blood_group)
+    if city:
+        query = query.filter(User.city.ilike(f'%{city}%'))
+    if state:
+        query = query.filter(User.state.ilike(f'%{state}%'))
+    return query
+
+def next_eligibility_change(now, blood_group='', city='', state=''):
+    """When the next verified donor matching the search becomes eligible again, or None."""
+    return filter_verified_donors(db.session.query(func.min(User.next_eligible_at)), blood_group, city, state)\
+        .filter(User.next_eligible_at > now).scalar()
+
+# Archived history (see archive.py). Usage and donation records older than
+# ARCHIVE_AFTER_DAYS are moved into compressed chunks so the hot tables stay small.
+# Pages show hot records by default and read archived ones on request; forecasting
+# and rollup rebuilds read both.
+ARCHIVE_MODELS = {'usage': BloodUsage, 'donation': Donation}
+ARCHIVE_DATA_VERSIONS = {'usage': 'usage', 'donation': 'donations'}
+
+def load_archived(kind, hospital_id=None, donor_id=None, after_id=0):
+    """Archived records of a hospital and/or donor with ids above after_id, in id order."""
+    from archive import unpack_chunk
+    query = db.session.query(ArchiveChunk.payload)\
+        .filter(ArchiveChunk.kind == kind, ArchiveChunk.last_id > after_id)
+    if hospital_id is not None:
+        query = query.filter(ArchiveChunk.hospital_id == hospital_id)
+    if donor_id is not None:
+        query = query.join(ArchiveChunkDonor, ArchiveChunkDonor.chunk_id == ArchiveChunk.id)\
+            .filter(ArchiveChunkDonor.donor_id == donor_id)
+    records = []
+    for (payload,) in query.order_by(ArchiveChunk.first_id):
+        records.extend(record for record in unpack_chunk(kind, payload)
+                       if record.id > after_id and (donor_id is None or record.donor_id == donor_id))
+    records.sort(key=lambda record: record.id)
+    return records
+
+def iter_archived(kind, chunk_size=50):
+    """Every archived record of a kind, one decompressed chunk at a time."""
+    from archive import unpack_chunk
+    chunks = db.session.query(ArchiveChunk.payload).filter(ArchiveChunk.kind == kind)\
+        .order_by(ArchiveChunk.id).yield_per(chunk_size)
+    for (payload,) in chunks:
+        yield unpack_chunk(kind, payload)
+
+def count_archived(kind, hospital_id=None, donor_id=None):
+    # Counts are kept next to the chunks, nothing is decompressed
+    if donor_id is not None:
+        return db.session.query(func.coalesce(func.sum(ArchiveChunkDonor.row_count), 0))\
+            .filter(ArchiveChunkDonor.donor_id == donor_id, ArchiveChunkDonor.kind == kind).scalar()
+    query = db.session.query(func.coalesce(func.sum(ArchiveChunk.row_count), 0)).filter(ArchiveChunk.kind == kind)
+    if hospital_id is not None:
+        query = query.filter(ArchiveChunk.hospital_id == hospital_id)
+    return query.scalar()
+
+def donor_blood_groups(donor_ids, chunk_size=10000):
+    donor_ids = list(donor_ids)
+    groups = {}
+    for start in range(0, len(donor_ids), chunk_size):
+        groups.update(db.session.query(User.id, User.blood_group)
+                      .filter(User.id.in_(donor_ids[start:start + chunk_size])).all())
+    return groups
+
+def with_hospital_names(records):
+    """Archived records with `hospital` set, for templates that show record.hospital.name."""
+    hospital_ids = {record.hospital_id for record in records}
+    if not hospital_ids:
+        return records
+    hospitals = {hospital.id: hospital for hospital in
+                 Hospital.query.filter(Hospital.id.in_(hospital_ids)).options(load_only(Hospital.name))}
+    return [record._replace(hospital=hospitals.get(record.hospital_id)) for record in records]
+
+def archive_records(kind, cutoff, batch_size=None):
+    """Move records dated before cutoff into archive chunks, one batch per transaction.
+
+    Each batch is a short write transaction (insert chunks, delete the
+    originals), so pages and other writers are only blocked briefly. Returns
+    the number of records moved.
+    """
+    from archive import KINDS, pack_chunk
+    model = ARCHIVE_MODELS[kind]
+    batch_size = batch_size or app.config['ARCHIVE_BATCH_SIZE']
+    columns = [getattr(model, name) for name in KINDS[kind][0]]
+    router = get_shard_router()
+    moved, last_seen = 0, 0
+    while True:
+        # Keyset pagination on the primary key; old records have the lowest ids
+        rows = db.session.query(*columns).filter(model.id > last_seen, model.date < cutoff)\
+            .order_by(model.id).limit(batch_size).all()
+        if not rows:
+            return moved
+        last_seen = rows[-1].id
+        by_hospital = defaultdict(list)
+        for row in rows:
+            by_hospital[row.hospital_id].append(row)
+        # Compress before the first write, so the write lock is only held for the inserts and deletes
+        chunks, donor_counts = [], []
+        for hospital_id, chunk_rows in by_hospital.items():
+            dates = [row.date for row in chunk_rows if row.date is not None]
+            chunks.append(ArchiveChunk(kind=kind, hospital_id=hospital_id, first_id=chunk_rows[0].id,
+                                       last_id=chunk_rows[-1].id, first_date=min(dates, default=None),
+                                       last_date=max(dates, default=None), row_count=len(chunk_rows),
+                                       payload=pack_chunk(chunk_rows)))
+            counts = defaultdict(int)
+            for row in chunk_rows:
+                counts[row.donor_id] += 1
+            donor_counts.append(counts)
+        db.session.add_all(chunks)
+        db.session.flush()
+        db.session.execute(ArchiveChunkDonor.__table__.insert(), [
+            {'chunk_id': chunk.id, 'donor_id': donor_id, 'kind': kind, 'row_count': count}
+            for chunk, counts in zip(chunks, donor_counts) for donor_id, count in counts.items()])
+
+        ids = [row.id for row in rows]
+        if kind == 'donation':
+            # Their units are past even the longest shelf life, archive-history checks the horizon
+            BloodUnit.query.filter(BloodUnit.donation_id.in_(ids)).delete(synchronize_session=False)
+        else:
+            BloodUnit.query.filter(BloodUnit.usage_id.in_(ids))\
+                .update({BloodUnit.usage_id: None}, synchronize_session=False)
+        model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        moved += len(rows)
+        bump_data_version(ARCHIVE_DATA_VERSIONS[kind])
+        if router:
+            try:
+                router.write(SHARD_TABLES[model], {}, ids)
+            except Exception:
+                app.logger.exception('Removing archived records from region shards failed; run `flask rebalance-shards`')
+
+def find_duplicate_donors(donor):
+    """[(reason, other)] for existing donors matching `donor` (see dedup.match_reason), phone matches first.
+
+    Fills in the donor's keys first, so it also works for a donor that is not saved yet.
+    """
+    from dedup import MAX_BLOCK_SIZE, donor_keys, match_reason
+    donor.phone_key, donor.name_key, donor.name_soundex = donor_keys(donor.name, donor.contact_number)
+    blocks = []
+    if donor.phone_key:
+        blocks.append(User.phone_key == donor.phone_key)
+    if donor.name_soundex:
+        blocks.append(and_(User.pincode == donor.pincode, User.name_soundex == donor.name_soundex))
+    if not blocks:
+        return []
+    query = User.query.filter(User.role == 'user', or_(*blocks))
+    if donor.id is not None:
+        query = query.filter(User.id != donor.id)
+    matches = []
+    for other in query.order_by(User.id).limit(MAX_BLOCK_SIZE):
+        reason = match_reason(donor, other)
+        if reason:
+            matches.append((reason, other))
+    return sorted(matches, key=lambda match: match[0] != 'phone')
+
+def backfill_donor_keys(chunk_size=10000):
+    """Fill in dedup keys for donors inserted without the ORM (imports, benchmark seeds); returns the count."""
+    from dedup import donor_keys
+    filled = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(User.id, User.name, User.contact_number)\
+            .filter(User.role == 'user', User.name_key.is_(None), User.id > last_id)\
+            .order_by(User.id).limit(chunk_size).all()
+        if not rows:
+            return filled
+        mappings = []
+        for user_id, name, contact_number in rows:
+            phone_key, name_key, name_soundex = donor_keys(name, contact_number)
+            mappings.append({'id': user_id, 'phone_key': phone_key, 'name_key': name_key, 'name_soundex': name_soundex})
+        db.session.bulk_update_mappings(User, mappings)
+        db.session.commit()
+        filled += len(rows)
+        last_id = rows[-1].id
+
+def dedup_donors(dry_run=False):
+    """Flag possible duplicates among all donors, one block of candidates at a time.
+
+    Blocks are donors sharing a phone key or a (pincode, name soundex) pair, read
+    through their indexes; only pairs inside a block are compared. Matching donors
+    are grouped, and every donor of a group except the canonical one (verified
+    first, then the oldest account) gets possible_duplicate_of_id set.
+    Returns (backfilled, groups, flagged).
+    """
+    from itertools import groupby
+    from dedup import MAX_BLOCK_SIZE, match_reason
+    backfilled = 0 if dry_run else backfill_donor_keys()
+    columns = load_only(User.id, User.phone_key, User.name_key, User.name_soundex, User.pincode,
+                        User.blood_group, User.is_verified_donor, User.possible_duplicate_of_id)
+    parent = {}
+
+    def find(donor_id):
+        while parent.get(donor_id, donor_id) != donor_id:
+            donor_id = parent[donor_id]
+        return donor_id
+
+    donors = {}
+    for key_columns in ((User.phone_key,), (User.pincode, User.name_soundex)):
+        blocks = db.session.query(*key_columns)\
+            .filter(User.role == 'user', *(column != '' for column in key_columns))\
+            .group_by(*key_columns)\
+            .having(func.count(User.id).between(2, MAX_BLOCK_SIZE)).subquery()
+        members = User.query.options(columns).filter(User.role == 'user')\
+            .join(blocks, and_(*(column == blocks.c[column.key] for column in key_columns)))\
+            .order_by(*key_columns, User.id).yield_per(10000)
+        for _, block in groupby(members, key=lambda donor: tuple(getattr(donor, column.key) for column in key_columns)):
+            block = list(block)
+            for i, donor in enumerate(block):
+                for other in block[i + 1:]:
+                    if match_reason(donor, other):
+                        donors[donor.id], donors[other.id] = donor, other
+                        parent[find(other.id)] = find(donor.id)
+
+    groups = defaultdict(list)
+    for donor_id, donor in donors.items():
+        groups[find(donor_id)].append(donor)
+    flagged = 0
+    for group in groups.values():
+        canonical = min(group, key=lambda donor: (not donor.is_verified_donor, donor.id))
+        for donor in group:
+            if donor is not canonical and donor.possible_duplicate_of_id != canonical.id:
+                flagged += 1
+                if not dry_run:
+                    User.query.filter_by(id=donor.id)\
+                        .update({User.possible_duplicate_of_id: canonical.id}, synchronize_session=False)
+    if flagged and not dry_run:
+        db.session.commit()
+        bump_data_version('donors')
+    else:
+        db.session.rollback()
+    return backfilled, len(groups), flagged
+
 # Routes
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/sw.js')
+def service_worker():
+    # Served from the root so the worker's scope covers the whole site, not just /static/.
+    # The asset manifest is prepended, so every asset build changes the worker and busts its caches.
+    with open(os.path.join(app.static_folder, 'sw.js'), encoding='utf-8') as f:
+        source = f.read()
+    prelude = 'self.ASSET_MANIFEST = %s;\nself.ASSET_VERSION = %s;\n' % (
+        json.dumps(asset_manifest['files']), json.dumps(asset_manifest['version']))
+    response = app.response_class(prelude + source, mimetype='application/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Service-Worker-Allowed'] = '/'
+    return response
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -731,8 +2076,24 @@ def register():
             flash('Email already registered. Please login instead.', 'error')
             return redirect(url_for('register'))
         
+        user = User(
+            name=name, age=age, gender=gender, blood_group=blood_group,
+            city=city, state=state, pincode=pincode, contact_number=contact_number,
+            diseases=diseases, email=email, test_hospital_name=test_hospital_name
+        )
+        
+        # The same person under another email: refuse on a phone match, flag a name match for review
+        # The message says nothing about the matched donor; hospitals see the details on review
+        duplicates = find_duplicate_donors(user)
+        if duplicates and duplicates[0][0] == 'phone':
+            app.logger.info('Registration refused as a possible duplicate of donor %s', duplicates[0][1].id)
+            flash('This registration looks like a possible duplicate of an existing donor account. '
+                  'Please login with your existing account, or ask a hospital to review it.', 'error')
+            return redirect(url_for('register'))
+        if duplicates:
+            user.possible_duplicate_of_id = duplicates[0][1].id
+        
         # Handle file upload
-        blood_report_filename = None
         if 'blood_report' in request.files:
             file = request.files['blood_report']
             if file and file.filename != '' and allowed_file(file.filename):
@@ -740,21 +2101,15 @@ def register():
                 filename = str(uuid.uuid4()) + '.' + file.filename.rsplit('.', 1)[1].lower()
                 file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
                 file.save(os.path.join(app.root_path, file_path))
-                blood_report_filename = filename
+                user.blood_report_filename = filename
+                user.report_submitted_at = datetime.utcnow()
         
         # Create new user
-        password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
-        user = User(
-            name=name, age=age, gender=gender, blood_group=blood_group,
-            city=city, state=state, pincode=pincode, contact_number=contact_number,
-            diseases=diseases, email=email, password_hash=password_hash,
-            test_hospital_name=test_hospital_name,
-            blood_report_filename=blood_report_filename,
-            report_submitted_at=datetime.utcnow() if blood_report_filename else None
-        )
-        
+        user.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
         db.session.add(user)
+        add_outbox_event('donor.registered', 'donors', user)
         db.session.commit()
+        bump_data_version('donors')
         
         flash('Registration successful! Please login.', 'success')
         return redirect(url_for('login'))
@@ -848,22 +2203,41 @@ def dashboard():
     if current_user.role == 'hospital':
         return redirect(url_for('hospital_dashboard'))
     
-    # Get blood usage stats for the user
-    usage_records = BloodUsage.query.filter_by(donor_id=current_user.id).all()
-    usage_count = len(usage_records)
+    # Archived records (older than ARCHIVE_AFTER_DAYS) are only listed on request
+    include_archived = request.args.get('archived') == '1'
+
+    # Get blood usage stats and the rendered history for the user
+    def render_usage_history():
+        # The hospital name is joined in, not lazy loaded once per row
+        usage_records = BloodUsage.query.filter_by(donor_id=current_user.id)\
+                         .options(joinedload(BloodUsage.hospital).load_only(Hospital.name)).all()
+        archived_count = count_archived('usage', donor_id=current_user.id)
+        if include_archived and archived_count:
+            usage_records = sorted(with_hospital_names(load_archived('usage', donor_id=current_user.id))
+                                   + usage_records, key=lambda record: record.id)
+        html = render_template('fragments/usage_history.html', usage_records=usage_records,
+                               archived_count=0 if include_archived else archived_count)
+        return html, {
+            'usage_count': len(usage_records) + (0 if include_archived else archived_count),
+            'last_usage_date': usage_records[-1].date if usage_records else None,
+        }
+
+    usage_history_html, usage_meta = fragment_cache.get_or_render(
+        ('usage_history', current_user.id, get_language(), include_archived, get_data_versions('usage')),
+        render_usage_history)
 
     # Get donation stats for the user
-    donation_records = Donation.query.filter_by(donor_id=current_user.id).order_by(Donation.date.desc()).all()
-    donation_count = len(donation_records)
+    donation_count = Donation.query.filter_by(donor_id=current_user.id).count() \
+        + count_archived('donation', donor_id=current_user.id)
     
     # Check if report is still pending
     report_pending = is_report_pending(current_user)
     
     return render_template('dashboard.html', 
                           user=current_user, 
-                          usage_records=usage_records, 
-                          usage_count=usage_count,
-                          donation_records=donation_records,
+                          usage_history_html=usage_history_html,
+                          usage_count=usage_meta['usage_count'],
+                          last_usage_date=usage_meta['last_usage_date'],
                           donation_count=donation_count,
                           report_pending=report_pending)
 
@@ -887,6 +2261,8 @@ def edit_profile():
         current_user.test_hospital_name = request.form['test_hospital_name']
         
         db.session.commit()
+        bump_data_version('donors')
+        patch_donor_snapshot(current_user)
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('dashboard'))
     
@@ -913,6 +2289,7 @@ def remove_report():
         current_user.report_status = 'pending'
         
         db.session.commit()
+        bump_data_version('donors')
         flash('Blood test report removed successfully!', 'success')
     else:
         flash('Report cannot be removed at this time.', 'error')
@@ -930,42 +2307,116 @@ def hospital_dashboard():
     blood_group = request.args.get('blood_group', '')
     city = request.args.get('city', '')
     state = request.args.get('state', '')
+    eligible_only = request.args.get('eligible') == '1'
+    include_archived = request.args.get('archived') == '1'
     
-    # Build query - only show verified donors
-    donor_query = User.query.filter_by(role='user', is_verified_donor=True)
-    if blood_group:
-        donor_query = donor_query.filter(User.blood_group == blood_group)
-    if city:
-        donor_query = donor_query.filter(User.city.ilike(f'%{city}%'))
-    if state:
-        donor_query = donor_query.filter(User.state.ilike(f'%{state}%'))
-    donors = donor_query.all()
+    lang = get_language()
+
+    def render_verified_donors():
+        # Only verified donors
+        now = datetime.utcnow()
+        donors = search_verified_donors(blood_group, city, state, eligible_only)
+        # Eligibility badges (and the eligible-only list) change once a waiting period ends,
+        # so the cached table expires then. Donors still waiting are not listed with eligible_only.
+        if eligible_only:
+            expires_at = next_eligibility_change(now, blood_group, city, state)
+        else:
+            expires_at = min((donor.next_eligible_at for donor in donors
+                              if donor.next_eligible_at and donor.next_eligible_at > now), default=None)
+
+        router = get_shard_router()
+        if router:
+            usage_records, donation_records = router.hospital_activity(current_user.state, current_user.id)
+        else:
+            # Get ALL blood usage records for this hospital (not just 20), only the columns the table shows
+            usage_records = BloodUsage.query.filter_by(hospital_id=current_user.id)\
+                             .options(load_only(BloodUsage.donor_id, BloodUsage.date, BloodUsage.blood_units,
+                                                BloodUsage.usage_type, BloodUsage.notes))\
+                             .order_by(BloodUsage.date.desc()).all()
+            donation_records = Donation.query.filter_by(hospital_id=current_user.id)\
+                             .options(load_only(Donation.donor_id, Donation.date, Donation.donation_units,
+                                                Donation.donation_type, Donation.notes)).all()
+
+        # Records older than ARCHIVE_AFTER_DAYS are decompressed only when asked for
+        archived_usage = count_archived('usage', hospital_id=current_user.id)
+        archived_donations = count_archived('donation', hospital_id=current_user.id)
+        if include_archived:
+            usage_records = sorted(list(usage_records) + load_archived('usage', hospital_id=current_user.id),
+                                   key=lambda record: record.date or datetime.min, reverse=True)
+            donation_records = list(donation_records) + load_archived('donation', hospital_id=current_user.id)
+            archived_usage = archived_donations = 0
+
+        # Grouped once here; filtering the full lists per donor in the template is donors x records
+        usage_by_donor = defaultdict(list)
+        for record in usage_records:
+            usage_by_donor[record.donor_id].append(record)
+        donations_by_donor = defaultdict(list)
+        for record in donation_records:
+            donations_by_donor[record.donor_id].append(record)
 
-    # Pending approvals logic - Show ALL pending donors to ANY hospital
-    # This way, any hospital can approve any donor, regardless of hospital name entered during registration
-    pending_query = User.query.filter(
-        User.role == 'user',
-        User.report_status == 'pending'
-    )
-    pending_approvals = pending_query.all()
-    
-    # Get unique blood groups for filter dropdown (from verified donors only)
         # Get unique blood groups for filter dropdown (from verified donors only)
-    blood_groups = db.session.query(User.blood_group).filter_by(role='user', is_verified_donor=True).distinct().all()
-    blood_groups = [bg[0] for bg in blood_groups]
+        if router:
+            blood_groups = router.verified_blood_groups()
+        else:
+            blood_groups = db.session.query(User.blood_group).filter_by(role='user', is_verified_donor=True).distinct().all()
+            blood_groups = [bg[0] for bg in blood_groups]
+
+        html = render_template('fragments/verified_donors.html',
+                               donors=donors,
+                               now=now,
+                               usage_by_donor=usage_by_donor,   # ← this line records the usage of blood and shows in hospital dashboard
+                               donations_by_donor=donations_by_donor)
+        return html, {
+            'donor_count': len(donors),
+            'usage_count': len(usage_records) + archived_usage,
+            'donation_count': len(donation_records) + archived_donations,
+            'archived_count': archived_usage + archived_donations,
+            'blood_groups': blood_groups,
+            'expires_at': expires_at,
+        }
 
-    # Get ALL blood usage records for this hospital (not just 20)
-    usage_records = BloodUsage.query.filter_by(hospital_id=current_user.id)\
-                     .order_by(BloodUsage.date.desc()).all()
+    def render_pending_approvals():
+        # Pending approvals logic - Show ALL pending donors to ANY hospital
+        # This way, any hospital can approve any donor, regardless of hospital name entered during registration
+        # The donor each one may duplicate comes from the same query; only hospitals see it
+        original = aliased(User)
+        rows = db.session.query(User, original)\
+            .outerjoin(original, original.id == User.possible_duplicate_of_id)\
+            .filter(User.role == 'user', User.report_status == 'pending').all()
+        pending_approvals = [donor for donor, _ in rows]
+        from dedup import match_reason
+        duplicates = {donor.id: (duplicate, match_reason(donor, duplicate))
+                      for donor, duplicate in rows if duplicate is not None}
+        html = render_template('fragments/pending_approvals.html', pending_approvals=pending_approvals,
+                               duplicates=duplicates)
+        return html, {'pending_count': len(pending_approvals)}
+
+    verified_donors_html, donors_meta = fragment_cache.get_or_render(
+        ('verified_donors', current_user.id, blood_group, city, state, eligible_only, include_archived, lang,
+         get_data_versions('donors', 'usage', 'donations')),
+        render_verified_donors)
+    pending_approvals_html, pending_meta = fragment_cache.get_or_render(
+        ('pending_approvals', lang, get_data_versions('donors')),
+        render_pending_approvals)
+
+    from forecasting import shortage_warnings
+    forecast = get_hospital_forecast(current_user.id)
 
     return render_template('hospital_dashboard.html',
-                          donors=donors,
-                          blood_groups=blood_groups,
+                          shortage_warnings=shortage_warnings(forecast),
+                          verified_donors_html=verified_donors_html,
+                          pending_approvals_html=pending_approvals_html,
+                          blood_groups=donors_meta['blood_groups'],
                           search_blood_group=blood_group,
                           search_city=city,
                           search_state=state,
-                          pending_approvals=pending_approvals,
-                          usage_records=usage_records)   # ← this line records the usage of blood and shows in hospital dashboard
+                          search_eligible=eligible_only,
+                          search_archived=include_archived,
+                          archived_count=donors_meta['archived_count'],
+                          donor_count=donors_meta['donor_count'],
+                          pending_count=pending_meta['pending_count'],
+                          usage_count=donors_meta['usage_count'],
+                          donation_count=donors_meta['donation_count'])
     
     
 @app.route('/hospital/approve_donor/<int:donor_id>', methods=['POST'])
@@ -987,8 +2438,12 @@ def approve_donor(donor_id):
         donor.report_status = 'rejected'
         donor.is_verified_donor = False
         flash(f'Donor {donor.name} has been rejected.', 'warning')
+    if action in ('approve', 'reject'):
+        add_outbox_event('donor.approved' if action == 'approve' else 'donor.rejected', 'donors', donor)
     
     db.session.commit()
+    bump_data_version('donors')
+    patch_donor_snapshot(donor)
     return redirect(url_for('hospital_dashboard'))
 
 @app.route('/hospital/usage/new')
@@ -1015,19 +2470,22 @@ def new_usage():
                            donor=donor,
                            usage_exists=usage_exists,
                            today=today,
-                           now_time=now_time)
+                           now_time=now_time,
+                           idempotency_key=str(uuid.uuid4()),
+                           account_tag=account_tag())
 @app.route('/hospital/usage/create', methods=['POST'])
 @login_required
 def create_usage():
     if current_user.role != 'hospital':
-        flash('Access denied', 'error')
-        return redirect(url_for('dashboard'))
+        return record_outcome(403, ('Access denied', 'error'), endpoint='dashboard')
+    if not submitted_by_current_account():
+        return record_outcome(409, ('This record was entered while another account was signed in and was not saved.',
+                                    'error'))
    
     # Get and clean form data
     donor_id = request.form.get('donor_id')
     if not donor_id:
-        flash('Donor not found', 'error')
-        return redirect(url_for('hospital_dashboard'))
+        return record_outcome(400, ('Donor not found', 'error'))
 
     blood_units = request.form.get('blood_units', '').strip()
     usage_type = request.form.get('usage_type', '').strip()
@@ -1039,8 +2497,14 @@ def create_usage():
     try:
         usage_datetime = datetime.strptime(f"{usage_date} {usage_time}", "%Y-%m-%d %H:%M")
     except (ValueError, TypeError):
-        flash('Invalid date or time', 'error')
-        return redirect(url_for('hospital_dashboard'))
+        return record_outcome(400, ('Invalid date or time', 'error'))
+
+    # A replayed submit (double click, offline queue) must not create a second record
+    idempotency_key = get_idempotency_key()
+    if idempotency_key and BloodUsage.query.filter_by(idempotency_key=idempotency_key).first():
+        return record_outcome(200, ('Blood usage record was already saved.', 'info'))
+
+    donor = User.query.get_or_404(donor_id)
 
     # Save with ALL fields
     usage = BloodUsage(
@@ -1049,13 +2513,31 @@ def create_usage():
         blood_units=blood_units if blood_units else None,
         usage_type=usage_type if usage_type else None,
         notes=notes if notes else None,
-        date=usage_datetime
+        date=usage_datetime,
+        idempotency_key=idempotency_key
     )
     db.session.add(usage)
-    db.session.commit()
-   
-    flash('Blood usage record created successfully!', 'success')
-    return redirect(url_for('hospital_dashboard'))
+    try:
+        # Both flush the new row, so a duplicate idempotency key already fails here
+        record_rollup('usage', current_user, donor.blood_group, usage.usage_type, usage.blood_units, usage_datetime)
+        add_outbox_event('usage.created', 'usages', usage, hospital_id=current_user.id)
+        allocated, requested = allocate_units(usage, donor.blood_group)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # Units popped from the heaps were not used after all; the stock is reloaded on the next request
+        inventory_stock.pop(current_user.id, None)
+        if not isinstance(e, IntegrityError):
+            raise
+        # Lost the race against a concurrent replay of the same submit
+        return record_outcome(200, ('Blood usage record was already saved.', 'info'))
+    bump_data_version('usage')
+
+    messages = [('Blood usage record created successfully!', 'success')]
+    if allocated < requested:
+        messages.append((f'Only {allocated} of {requested} {donor.blood_group} units were in stock; '
+                         f'the rest were not taken from inventory.', 'warning'))
+    return record_outcome(201, *messages)
 
 @app.route('/hospital/donation/new')
 @login_required
@@ -1086,19 +2568,22 @@ def new_donation():
                            donor=donor,
                            donation_exists=donation_exists,
                            today=today,
-                           now_time=now_time)
+                           now_time=now_time,
+                           idempotency_key=str(uuid.uuid4()),
+                           account_tag=account_tag())
 
 @app.route('/hospital/donation/create', methods=['POST'])
 @login_required
 def create_donation():
     if current_user.role != 'hospital':
-        flash('Access denied', 'error')
-        return redirect(url_for('dashboard'))
+        return record_outcome(403, ('Access denied', 'error'), endpoint='dashboard')
+    if not submitted_by_current_account():
+        return record_outcome(409, ('This record was entered while another account was signed in and was not saved.',
+                                    'error'))
 
     donor_id = request.form.get('donor_id')
     if not donor_id:
-        flash('Donor not found', 'error')
-        return redirect(url_for('hospital_dashboard'))
+        return record_outcome(400, ('Donor not found', 'error'))
 
     donation_units = request.form.get('donation_units', '').strip()
     donation_type = request.form.get('donation_type', '').strip()
@@ -1109,8 +2594,13 @@ def create_donation():
     try:
         donation_datetime = datetime.strptime(f"{donation_date} {donation_time}", "%Y-%m-%d %H:%M")
     except (ValueError, TypeError):
-        flash('Invalid date or time', 'error')
-        return redirect(url_for('hospital_dashboard'))
+        return record_outcome(400, ('Invalid date or time', 'error'))
+
+    idempotency_key = get_idempotency_key()
+    if idempotency_key and Donation.query.filter_by(idempotency_key=idempotency_key).first():
+        return record_outcome(200, ('Donation record was already saved.', 'info'))
+
+    donor = User.query.get_or_404(donor_id)
 
     donation = Donation(
         donor_id=donor_id,
@@ -1118,13 +2608,22 @@ def create_donation():
         donation_units=donation_units if donation_units else None,
         donation_type=donation_type if donation_type else None,
         notes=notes if notes else None,
-        date=donation_datetime
+        date=donation_datetime,
+        idempotency_key=idempotency_key
     )
     db.session.add(donation)
-    db.session.commit()
+    update_next_eligible_at(donor, donation.donation_type, donation_datetime)
+    try:
+        record_rollup('donation', current_user, donor.blood_group, donation.donation_type, donation.donation_units, donation_datetime)
+        add_outbox_event('donation.created', 'donations', donation, hospital_id=current_user.id)
+        add_inventory_units(donation, donor.blood_group)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return record_outcome(200, ('Donation record was already saved.', 'info'))
+    bump_data_version('donations', 'donors')
 
-    flash('Donation record created successfully!', 'success')
-    return redirect(url_for('hospital_dashboard'))
+    return record_outcome(201, ('Donation record created successfully!', 'success'))
 
 @app.route('/api/chatbot', methods=['POST'])
 @login_required
@@ -1141,7 +2640,7 @@ def chatbot_api():
     }
     user_context.update(context)
     
-    reply = chatbot.send(message, user_context)
+    reply = get_chatbot().send(message, user_context)
     
     return jsonify({'reply': reply})
 
@@ -1158,9 +2657,11 @@ def dashboard_stats():
             User.report_status == 'pending'
         ).count()
 
-        blood_usage_count = BloodUsage.query.filter_by(hospital_id=current_user.id).count()
+        blood_usage_count = BloodUsage.query.filter_by(hospital_id=current_user.id).count() \
+            + count_archived('usage', hospital_id=current_user.id)
         
-        donation_count = Donation.query.filter_by(hospital_id=current_user.id).count()
+        donation_count = Donation.query.filter_by(hospital_id=current_user.id).count() \
+            + count_archived('donation', hospital_id=current_user.id)
         return jsonify({
             'total_donors': total_donors,
             'pending_approvals': pending_approvals,
@@ -1169,11 +2670,13 @@ def dashboard_stats():
         })
     else:
         # Donor stats
-        usage_count = BloodUsage.query.filter_by(donor_id=current_user.id).count()
+        usage_count = BloodUsage.query.filter_by(donor_id=current_user.id).count() \
+            + count_archived('usage', donor_id=current_user.id)
         is_verified = current_user.is_verified_donor
         report_status = current_user.report_status
         
-        donation_count = Donation.query.filter_by(donor_id=current_user.id).count()
+        donation_count = Donation.query.filter_by(donor_id=current_user.id).count() \
+            + count_archived('donation', donor_id=current_user.id)
         return jsonify({
             'usage_count': usage_count,
             'donation_count': donation_count,
@@ -1181,6 +2684,554 @@ def dashboard_stats():
             'report_status': report_status
         })
 
+@app.route('/api/forecast')
+@login_required
+def forecast_api():
+    if current_user.role != 'hospital':
+        return jsonify({'error': 'Access denied'}), 403
+    from forecasting import shortage_warnings
+    forecast = get_hospital_forecast(current_user.id)
+    return jsonify({'forecast': forecast, 'warnings': shortage_warnings(forecast)})
+
+@app.route('/api/inventory')
+@login_required
+def inventory_api():
+    if current_user.role != 'hospital':
+        return jsonify({'error': 'Access denied'}), 403
+    now = datetime.utcnow()
+    rows = db.session.query(BloodUnit.blood_group, BloodUnit.component, func.count(BloodUnit.id),
+                            func.count(BloodUnit.expiry_flagged_at), func.min(BloodUnit.expires_at))\
+        .filter(BloodUnit.hospital_id == current_user.id, BloodUnit.status == 'available', BloodUnit.expires_at > now)\
+        .group_by(BloodUnit.blood_group, BloodUnit.component)\
+        .order_by(BloodUnit.blood_group, BloodUnit.component).all()
+    return jsonify({'stock': [{
+        'blood_group': blood_group,
+        'component': component,
+        'units': units,
+        'expiring_soon': expiring_soon,
+        'next_expiry': next_expiry.isoformat(),
+    } for blood_group, component, units, expiring_soon, next_expiry in rows]})
+
+@app.route('/api/transfers')
+@login_required
+def transfers_api():
+    if current_user.role != 'hospital':
+        return jsonify({'error': 'Access denied'}), 403
+    suggestions = TransferSuggestion.query.filter(or_(TransferSuggestion.from_hospital_id == current_user.id,
+                                                      TransferSuggestion.to_hospital_id == current_user.id))\
+        .order_by(TransferSuggestion.blood_group, TransferSuggestion.id).all()
+    other_ids = {s.to_hospital_id if s.from_hospital_id == current_user.id else s.from_hospital_id for s in suggestions}
+    hospitals = {hospital.id: hospital for hospital in Hospital.query.filter(Hospital.id.in_(other_ids))
+                 .options(load_only(Hospital.name, Hospital.city, Hospital.state, Hospital.contact_number))}
+
+    def serialize(suggestion, other_id):
+        hospital = hospitals[other_id]
+        return {
+            'blood_group': suggestion.blood_group,
+            'units': suggestion.units,
+            'distance': suggestion.distance,
+            'hospital': {'id': hospital.id, 'name': hospital.name, 'city': hospital.city, 'state': hospital.state,
+                         'contact_number': hospital.contact_number},
+        }
+
+    return jsonify({
+        'generated_at': suggestions[0].created_at.isoformat() if suggestions else None,
+        'send': [serialize(s, s.to_hospital_id) for s in suggestions if s.from_hospital_id == current_user.id],
+        'receive': [serialize(s, s.from_hospital_id) for s in suggestions if s.to_hospital_id == current_user.id],
+    })
+
+# Regional analytics, answered from daily_rollups only (cost depends on days x hospitals x groups, not records)
+ANALYTICS_GROUP_COLUMNS = {
+    'state': DailyRollup.state,
+    'city': DailyRollup.city,
+    'hospital_id': DailyRollup.hospital_id,
+    'blood_group': DailyRollup.blood_group,
+    'record_type': DailyRollup.record_type,
+    'day': DailyRollup.day,
+}
+
+@app.route('/api/analytics/regional')
+@login_required
+def regional_analytics():
+    if current_user.role != 'hospital':
+        return jsonify({'error': 'Access denied'}), 403
+
+    kind = request.args.get('kind', 'donation')
+    if kind not in ('donation', 'usage'):
+        return jsonify({'error': 'kind must be "donation" or "usage"'}), 400
+    group_by = [g.strip() for g in request.args.get('group_by', 'state,blood_group').split(',') if g.strip()]
+    unknown = [g for g in group_by if g not in ANALYTICS_GROUP_COLUMNS]
+    if unknown:
+        return jsonify({'error': f"Unknown group_by: {', '.join(unknown)}"}), 400
+
+    # Defaults to the current month
+    today = datetime.utcnow().date()
+    try:
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if 'from' in request.args else today.replace(day=1)
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if 'to' in request.args else today
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+
+    columns = [ANALYTICS_GROUP_COLUMNS[g].label(g) for g in group_by]
+    query = db.session.query(*columns,
+                             func.sum(DailyRollup.record_count).label('records'),
+                             func.sum(DailyRollup.units).label('units'))\
+        .filter(DailyRollup.kind == kind, DailyRollup.day >= start, DailyRollup.day <= end)
+    for name in ('state', 'city', 'blood_group', 'record_type'):
+        value = request.args.get(name)
+        if value:
+            query = query.filter(ANALYTICS_GROUP_COLUMNS[name] == value)
+    if group_by:
+        query = query.group_by(*columns).order_by(*columns)
+
+    rows = [dict(row._mapping) for row in query.all()]
+    for row in rows:
+        if 'day' in row:
+            row['day'] = row['day'].isoformat()
+        row['units'] = round(row['units'] or 0.0, 2)
+    return jsonify({'kind': kind, 'from': start.isoformat(), 'to': end.isoformat(), 'rows': rows})
+
+@app.route('/api/fragment_cache_stats')
+@login_required
+def fragment_cache_stats():
+    if current_user.role != 'hospital':
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(fragment_cache.stats())
+
+# Emergency donor broadcast
+def get_notification_sender():
+    name = app.config['EMERGENCY_SENDER']
+    if name == 'webhook':
+        return SENDERS['webhook'](app.config['EMERGENCY_WEBHOOK_URL'], app.config['EMERGENCY_WEBHOOK_TOKEN'] or None)
+    return SENDERS[name]()
+
+def select_emergency_donors(emergency):
+    # Compatible, verified, currently eligible donors in the requested area; columns only
+    compatible = COMPATIBLE_DONORS.get(emergency.blood_group, [emergency.blood_group])
+    snapshot = get_donor_snapshot()
+    if snapshot is not None:
+        ids = [int(donor_id) for donor_id in snapshot.match(
+            compatible, state_exact=emergency.state, eligible_at=datetime.utcnow(),
+            city_exact=emergency.city if emergency.scope == 'city' else None)]
+        donors = []
+        for start in range(0, len(ids), 10000):
+            donors.extend(db.session.query(User.id, User.contact_number)
+                          .filter(User.id.in_(ids[start:start + 10000])).order_by(User.id).all())
+        return donors
+    query = db.session.query(User.id, User.contact_number).filter(
+        User.role == 'user',
+        User.is_verified_donor.is_(True),
+        User.blood_group.in_(compatible),
+        eligible_now_filter(),
+        func.lower(User.state) == emergency.state.lower(),
+    )
+    if emergency.scope == 'city':
+        query = query.filter(func.lower(User.city) == emergency.city.lower())
+    return query.all()
+
+def run_emergency_broadcast(emergency_id, sender=None):
+    emergency = db.session.get(EmergencyRequest, emergency_id)
+    sender = sender or get_notification_sender()
+    hospital = emergency.hospital
+    message = (f"URGENT: {hospital.name}, {hospital.city} needs {emergency.blood_group} blood"
+               f"{' (' + emergency.units + ' units)' if emergency.units else ''}. "
+               f"If you can donate, call {hospital.contact_number}. - BloodLink")
+
+    # A retry keeps the recipients chosen the first time and only sends what was not sent yet
+    retry = db.session.query(EmergencyNotification.id).filter_by(request_id=emergency.id).first() is not None
+    if retry:
+        emergency.failed_count = 0
+    else:
+        donors = select_emergency_donors(emergency)
+        rows = [{'request_id': emergency.id, 'donor_id': donor_id, 'channel': sender.channel,
+                 'recipient': contact_number, 'status': 'queued'} for donor_id, contact_number in donors]
+        if rows:
+            db.session.bulk_insert_mappings(EmergencyNotification, rows)
+        emergency.recipient_count = len(rows)
+    emergency.status = 'sending'
+    emergency.last_error = None
+    emergency.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+
+    notifications = [Notification(notification_id, recipient, message) for notification_id, recipient in
+                     db.session.query(EmergencyNotification.id, EmergencyNotification.recipient)
+                     .filter(EmergencyNotification.request_id == emergency.id,
+                             EmergencyNotification.status != 'sent').all()]
+    latencies = []
+
+    def record_batch(results):
+        # Runs in this thread, so the session is never shared with the pool workers
+        now = datetime.utcnow()
+        db.session.bulk_update_mappings(EmergencyNotification, [
+            {'id': r.notification_id, 'status': 'sent' if r.ok else 'failed',
+             'error': (r.error or '')[:255] or None, 'sent_at': now if r.ok else None}
+            for r in results])
+        sent = sum(1 for r in results if r.ok)
+        emergency.sent_count += sent
+        emergency.failed_count += len(results) - sent
+        emergency.heartbeat_at = now
+        latencies.extend(r.latency for r in results if r.ok)
+        db.session.commit()
+
+    # Workers share one bucket per channel so the provider's limit holds across processes
+    bucket = shared_state.token_bucket(f'channel:{sender.channel}', sender.rate_per_second,
+                                       max(sender.rate_per_second, sender.batch_size))
+    Broadcaster(sender, app.config['EMERGENCY_WORKERS'], bucket).broadcast(notifications, on_batch_done=record_batch)
+
+    emergency.status = 'completed'
+    emergency.completed_at = datetime.utcnow()
+    emergency.p95_notify_seconds = percentile(latencies, 95)
+    db.session.commit()
+    return emergency
+
+def broadcast_or_mark_failed(emergency_id):
+    """Run a broadcast; when it stops early, mark the request failed so it can be retried. Returns success."""
+    try:
+        run_emergency_broadcast(emergency_id)
+        return True
+    except Exception as e:
+        app.logger.exception('Emergency broadcast %s failed', emergency_id)
+        db.session.rollback()
+        emergency = db.session.get(EmergencyRequest, emergency_id)
+        emergency.status = 'failed'
+        emergency.last_error = (f'Stopped after notifying {emergency.sent_count or 0} of '
+                                f'{emergency.recipient_count or 0} donors: {e}')[:500]
+        db.session.commit()
+        return False
+
+def retryable_emergency_filter(now=None):
+    """Failed broadcasts, and queued or sending ones whose worker stopped reporting progress."""
+    stalled_before = (now or datetime.utcnow()) - timedelta(seconds=app.config['EMERGENCY_STALL_SECONDS'])
+    return or_(EmergencyRequest.status == 'failed',
+               and_(EmergencyRequest.status.in_(('queued', 'sending')),
+                    func.coalesce(EmergencyRequest.heartbeat_at, EmergencyRequest.created_at) < stalled_before))
+
+def claim_emergency_retry(emergency_id):
+    """Move a retryable request back to queued; False when it is not retryable or another retry won."""
+    claimed = db.session.execute(
+        update(EmergencyRequest)
+        .where(EmergencyRequest.id == emergency_id, retryable_emergency_filter())
+        .values(status='queued', heartbeat_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return claimed == 1
+
+def dispatch_emergency_broadcast(emergency_id):
+    if not app.config['EMERGENCY_DISPATCH_ASYNC']:
+        return broadcast_or_mark_failed(emergency_id)
+
+    def worker():
+        with app.app_context():
+            broadcast_or_mark_failed(emergency_id)
+    threading.Thread(target=worker, daemon=True).start()
+
+@app.route('/hospital/emergency', methods=['GET', 'POST'])
+@login_required
+def emergency_requests():
+    if current_user.role != 'hospital':
+        flash('Access denied', 'error')
+        return redirect(url_for('dashboard'))
+
+    if request.method == 'POST':
+        blood_group = request.form.get('blood_group', '')
+        if blood_group not in COMPATIBLE_DONORS:
+            flash('Please choose a valid blood group.', 'error')
+            return redirect(url_for('emergency_requests'))
+
+        emergency = EmergencyRequest(
+            hospital_id=current_user.id,
+            blood_group=blood_group,
+            units=request.form.get('units', '').strip() or None,
+            city=request.form.get('city', '').strip() or current_user.city,
+            state=request.form.get('state', '').strip() or current_user.state,
+            scope='state' if request.form.get('scope') == 'state' else 'city',
+            notes=request.form.get('notes', '').strip() or None,
+        )
+        db.session.add(emergency)
+        db.session.commit()
+        dispatch_emergency_broadcast(emergency.id)
+
+        flash('Emergency request posted. Compatible donors nearby are being notified.', 'success')
+        return redirect(url_for('emergency_requests'))
+
+    recent_requests = EmergencyRequest.query.filter_by(hospital_id=current_user.id)\
+                        .order_by(EmergencyRequest.created_at.desc()).limit(20).all()
+    return render_template('emergency.html',
+                           recent_requests=recent_requests,
+                           blood_groups=list(COMPATIBLE_DONORS))
+
+@app.route('/hospital/emergency/<int:emergency_id>/retry', methods=['POST'])
+@login_required
+def retry_emergency_request(emergency_id):
+    if current_user.role != 'hospital':
+        flash('Access denied', 'error')
+        return redirect(url_for('dashboard'))
+    emergency = EmergencyRequest.query.filter_by(id=emergency_id, hospital_id=current_user.id).first_or_404()
+    if not claim_emergency_retry(emergency.id):
+        flash('Only failed or stalled requests can be retried.', 'error')
+        return redirect(url_for('emergency_requests'))
+    dispatch_emergency_broadcast(emergency.id)
+    flash('Retrying: donors who were not notified yet are being notified.', 'success')
+    return redirect(url_for('emergency_requests'))
+
+@app.route('/api/emergency/<int:emergency_id>')
+@login_required
+def emergency_status(emergency_id):
+    if current_user.role != 'hospital':
+        return jsonify({'error': 'Access denied'}), 403
+    emergency = EmergencyRequest.query.filter_by(id=emergency_id, hospital_id=current_user.id).first_or_404()
+    return jsonify({
+        'id': emergency.id,
+        'status': emergency.status,
+        'blood_group': emergency.blood_group,
+        'recipient_count': emergency.recipient_count,
+        'sent_count': emergency.sent_count,
+        'failed_count': emergency.failed_count,
+        'p95_notify_seconds': emergency.p95_notify_seconds,
+        'last_error': emergency.last_error,
+    })
+
+# JSON API (v1)
+# Read-only, hospital-authenticated access to donors, hospitals, donations and usages
+# for hospital information systems. Supports sparse fieldsets (?fields=), cursor
+# pagination ordered by (updated_at, id), incremental sync (?updated_since=) and
+# conditional GET via ETag.
+API_DEFAULT_LIMIT = 100
+API_MAX_LIMIT = 1000
+
+API_RESOURCES = {
+    'donors': {
+        'model': User,
+        'fields': ('id', 'name', 'age', 'gender', 'blood_group', 'city', 'state', 'pincode',
+                   'contact_number', 'email', 'is_verified_donor', 'report_status',
+                   'approved_by_hospital_id', 'next_eligible_at', 'updated_at'),
+        'filters': ('blood_group', 'city', 'state'),
+    },
+    'hospitals': {
+        'model': Hospital,
+        'fields': ('id', 'name', 'hospital_code', 'city', 'state', 'contact_number', 'email', 'updated_at'),
+        'filters': ('city', 'state'),
+    },
+    'donations': {
+        'model': Donation,
+        'fields': ('id', 'donor_id', 'hospital_id', 'donation_units', 'donation_type', 'notes', 'date', 'updated_at'),
+        'filters': ('donor_id',),
+        'own_hospital_only': True,
+    },
+    'usages': {
+        'model': BloodUsage,
+        'fields': ('id', 'donor_id', 'hospital_id', 'blood_units', 'usage_type', 'notes', 'date', 'updated_at'),
+        'filters': ('donor_id',),
+        'own_hospital_only': True,
+    },
+    'units': {
+        'model': BloodUnit,
+        'fields': ('id', 'donation_id', 'hospital_id', 'blood_group', 'component', 'collected_at', 'expires_at',
+                   'status', 'usage_id', 'allocated_at', 'expiry_flagged_at', 'updated_at'),
+        'filters': ('blood_group', 'component', 'status', 'usage_id'),
+        'own_hospital_only': True,
+    },
+}
+
+def dumps_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    if msgspec is not None:
+        return msgspec.json.encode(payload)
+    return json.dumps(payload, separators=(',', ':'), default=lambda o: o.isoformat()).encode('utf-8')
+
+def api_response(payload, status=200):
+    response = app.response_class(dumps_json(payload), status=status, mimetype='application/json')
+    if status == 200:
+        response.add_etag()
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.make_conditional(request)
+    return response
+
+def api_error(message, status=400):
+    return api_response({'error': message}, status)
+
+def encode_cursor(updated_at, record_id, horizon=None):
+    raw = json.dumps([updated_at.isoformat() if updated_at else None, record_id,
+                      horizon.isoformat() if horizon else None]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """(updated_at, id, horizon); cursors issued before the horizon was added have none."""
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    updated_at, record_id, *rest = json.loads(raw)
+    if len(rest) > 1:
+        raise ValueError('cursor has too many parts')
+    horizon = rest[0] if rest else None
+    return ((datetime.fromisoformat(updated_at) if updated_at else None), int(record_id),
+            (datetime.fromisoformat(horizon) if horizon else None))
+
+def parse_api_fields(resource):
+    fields = request.args.get('fields')
+    if not fields:
+        return list(resource['fields'])
+    requested = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in resource['fields']]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return requested
+
+def build_api_query(name, resource, columns):
+    model = resource['model']
+    query = db.session.query(*columns)
+    if model is User:
+        query = query.filter(User.role == 'user')
+    if resource.get('own_hospital_only'):
+        query = query.filter(model.hospital_id == current_user.id)
+    for key in resource['filters']:
+        value = request.args.get(key)
+        if value:
+            query = query.filter(getattr(model, key) == value)
+    if name == 'donors' and request.args.get('verified') in ('true', '1'):
+        query = query.filter(User.is_verified_donor.is_(True))
+    if name == 'donors' and request.args.get('eligible') in ('true', '1'):
+        query = query.filter(eligible_now_filter())
+    return query
+
+def serialize_subscription(subscription, include_secret=False):
+    data = {
+        'id': subscription.id,
+        'url': subscription.url,
+        'event_types': subscription.event_type_list(),
+        'active': subscription.active,
+        'cursor': subscription.cursor,
+        'failure_count': subscription.failure_count,
+        'next_attempt_at': subscription.next_attempt_at,
+        'last_error': subscription.last_error,
+        'last_delivered_at': subscription.last_delivered_at,
+    }
+    if include_secret:
+        data['secret'] = subscription.secret
+    return data
+
+@app.route('/api/v1/webhooks', methods=['GET', 'POST', 'DELETE'])
+@login_required
+def webhook_subscription():
+    if current_user.role != 'hospital':
+        return api_error('Access denied', 403)
+    subscription = WebhookSubscription.query.filter_by(hospital_id=current_user.id).first()
+
+    if request.method == 'GET':
+        return api_response({'subscription': serialize_subscription(subscription) if subscription else None})
+
+    if request.method == 'DELETE':
+        if subscription:
+            db.session.delete(subscription)
+            db.session.commit()
+        return api_response({'subscription': None})
+
+    data = request.get_json(silent=True) or {}
+    url = (data.get('url') or '').strip()
+    if not url.startswith(('http://', 'https://')):
+        return api_error('url must be an http(s) URL')
+    event_types = data.get('event_types') or []
+    unknown = [t for t in event_types if t not in OUTBOX_EVENT_TYPES]
+    if unknown:
+        return api_error(f"Unknown event type(s): {', '.join(unknown)}")
+
+    created = subscription is None
+    if created:
+        # New subscribers start at the current end of the feed, not at the beginning of history
+        latest = db.session.query(func.max(OutboxEvent.sequence)).scalar() or 0
+        subscription = WebhookSubscription(hospital_id=current_user.id, secret=secrets.token_hex(32), cursor=latest)
+        db.session.add(subscription)
+    subscription.url = url
+    subscription.event_types = ','.join(event_types)
+    subscription.active = bool(data.get('active', True))
+    subscription.failure_count = 0
+    subscription.next_attempt_at = None
+    db.session.commit()
+    # The signing secret is only shown when the subscription is created
+    return api_response({'subscription': serialize_subscription(subscription, include_secret=created)},
+                        201 if created else 200)
+
+@app.route('/api/v1/<resource_name>')
+@login_required
+def api_list(resource_name):
+    if current_user.role != 'hospital':
+        return api_error('Access denied', 403)
+    resource = API_RESOURCES.get(resource_name)
+    if resource is None:
+        return api_error('Unknown resource', 404)
+    model = resource['model']
+
+    try:
+        fields = parse_api_fields(resource)
+        limit = min(max(int(request.args.get('limit', API_DEFAULT_LIMIT)), 1), API_MAX_LIMIT)
+        updated_since = request.args.get('updated_since')
+        updated_since = datetime.fromisoformat(updated_since) if updated_since else None
+    except (ValueError, TypeError) as e:
+        return api_error(str(e) or 'Invalid parameter')
+    try:
+        cursor = request.args.get('cursor')
+        cursor = decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError):
+        # The decoder's own message would echo base64/JSON details back to the client
+        return api_error('invalid cursor')
+
+    # Column-only projection: no ORM objects are built for the rows.
+    # id and updated_at are always selected to build the cursor, even when not requested.
+    columns = [getattr(model, f).label(f) for f in fields]
+    columns += [model.id.label('_id'), model.updated_at.label('_updated_at')]
+    query = build_api_query(resource_name, resource, columns)
+
+    # updated_at is set when a row is written, not when it commits: a transaction that commits
+    # late shows up behind rows already paged past. The horizon is the newest updated_at when the
+    # first page was read; the last page hands back a next_updated_since that far minus
+    # SNAPSHOT_SYNC_OVERLAP, so such rows arrive in the next sync (and some rows arrive twice)
+    horizon = cursor[2] if cursor else None
+    if horizon is None:
+        horizon = query.with_entities(func.max(model.updated_at)).scalar()
+    if updated_since:
+        query = query.filter(model.updated_at >= updated_since)
+    if cursor:
+        cursor_updated_at, cursor_id, _ = cursor
+        query = query.filter(or_(model.updated_at > cursor_updated_at,
+                                 and_(model.updated_at == cursor_updated_at, model.id > cursor_id)))
+    rows = query.order_by(model.updated_at, model.id).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    data = [{f: row._mapping[f] for f in fields} for row in rows]
+    next_cursor = encode_cursor(rows[-1]._updated_at, rows[-1]._id, horizon) if has_more else None
+    next_updated_since = None
+    if not has_more and horizon is not None:
+        next_updated_since = (horizon - SNAPSHOT_SYNC_OVERLAP).isoformat()
+
+    return api_response({
+        'data': data,
+        'count': len(data),
+        'has_more': has_more,
+        'next_cursor': next_cursor,
+        'next_updated_since': next_updated_since,
+    })
+
+@app.route('/api/v1/<resource_name>/<int:record_id>')
+@login_required
+def api_detail(resource_name, record_id):
+    if current_user.role != 'hospital':
+        return api_error('Access denied', 403)
+    resource = API_RESOURCES.get(resource_name)
+    if resource is None:
+        return api_error('Unknown resource', 404)
+    model = resource['model']
+
+    try:
+        fields = parse_api_fields(resource)
+    except ValueError as e:
+        return api_error(str(e))
+
+    columns = [getattr(model, f).label(f) for f in fields]
+    row = build_api_query(resource_name, resource, columns).filter(model.id == record_id).first()
+    if row is None:
+        return api_error('Not found', 404)
+    return api_response({'data': {f: row._mapping[f] for f in fields}})
+
 @app.route('/logout')
 @login_required
 def logout():
@@ -1188,6 +3239,13 @@ def logout():
     flash('You have been logged out successfully.', 'info')
     return redirect(url_for('index'))
 
+@app.route('/metrics')
+def prometheus_metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Access denied'}), 403
+    return metrics_registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.errorhandler(404)
 def not_found(error):
     return render_template('error.html', error_code=404, error_message="Page not found"), 404
@@ -1196,9 +3254,394 @@ def not_found(error):
 def internal_error(error):
     return render_template('error.html', error_code=500, error_message="Internal server error"), 500
 
-# Create database tables
-with app.app_context():
+def recompute_eligibility():
+    """Rebuild users.next_eligible_at from the full donation history; returns the number of donors with a date."""
+    # Archived donations are older than the longest donation interval, so they cannot move a date.
+    # The interval only depends on type and gender, so the latest donation of each type decides
+    latest = {}
+    rows = db.session.query(Donation.donor_id, Donation.donation_type, func.max(Donation.date), User.gender)\
+        .join(User, User.id == Donation.donor_id)\
+        .group_by(Donation.donor_id, Donation.donation_type, User.gender).all()
+    for donor_id, donation_type, date, gender in rows:
+        next_eligible_at = date + get_donation_interval(donation_type, gender)
+        if donor_id not in latest or next_eligible_at > latest[donor_id]:
+            latest[donor_id] = next_eligible_at
+
+    # Dates are computed in Python (intervals differ by type and gender), then only the rows whose
+    # date changes are written, as one executemany; unchanged donors keep their updated_at
+    changes = [{'id': donor_id, 'next_eligible_at': latest.get(donor_id)}
+               for donor_id, next_eligible_at in db.session.query(User.id, User.next_eligible_at)
+               if latest.get(donor_id) != next_eligible_at]
+    if changes:
+        db.session.bulk_update_mappings(User, changes)
+    db.session.commit()
+    if changes and get_shard_router():
+        # Bulk updates bypass the session, so copy every donor again
+        sync_shard_table('donors')
+    if changes:
+        bump_data_version('donors')
+    return len(latest)
+
+@app.cli.command('recompute-eligibility')
+def recompute_eligibility_command():
+    """Rebuild users.next_eligible_at from the full donation history."""
+    print(f'Updated next eligible date for {recompute_eligibility()} donors.')
+
+def rebuild_rollups():
+    """Recompute daily_rollups from the full donation and usage history; returns the number of rows."""
+    from forecasting import parse_units
+    DailyRollup.query.delete()
+    totals = {}
+    sources = (
+        ('donation', Donation, Donation.donation_type, Donation.donation_units),
+        ('usage', BloodUsage, BloodUsage.usage_type, BloodUsage.blood_units),
+    )
+
+    def add(kind, date, hospital_id, state, city, blood_group, record_type, units):
+        key = (kind, date.date(), hospital_id, blood_group, record_type or '')
+        entry = totals.get(key)
+        if entry is None:
+            entry = totals[key] = {'kind': kind, 'day': key[1], 'hospital_id': hospital_id, 'state': state,
+                                   'city': city, 'blood_group': blood_group, 'record_type': key[4],
+                                   'record_count': 0, 'units': 0.0}
+        entry['record_count'] += 1
+        entry['units'] += parse_units(units)
+
+    for kind, model, type_column, units_column in sources:
+        # Streamed in chunks; units are free text, so they are summed in Python
+        rows = db.session.query(model.date, model.hospital_id, Hospital.state, Hospital.city,
+                                User.blood_group, type_column, units_column)\
+            .join(Hospital, Hospital.id == model.hospital_id)\
+            .join(User, User.id == model.donor_id)\
+            .yield_per(5000)
+        for row in rows:
+            add(kind, *row)
+
+    # Archived records count towards the same days
+    hospitals = {hospital_id: (state, city) for hospital_id, state, city
+                 in db.session.query(Hospital.id, Hospital.state, Hospital.city)}
+    for kind, model, type_column, units_column in sources:
+        for records in iter_archived(kind):
+            groups = donor_blood_groups({record.donor_id for record in records})
+            for record in records:
+                if record.hospital_id in hospitals and record.donor_id in groups:
+                    add(kind, record.date, record.hospital_id, *hospitals[record.hospital_id],
+                        groups[record.donor_id], getattr(record, type_column.key), getattr(record, units_column.key))
+
+    db.session.bulk_insert_mappings(DailyRollup, list(totals.values()))
+    db.session.commit()
+    return len(totals)
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute daily_rollups from the full donation and usage history."""
+    print(f'Rebuilt {rebuild_rollups()} daily rollup rows.')
+
+def sequence_outbox_events():
+    """Number the committed events that have no sequence yet, continuing after the highest one.
+
+    Ids are handed out when a transaction inserts, not when it commits, so on a
+    database with concurrent writers (PostgreSQL) an event with a lower id can
+    become visible after one with a higher id was already delivered. Cursors
+    therefore follow this sequence, which only ever grows in the order events
+    become visible here. A second dispatcher numbering at the same moment hits
+    the unique constraint and leaves the numbering to the next round.
+    """
+    last = db.session.query(func.max(OutboxEvent.sequence)).scalar() or 0
+    pending = db.session.query(OutboxEvent.id).filter(OutboxEvent.sequence.is_(None)).order_by(OutboxEvent.id).all()
+    if not pending:
+        return
+    db.session.bulk_update_mappings(OutboxEvent, [
+        {'id': event_id, 'sequence': last + number} for number, (event_id,) in enumerate(pending, 1)])
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+
+def dispatch_webhooks_once(client, batch_size=None, now=None):
+    """Deliver the next batch of every due subscription; returns the number of events delivered."""
+    batch_size = batch_size or app.config['WEBHOOK_BATCH_SIZE']
+    now = now or datetime.utcnow()
+    sequence_outbox_events()
+    subscriptions = WebhookSubscription.query.filter(
+        WebhookSubscription.active.is_(True),
+        or_(WebhookSubscription.next_attempt_at.is_(None), WebhookSubscription.next_attempt_at <= now)).all()
+
+    deliveries, batch_sizes = [], {}
+    for subscription in subscriptions:
+        query = OutboxEvent.query.filter(
+            OutboxEvent.sequence > subscription.cursor,
+            or_(OutboxEvent.hospital_id.is_(None), OutboxEvent.hospital_id == subscription.hospital_id))
+        if subscription.event_type_list():
+            query = query.filter(OutboxEvent.event_type.in_(subscription.event_type_list()))
+        events = query.order_by(OutboxEvent.sequence).limit(batch_size).all()
+        if not events:
+            continue
+        body = dumps_json({
+            'subscription_id': subscription.id,
+            'cursor': events[-1].sequence,
+            'events': [{
+                'id': event.id,
+                'type': event.event_type,
+                'resource': event.resource,
+                'record_id': event.record_id,
+                'created_at': event.created_at,
+                'data': json.loads(event.payload),
+            } for event in events],
+        })
+        deliveries.append(Delivery(subscription.id, subscription.url, subscription.secret, body, events[-1].sequence))
+        batch_sizes[subscription.id] = len(events)
+
+    # HTTP runs in parallel across subscribers; cursors are only written here, in this thread
+    by_id = {subscription.id: subscription for subscription in subscriptions}
+    delivered = 0
+    for outcome in client.deliver_all(deliveries):
+        subscription = by_id[outcome.subscription_id]
+        if outcome.ok:
+            subscription.cursor = outcome.cursor
+            subscription.failure_count = 0
+            subscription.next_attempt_at = None
+            subscription.last_error = None
+            subscription.last_delivered_at = now
+            delivered += batch_sizes[outcome.subscription_id]
+        else:
+            subscription.failure_count += 1
+            subscription.next_attempt_at = now + timedelta(seconds=backoff_seconds(subscription.failure_count))
+            subscription.last_error = outcome.error
+    db.session.commit()
+    return delivered
+
+@app.cli.command('dispatch-webhooks')
+@click.option('--interval', default=1.0, help='Seconds to wait when there is nothing to send.')
+@click.option('--batch-size', default=None, type=int, help='Events per delivery (WEBHOOK_BATCH_SIZE).')
+@click.option('--once', is_flag=True, help='Run a single round and exit.')
+def dispatch_webhooks_command(interval, batch_size, once):
+    """Deliver outbox events to subscribed hospital systems."""
+    client = WebhookClient(timeout=app.config['WEBHOOK_TIMEOUT'])
+    while True:
+        delivered = dispatch_webhooks_once(client, batch_size)
+        db.session.remove()
+        if once:
+            print(f'Delivered {delivered} events.')
+            return
+        if not delivered:
+            time.sleep(interval)
+
+@app.cli.command('prune-outbox')
+@click.option('--days', default=7, help='Keep events newer than this.')
+def prune_outbox_command(days):
+    """Delete old outbox events that every active subscriber has received."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    query = OutboxEvent.query.filter(OutboxEvent.created_at < cutoff)
+    oldest_cursor = db.session.query(func.min(WebhookSubscription.cursor))\
+        .filter(WebhookSubscription.active.is_(True)).scalar()
+    if oldest_cursor is not None:
+        query = query.filter(OutboxEvent.sequence <= oldest_cursor)
+    deleted = query.delete(synchronize_session=False)
+    db.session.commit()
+    print(f'Deleted {deleted} outbox events.')
+
+@app.cli.command('archive-history')
+@click.option('--days', default=None, type=int, help='Archive records older than this (ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', default=None, type=int, help='Records moved per transaction (ARCHIVE_BATCH_SIZE).')
+def archive_history_command(days, batch_size):
+    """Move old usage and donation records into compressed archive chunks."""
+    from inventory import SHELF_LIFE_DAYS
+    days = days or app.config['ARCHIVE_AFTER_DAYS']
+    # Inventory units of archived donations are deleted with them, so none may still be in stock
+    if days < max(SHELF_LIFE_DAYS.values()):
+        raise click.BadParameter(f'must be at least {max(SHELF_LIFE_DAYS.values())}, the longest shelf life',
+                                 param_hint='--days')
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    for kind in ('donation', 'usage'):
+        moved = archive_records(kind, cutoff, batch_size)
+        print(f'Archived {moved} {kind} records dated before {cutoff:%Y-%m-%d}.')
+
+@app.cli.command('dedup-donors')
+@click.option('--dry-run', is_flag=True, help='Report duplicates without flagging them.')
+def dedup_donors_command(dry_run):
+    """Flag donors that look like duplicates of another donor for hospital review."""
+    started = time.perf_counter()
+    backfilled, groups, flagged = dedup_donors(dry_run)
+    if backfilled:
+        print(f'Filled in duplicate keys for {backfilled} donors.')
+    print(f"{'Would flag' if dry_run else 'Flagged'} {flagged} donors in {groups} groups of possible duplicates "
+          f'in {time.perf_counter() - started:.2f}s.')
+
+@app.cli.command('check-inventory')
+@click.option('--interval', default=3600.0, help='Seconds between checks.')
+@click.option('--once', is_flag=True, help='Run a single check and exit.')
+def check_inventory_command(interval, once):
+    """Expire stock past its shelf life and flag units that expire soon."""
+    while True:
+        expired, flagged = check_inventory()
+        db.session.remove()
+        print(f'{datetime.utcnow():%Y-%m-%d %H:%M} expired {expired} units, flagged {flagged} expiring soon.')
+        if once:
+            return
+        time.sleep(interval)
+
+@app.cli.command('suggest-transfers')
+@click.option('--interval', default=3600.0, help='Seconds between plans.')
+@click.option('--once', is_flag=True, help='Plan once and exit.')
+def suggest_transfers_command(interval, once):
+    """Suggest transfers from hospitals with surplus or expiring stock to hospitals running short."""
+    while True:
+        started = time.perf_counter()
+        transfers = suggest_transfers()
+        db.session.remove()
+        print(f'{datetime.utcnow():%Y-%m-%d %H:%M} suggested {len(transfers)} transfers '
+              f'({sum(t.units for t in transfers)} units) in {time.perf_counter() - started:.2f}s.')
+        if once:
+            return
+        time.sleep(interval)
+
+@app.cli.command('rebalance-shards')
+@click.option('--max-shards', default=None, type=int, help='Merge smaller states so there are at most this many shards.')
+def rebalance_shards_command(max_shards):
+    """Reassign states to shards and rebuild every shard file from the main database."""
+    if get_shard_router() is None:
+        print('Region shards are off; set PARTITIONING=state to use them.')
+        return
+    plan, copied = rebalance_shards(max_shards)
+    by_shard = defaultdict(list)
+    for region, shard in plan.items():
+        by_shard[shard].append(region)
+    for shard, regions in sorted(by_shard.items()):
+        print(f"{shard}: {', '.join(sorted(regions))}")
+    print(f"Copied {copied['donors']} donors, {copied['blood_usage']} usage and "
+          f"{copied['donations']} donation records into {len(by_shard)} shards.")
+
+@app.cli.command('retry-emergencies')
+@click.option('--request-id', default=None, type=int, help='Retry only this emergency request.')
+def retry_emergencies_command(request_id):
+    """Resume failed and stalled emergency broadcasts, notifying the donors who were not notified yet."""
+    query = EmergencyRequest.query.filter(retryable_emergency_filter())
+    if request_id:
+        query = query.filter_by(id=request_id)
+    for emergency_id, in query.with_entities(EmergencyRequest.id).order_by(EmergencyRequest.id).all():
+        if not claim_emergency_retry(emergency_id):
+            continue
+        ok = broadcast_or_mark_failed(emergency_id)
+        emergency = db.session.get(EmergencyRequest, emergency_id)
+        print(f'Request {emergency_id}: {emergency.status}, {emergency.sent_count} of {emergency.recipient_count} '
+              f"donors notified{'' if ok else ' (' + emergency.last_error + ')'}.")
+
+@app.cli.command('emergency-benchmark')
+@click.option('--donors', default=10000, help='Number of synthetic recipients.')
+@click.option('--workers', default=8, help='Thread pool size.')
+def emergency_benchmark_command(donors, workers):
+    """Measure time-to-notify for a broadcast through the local stub sender."""
+    sender = SENDERS['local']()
+    notifications = [Notification(i, f'9{i:09d}', 'benchmark') for i in range(donors)]
+    started = time.perf_counter()
+    results = Broadcaster(sender, workers).broadcast(notifications)
+    elapsed = time.perf_counter() - started
+    latencies = [r.latency for r in results if r.ok]
+    print(f'Notified {len(latencies)}/{donors} donors in {elapsed:.3f}s '
+          f'(p50 {percentile(latencies, 50):.4f}s, p95 {percentile(latencies, 95):.4f}s)')
+
+@app.cli.command('init-db')
+@click.option('--upgrade', is_flag=True, help='Add and backfill the columns that older databases lack.')
+def init_db_command(upgrade):
+    """Create any missing database tables and indexes."""
     db.create_all()
+    if upgrade:
+        for step in upgrade_schema():
+            print(step)
+    elif missing_columns():
+        raise click.ClickException(schema_upgrade_message())
+    create_missing_indexes()
+    print('Database tables are up to date.')
+
+def missing_columns():
+    """[(table, column)] of columns the models have but existing tables lack."""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name in tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            missing.extend((table, column) for column in table.columns if column.name not in existing)
+    return missing
+
+def schema_upgrade_message():
+    names = ', '.join(f'{table.name}.{column.name}' for table, column in missing_columns())
+    return f'The database is missing columns ({names}). Back it up and run `flask --app app init-db --upgrade`.'
+
+def upgrade_schema():
+    """Add missing columns to tables created by older releases and fill them in; returns what was done.
+
+    create_all() only creates whole tables. Added columns are nullable (or have a
+    server default), so ALTER TABLE ... ADD COLUMN works on SQLite too; unique
+    columns get a unique index instead of an inline constraint, which SQLite
+    cannot add to an existing table. Tables created for the first time (such as
+    daily_rollups) are filled from the existing records.
+    """
+    from sqlalchemy.schema import CreateColumn
+    db.create_all()
+    steps = []
+    added = set()
+    with db.engine.begin() as connection:
+        for table, column in missing_columns():
+            definition = CreateColumn(column).compile(dialect=db.engine.dialect)
+            connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {definition}')
+            if column.unique:
+                connection.exec_driver_sql(f'CREATE UNIQUE INDEX IF NOT EXISTS uq_{table.name}_{column.name} '
+                                           f'ON {table.name} ({column.name})')
+            added.add((table.name, column.name))
+            steps.append(f'Added column {table.name}.{column.name}.')
+
+    now = datetime.utcnow()
+    for model, value in ((User, now), (Hospital, now), (BloodUsage, BloodUsage.date), (Donation, Donation.date)):
+        if (model.__tablename__, 'updated_at') in added:
+            model.query.filter(model.updated_at.is_(None))\
+                .update({model.updated_at: value}, synchronize_session=False)
+    db.session.commit()
+    if ('users', 'next_eligible_at') in added:
+        steps.append(f'Computed the next eligible date of {recompute_eligibility()} donors.')
+    if ('users', 'name_key') in added:
+        steps.append(f'Filled in duplicate keys for {backfill_donor_keys()} donors.')
+    if ('outbox_events', 'sequence') in added:
+        # Subscriber cursors so far were event ids
+        OutboxEvent.query.update({OutboxEvent.sequence: OutboxEvent.id}, synchronize_session=False)
+        db.session.commit()
+        steps.append('Numbered the existing outbox events in id order.')
+    # Rollups are kept up to date on every new record, so an empty table beside existing records is a new one
+    if DailyRollup.query.first() is None and (Donation.query.first() or BloodUsage.query.first()):
+        steps.append(f'Built {rebuild_rollups()} daily rollup rows.')
+    return steps
+
+def create_missing_indexes():
+    # create_all() only creates indexes together with new tables; add the ones older databases lack
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def create_app(config=None):
+    """Entry point for servers (wsgi.py) and scripts: applies overrides and creates missing tables.
+
+    Tables are no longer created at import time, so importing app.py (CLI, tests,
+    gunicorn workers) does not touch the database. Entry points that serve the
+    module-level app directly get this setup before their first request
+    (see ensure_app_ready).
+    """
+    if config:
+        app.config.update(config)
+    # Without this, every request behind a proxy has the proxy's address and shares one rate limit bucket
+    if app.config['TRUSTED_PROXIES'] and not isinstance(app.wsgi_app, ProxyFix):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                                x_proto=app.config['TRUSTED_PROXIES'])
+    os.makedirs(os.path.join(app.root_path, app.config['UPLOAD_FOLDER']), exist_ok=True)
+    with app.app_context():
+        db.create_all()
+        # Indexes on new columns cannot be created before the columns exist
+        if missing_columns():
+            raise RuntimeError(schema_upgrade_message())
+        create_missing_indexes()
+    global _app_ready
+    _app_ready = True
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,52 @@
+"""Cold storage for old usage and donation records.
+
+`flask archive-history` moves records older than ARCHIVE_AFTER_DAYS out of the
+blood_usage and donations tables, one batch of ids per short transaction.
+Every batch is split per hospital into chunks. A chunk is one archive_chunks row
+holding the records as zlib-compressed JSON, plus one archive_chunk_donors row
+per donor with the number of that donor's records in it, so per-donor counts
+and lookups need no decompression.
+
+Archived records are read back as namedtuples whose attribute names match the
+ORM models, so dashboards, forecasting and rollup rebuilds treat hot and
+archived records alike.
+"""
+import json
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+FORMAT_VERSION = 1
+COMPRESSION_LEVEL = 6
+
+USAGE_FIELDS = ('id', 'donor_id', 'hospital_id', 'date', 'blood_units', 'usage_type', 'notes')
+DONATION_FIELDS = ('id', 'donor_id', 'hospital_id', 'date', 'donation_units', 'donation_type', 'notes')
+
+# `hospital` is filled in by callers that display the hospital name (the donor's history)
+ArchivedUsage = namedtuple('ArchivedUsage', USAGE_FIELDS + ('hospital',), defaults=(None,))
+ArchivedDonation = namedtuple('ArchivedDonation', DONATION_FIELDS + ('hospital',), defaults=(None,))
+
+KINDS = {
+    'usage': (USAGE_FIELDS, ArchivedUsage),
+    'donation': (DONATION_FIELDS, ArchivedDonation),
+}
+DATE_INDEX = 3
+
+
+def pack_chunk(rows):
+    """Compress rows (tuples in the kind's field order) into one chunk payload."""
+    values = [[value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows]
+    document = json.dumps({'version': FORMAT_VERSION, 'rows': values}, separators=(',', ':'))
+    return zlib.compress(document.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def unpack_chunk(kind, payload):
+    """Records of one chunk as ArchivedUsage / ArchivedDonation tuples, in id order."""
+    tuple_type = KINDS[kind][1]
+    document = json.loads(zlib.decompress(payload))
+    records = []
+    for row in document['rows']:
+        if row[DATE_INDEX] is not None:
+            row[DATE_INDEX] = datetime.fromisoformat(row[DATE_INDEX])
+        records.append(tuple_type(*row))
+    return records
@@ -0,0 +1,720 @@
+"""Benchmark harness: synthetic data, route timings and a JSON baseline.
+
+    python benchmark.py seed --users 100000 --hospitals 50 --records 1000000
+    python benchmark.py run --output benchmark-baseline.json
+    python benchmark.py http --url http://127.0.0.1:8000 --concurrency 16 --duration 30
+    python benchmark.py compare benchmark-baseline.json benchmark-current.json --tolerance 0.2
+    python benchmark.py import-time --budget-ms 800
+    python benchmark.py shards --concurrency 8 --writers 2 --duration 10
+    python benchmark.py donor-search --iterations 50
+    python benchmark.py transfers --hospitals 500
+
+`seed` bulk inserts donors, hospitals and usage/donation rows into a separate
+SQLite file (instance/benchmark.db by default), then rebuilds the derived
+eligibility dates and daily rollups. `run` drives the main routes in process
+through the Flask test client. `http` runs the same routes against a live
+server (start it with DATABASE_URL pointing at the seeded file and
+RATE_LIMIT_ENABLED=0) from
+concurrent client threads. Both record p50/p95/p99 latency, throughput and
+memory, plus the largest number of database queries a request issued.
+`compare` exits with status 1 when a route's p95 got slower than the baseline
+by more than the tolerance, or when it issues more queries. `run` takes the
+query count from a cold render (empty fragment cache), with or without --cold.
+Runs against a small and a large seed with --queries-only check that every
+page needs a fixed number of queries regardless of row count; so does
+tests/test_query_counts.py.
+`import-time` runs `python -X importtime -c "import app"` and fails when the
+import exceeds its budget or loads a module that should only load on first
+use (LAZY_MODULES), which keeps cold starts of new workers fast.
+`shards` rebuilds per-state shards from the seeded file (PARTITIONING=state)
+and measures donor search throughput, single region and all regions, against
+the single file and against the shards while writer threads keep recording
+usage. `donor-search` times donor matching (dashboard filters and emergency
+compatibility) in SQL against the in-memory donor snapshot and checks that both
+return the same donors. `transfers` times the inter-hospital transfer planner
+on synthetic stock and demand for the given number of hospitals.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from notifications import percentile
+
+try:
+    import resource
+except ImportError:  # not available on Windows; peak RSS is reported as null there
+    resource = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.path.join(BASE_DIR, 'instance', 'benchmark.db')
+PASSWORD = 'benchmark'
+DONOR_EMAIL = 'donor1@bench.local'
+HOSPITAL_EMAIL = 'hospital1@bench.local'
+
+BLOOD_GROUPS = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+GENDERS = ('Male', 'Female')
+PLACES = (
+    ('Bangalore', 'Karnataka'), ('Mysore', 'Karnataka'), ('Mumbai', 'Maharashtra'), ('Pune', 'Maharashtra'),
+    ('Delhi', 'Delhi'), ('Lucknow', 'Uttar Pradesh'), ('Chennai', 'Tamil Nadu'), ('Kolkata', 'West Bengal'),
+)
+USAGE_TYPES = ('Surgery', 'Accident', 'Anemia', 'Childbirth', 'Cancer Treatment')
+DONATION_TYPES = ('Whole Blood', 'Plasma', 'Platelets')
+
+QUERY_COUNT_PATTERN = re.compile(r'desc="(\d+) queries"')
+IMPORT_TIME_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+# Loaded on first use; importing app.py must not pull them in
+LAZY_MODULES = ('requests', 'numpy', 'forecasting')
+
+# name, session role, method, path, form data
+SCENARIOS = (
+    ('index', None, 'GET', '/', None),
+    ('login', None, 'POST', '/login', {'email': DONOR_EMAIL, 'password': PASSWORD}),
+    ('donor_dashboard', 'donor', 'GET', '/dashboard', None),
+    ('dashboard_stats', 'donor', 'GET', '/api/dashboard_stats', None),
+    ('hospital_dashboard', 'hospital', 'GET', '/hospital/dashboard', None),
+    ('hospital_dashboard_search', 'hospital', 'GET', '/hospital/dashboard?blood_group=O%2B&eligible=1', None),
+    ('api_donors', 'hospital', 'GET', '/api/v1/donors?verified=true&limit=100', None),
+    ('regional_analytics', 'hospital', 'GET', '/api/analytics/regional', None),
+)
+
+
+def load_app(db_path):
+    # DATABASE_URL must be set before app.py is imported: the engine is created at import
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(db_path)
+    os.environ.setdefault('SHARED_STATE', 'memory')
+    import app as bloodlink
+    bloodlink.create_app({'TESTING': True, 'EMERGENCY_DISPATCH_ASYNC': False, 'RATE_LIMIT_ENABLED': False})
+    return bloodlink
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def query_count(headers):
+    # app.py reports the request's query count in Server-Timing: db;dur=..;desc="N queries"
+    match = QUERY_COUNT_PATTERN.search(headers.get('Server-Timing', ''))
+    return int(match.group(1)) if match else None
+
+
+def summarize(latencies, errors, elapsed, queries=()):
+    latencies_ms = [value * 1000 for value in latencies]
+    queries = [count for count in queries if count is not None]
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'db_queries': max(queries) if queries else None,
+        'p50_ms': round(percentile(latencies_ms, 50), 3) if latencies_ms else None,
+        'p95_ms': round(percentile(latencies_ms, 95), 3) if latencies_ms else None,
+        'p99_ms': round(percentile(latencies_ms, 99), 3) if latencies_ms else None,
+        'mean_ms': round(sum(latencies_ms) / len(latencies_ms), 3) if latencies_ms else None,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+def insert_chunks(bloodlink, model, rows, chunk_size=10000):
+    from sqlalchemy import insert
+    for start in range(0, len(rows), chunk_size):
+        bloodlink.db.session.execute(insert(model), rows[start:start + chunk_size])
+    bloodlink.db.session.commit()
+
+
+def seed(args):
+    if os.path.exists(args.db):
+        if not args.force:
+            sys.exit(f'{args.db} already exists; pass --force to replace it')
+        os.remove(args.db)
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+
+    bloodlink = load_app(args.db)
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    password_hash = bloodlink.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    started = time.perf_counter()
+
+    with bloodlink.app.app_context():
+        from sqlalchemy import text
+        bloodlink.db.session.execute(text('PRAGMA synchronous=OFF'))
+
+        hospitals = []
+        for i in range(1, args.hospitals + 1):
+            city, state = PLACES[i % len(PLACES)]
+            hospitals.append({
+                'id': i, 'name': f'Benchmark Hospital {i}', 'hospital_code': f'BENCH{i:04d}', 'city': city,
+                'state': state, 'contact_number': f'80{i:08d}', 'email': f'hospital{i}@bench.local',
+                'password_hash': password_hash, 'role': 'hospital', 'updated_at': now,
+            })
+        insert_chunks(bloodlink, bloodlink.Hospital, hospitals)
+
+        users = []
+        for i in range(1, args.users + 1):
+            city, state = rng.choice(PLACES)
+            verified = rng.random() < args.verified_ratio
+            users.append({
+                'id': i, 'name': f'Donor {i}', 'age': rng.randint(18, 65), 'gender': rng.choice(GENDERS),
+                'blood_group': rng.choice(BLOOD_GROUPS), 'city': city, 'state': state,
+                'pincode': f'{560000 + i % 1000}', 'contact_number': f'9{i:09d}', 'diseases': '',
+                'email': f'donor{i}@bench.local', 'password_hash': password_hash, 'role': 'user',
+                'test_hospital_name': 'Benchmark Lab', 'report_status': 'approved' if verified else 'pending',
+                'report_submitted_at': now, 'approved_by_hospital_id': rng.randint(1, args.hospitals) if verified else None,
+                'is_verified_donor': verified, 'updated_at': now,
+            })
+        insert_chunks(bloodlink, bloodlink.User, users)
+        del users
+
+        # Records are split evenly between usage and donations, spread over the last `days` days
+        for model, units_column, type_column, types, count in (
+                (bloodlink.BloodUsage, 'blood_units', 'usage_type', USAGE_TYPES, args.records // 2),
+                (bloodlink.Donation, 'donation_units', 'donation_type', DONATION_TYPES, args.records - args.records // 2)):
+            rows = []
+            for _ in range(count):
+                when = now - timedelta(days=rng.random() * args.days)
+                rows.append({
+                    'donor_id': rng.randint(1, args.users), 'hospital_id': rng.randint(1, args.hospitals),
+                    units_column: str(rng.randint(1, 3)), type_column: rng.choice(types), 'notes': '',
+                    'date': when, 'updated_at': when,
+                })
+                if len(rows) == 50000:
+                    insert_chunks(bloodlink, model, rows)
+                    rows = []
+            insert_chunks(bloodlink, model, rows)
+
+    inserted = time.perf_counter() - started
+    print(f'Inserted {args.hospitals} hospitals, {args.users} donors and {args.records} records in {inserted:.1f}s')
+
+    if not args.skip_derived:
+        runner = bloodlink.app.test_cli_runner()
+        for command in ('recompute-eligibility', 'rebuild-rollups'):
+            result = runner.invoke(args=[command])
+            print(result.output.strip())
+            if result.exception:
+                raise result.exception
+    print(f'Seeded {args.db} in {time.perf_counter() - started:.1f}s')
+
+
+# ---------------------------------------------------------------------------
+# In-process run through the Flask test client
+# ---------------------------------------------------------------------------
+
+def logged_in_client(bloodlink, role):
+    client = bloodlink.app.test_client()
+    if role == 'donor':
+        client.post('/login', data={'email': DONOR_EMAIL, 'password': PASSWORD})
+    elif role == 'hospital':
+        client.post('/Hospital-Login', data={'email': HOSPITAL_EMAIL, 'password': PASSWORD})
+    return client
+
+
+def call(client, method, path, data):
+    if method == 'POST':
+        return client.post(path, data=data)
+    return client.get(path)
+
+
+def run_scenario(bloodlink, scenario, iterations, warmup, cold):
+    name, role, method, path, data = scenario
+    client = logged_in_client(bloodlink, role)
+
+    def request_once():
+        if cold:
+            bloodlink.fragment_cache.clear()
+        return call(client, method, path, data)
+
+    for _ in range(warmup):
+        request_once()
+
+    latencies, queries, errors = [], [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        response = request_once()
+        latencies.append(time.perf_counter() - t0)
+        queries.append(query_count(response.headers))
+        if response.status_code >= 400:
+            errors += 1
+    result = summarize(latencies, errors, time.perf_counter() - started, queries)
+    # The query count always comes from a cold render: with a warm fragment cache a page needs
+    # almost no queries, which would hide an N+1 load from `compare`
+    bloodlink.fragment_cache.clear()
+    result['db_queries'] = query_count(call(client, method, path, data).headers)
+
+    # Allocation peak is measured in a separate short pass so tracing does not skew the timings
+    tracemalloc.start()
+    for _ in range(min(iterations, 5)):
+        request_once()
+    result['peak_alloc_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    tracemalloc.stop()
+    return result
+
+
+def selected_scenarios(args):
+    wanted = set(args.scenario or ())
+    return [s for s in SCENARIOS if not wanted or s[0] in wanted]
+
+
+def run(args):
+    if not os.path.exists(args.db):
+        sys.exit(f'{args.db} does not exist; run `python benchmark.py seed` first')
+    bloodlink = load_app(args.db)
+    results = {}
+    for scenario in selected_scenarios(args):
+        # Logins pay for bcrypt on every request, keep them short
+        iterations = max(1, args.iterations // 10) if scenario[0] == 'login' else args.iterations
+        results[scenario[0]] = run_scenario(bloodlink, scenario, iterations, args.warmup, args.cold)
+        print_result(scenario[0], results[scenario[0]])
+    write_report(args, 'test-client', results)
+
+
+# ---------------------------------------------------------------------------
+# Concurrent HTTP load against a running server
+# ---------------------------------------------------------------------------
+
+def http_session(base_url, role):
+    import requests
+    session = requests.Session()
+    if role == 'donor':
+        session.post(base_url + '/login', data={'email': DONOR_EMAIL, 'password': PASSWORD})
+    elif role == 'hospital':
+        session.post(base_url + '/Hospital-Login', data={'email': HOSPITAL_EMAIL, 'password': PASSWORD})
+    return session
+
+
+def http_scenario(args, scenario):
+    import requests
+    name, role, method, path, data = scenario
+    url = args.url.rstrip('/') + path
+    deadline = time.monotonic() + args.duration
+    latencies, queries, lock = [], [], threading.Lock()
+    errors = [0]
+
+    def worker():
+        session = http_session(args.url.rstrip('/'), role)
+        local_latencies, local_queries, local_errors = [], [], 0
+        while time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            try:
+                response = session.request(method, url, data=data, timeout=30, allow_redirects=False)
+                failed = response.status_code >= 400
+                local_queries.append(query_count(response.headers))
+            except requests.exceptions.RequestException:
+                failed = True
+            local_latencies.append(time.perf_counter() - t0)
+            local_errors += failed
+        with lock:
+            latencies.extend(local_latencies)
+            queries.extend(local_queries)
+            errors[0] += local_errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(args.concurrency)]:
+            future.result()
+    return summarize(latencies, errors[0], time.perf_counter() - started, queries)
+
+
+def http(args):
+    results = {}
+    for scenario in selected_scenarios(args):
+        results[scenario[0]] = http_scenario(args, scenario)
+        print_result(scenario[0], results[scenario[0]])
+    write_report(args, 'http', results)
+
+
+# ---------------------------------------------------------------------------
+# Single file against region shards, under concurrent writes
+# ---------------------------------------------------------------------------
+
+def contended_searches(bloodlink, args, searches):
+    """Run `searches` from reader threads while writer threads insert usage records; returns both summaries."""
+    deadline = time.monotonic() + args.duration
+    lock = threading.Lock()
+    reads, writes = {'latencies': [], 'errors': 0}, {'latencies': [], 'errors': 0}
+    with bloodlink.app.app_context():
+        max_donor = bloodlink.db.session.query(bloodlink.func.max(bloodlink.User.id)).scalar()
+        max_hospital = bloodlink.db.session.query(bloodlink.func.max(bloodlink.Hospital.id)).scalar()
+
+    def reader(seed):
+        rng = random.Random(seed)
+        latencies, errors = [], 0
+        with bloodlink.app.app_context():
+            while time.monotonic() < deadline:
+                t0 = time.perf_counter()
+                try:
+                    bloodlink.search_verified_donors(**rng.choice(searches))
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - t0)
+                bloodlink.db.session.remove()
+        with lock:
+            reads['latencies'].extend(latencies)
+            reads['errors'] += errors
+
+    def writer(seed):
+        rng = random.Random(seed)
+        latencies, errors = [], 0
+        with bloodlink.app.app_context():
+            while time.monotonic() < deadline:
+                t0 = time.perf_counter()
+                try:
+                    bloodlink.db.session.add(bloodlink.BloodUsage(
+                        donor_id=rng.randint(1, max_donor), hospital_id=rng.randint(1, max_hospital),
+                        blood_units='1', usage_type=rng.choice(USAGE_TYPES), notes='benchmark',
+                        date=datetime.utcnow()))
+                    bloodlink.db.session.commit()
+                except Exception:
+                    bloodlink.db.session.rollback()
+                    errors += 1
+                latencies.append(time.perf_counter() - t0)
+        with lock:
+            writes['latencies'].extend(latencies)
+            writes['errors'] += errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency + args.writers) as executor:
+        futures = [executor.submit(reader, i) for i in range(args.concurrency)]
+        futures += [executor.submit(writer, 1000 + i) for i in range(args.writers)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+    return (summarize(reads['latencies'], reads['errors'], elapsed),
+            summarize(writes['latencies'], writes['errors'], elapsed))
+
+
+def shards(args):
+    if not os.path.exists(args.db):
+        sys.exit(f'{args.db} does not exist; run `python benchmark.py seed` first')
+    os.environ['PARTITIONING'] = 'state'
+    # Both layouts search with SQL; the donor snapshot would answer for the single file otherwise
+    os.environ['DONOR_SNAPSHOT'] = '0'
+    os.environ['SHARD_DIR'] = os.path.abspath(args.shard_dir)
+    bloodlink = load_app(args.db)
+    with bloodlink.app.app_context():
+        started = time.perf_counter()
+        plan, copied = bloodlink.rebalance_shards(args.max_shards, grace_seconds=0)  # no other workers
+        print(f"Built {len(set(plan.values()))} shards from {copied['donors']} donors and "
+              f"{copied['blood_usage'] + copied['donations']} records in {time.perf_counter() - started:.1f}s")
+
+    groups = [{'blood_group': group} for group in BLOOD_GROUPS]
+    workloads = (
+        ('region_search', [dict(group, state=state) for group in groups for state in sorted({s for _, s in PLACES})]),
+        ('all_regions_search', groups),
+    )
+    results = {}
+    for layout, partitioning in (('single_file', 'off'), ('partitioned', 'state')):
+        bloodlink.app.config['PARTITIONING'] = partitioning
+        for workload, searches in workloads:
+            reads, writes = contended_searches(bloodlink, args, searches)
+            results[f'{layout}.{workload}'] = reads
+            results[f'{layout}.{workload}.writes'] = writes
+            print_result(f'{layout}.{workload}', reads)
+            print_result('  concurrent writes', writes)
+    write_report(args, 'shards', results)
+
+
+# ---------------------------------------------------------------------------
+# Donor matching: SQL against the in-memory snapshot
+# ---------------------------------------------------------------------------
+
+def donor_match_workload():
+    states = sorted({state for _, state in PLACES})
+    cities = sorted({city for city, _ in PLACES})
+    now = datetime.utcnow()
+    workload = [('all_verified', {})]
+    workload += [(f'group {group}', {'blood_groups': [group]}) for group in ('O+', 'AB-')]
+    workload += [('state substring', {'state': states[0][:4]}), ('city + group', {'city': cities[0], 'blood_groups': ['A+']})]
+    workload += [('eligible + group', {'blood_groups': ['B+'], 'eligible_at': now})]
+    # Emergency matching: compatible groups, exact region, eligible now
+    workload += [(f'emergency {group} {state}', {'blood_groups': COMPATIBLE[group], 'state_exact': state, 'eligible_at': now})
+                 for group, state in (('AB+', states[0]), ('O-', states[-1]))]
+    return workload
+
+
+# Mirrors app.COMPATIBLE_DONORS for the groups the workload uses
+COMPATIBLE = {
+    'AB+': ['AB+', 'AB-', 'A+', 'A-', 'B+', 'B-', 'O+', 'O-'],
+    'O-': ['O-'],
+}
+
+
+def sql_match(bloodlink, blood_groups=None, city='', state='', city_exact=None, state_exact=None, eligible_at=None):
+    User, func = bloodlink.User, bloodlink.func
+    query = bloodlink.db.session.query(User.id).filter(User.role == 'user', User.is_verified_donor.is_(True))
+    if blood_groups:
+        query = query.filter(User.blood_group.in_(blood_groups))
+    if city:
+        query = query.filter(User.city.ilike(f'%{city}%'))
+    if state:
+        query = query.filter(User.state.ilike(f'%{state}%'))
+    if city_exact is not None:
+        query = query.filter(func.lower(User.city) == city_exact.lower())
+    if state_exact is not None:
+        query = query.filter(func.lower(User.state) == state_exact.lower())
+    if eligible_at is not None:
+        query = query.filter(bloodlink.eligible_now_filter(eligible_at))
+    return [row[0] for row in query.order_by(User.id)]
+
+
+def donor_search(args):
+    if not os.path.exists(args.db):
+        sys.exit(f'{args.db} does not exist; run `python benchmark.py seed` first')
+    bloodlink = load_app(args.db)
+    results = {}
+    with bloodlink.app.app_context():
+        started = time.perf_counter()
+        snapshot = bloodlink.get_donor_snapshot()
+        stats = snapshot.stats()
+        print(f"Built snapshot of {stats['donors']} donors ({stats['bytes'] / 1024 / 1024:.1f} MB) "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        for name, filters in donor_match_workload():
+            expected = sql_match(bloodlink, **filters)
+            matched = snapshot.match(**filters).tolist()
+            if matched != expected:
+                sys.exit(f'{name}: snapshot matched {len(matched)} donors, SQL {len(expected)}')
+            for path, match in (('sql', lambda: sql_match(bloodlink, **filters)), ('snapshot', lambda: snapshot.match(**filters))):
+                latencies = []
+                began = time.perf_counter()
+                for _ in range(args.iterations if path == 'snapshot' else max(1, args.iterations // 10)):
+                    t0 = time.perf_counter()
+                    match()
+                    latencies.append(time.perf_counter() - t0)
+                result = summarize(latencies, 0, time.perf_counter() - began)
+                result['matches'] = len(expected)
+                results[f'{path}.{name}'] = result
+                print_result(f'{path}.{name}', result)
+    write_report(args, 'donor-search', results)
+
+
+# ---------------------------------------------------------------------------
+# Transfer planning on synthetic stock
+# ---------------------------------------------------------------------------
+
+def transfer_positions(rng, hospitals, states=28, cities_per_state=10):
+    from transfers import Position
+    positions = []
+    for hospital_id in range(1, hospitals + 1):
+        state = f'State {rng.randrange(states)}'
+        city = f'{state} City {rng.randrange(cities_per_state)}'
+        for group in BLOOD_GROUPS:
+            # Days of shelf life left per available unit, up to the 42 days of red cells
+            expiries = [rng.uniform(0, 42) for _ in range(rng.randint(0, 40))]
+            positions.append(Position(hospital_id, city, state, group, expiries, rng.uniform(0, 3), rng.uniform(0, 2)))
+    return positions
+
+
+def transfer_planning(args):
+    from transfers import plan_transfers
+    rng = random.Random(args.seed)
+    positions = transfer_positions(rng, args.hospitals)
+    latencies, planned = [], []
+    began = time.perf_counter()
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        planned = plan_transfers(positions)
+        latencies.append(time.perf_counter() - t0)
+    result = summarize(latencies, 0, time.perf_counter() - began)
+    result['transfers'] = len(planned)
+    result['units'] = sum(transfer.units for transfer in planned)
+    name = f'plan {args.hospitals} hospitals'
+    print_result(name, result)
+    print(f"{result['transfers']} transfers, {result['units']} units")
+    write_report(args, 'transfers', {name: result})
+
+
+# ---------------------------------------------------------------------------
+# Cold start
+# ---------------------------------------------------------------------------
+
+def measure_import():
+    # A fresh interpreter per measurement; returns (app cumulative us, [(self us, module)], eager lazy modules)
+    code = f'import sys, app; print(",".join(m for m in {LAZY_MODULES!r} if m in sys.modules))'
+    env = dict(os.environ, SHARED_STATE='memory')
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                               capture_output=True, text=True, cwd=BASE_DIR, env=env, check=True)
+    total, modules = None, []
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        modules.append((self_us, name))
+        if name == 'app' and len(indent) == 1:
+            total = cumulative_us
+    eager = [name for name in completed.stdout.strip().split(',') if name]
+    return total, modules, eager
+
+
+def import_time(args):
+    # The fastest of several runs: noise only ever adds time
+    runs = [measure_import() for _ in range(args.runs)]
+    total, modules, eager = min(runs, key=lambda run: run[0])
+    print(f'import app: {total / 1000:.1f} ms (best of {args.runs}, budget {args.budget_ms:.0f} ms)')
+    for self_us, name in sorted(modules, reverse=True)[:args.top]:
+        print(f'  {self_us / 1000:8.1f} ms  {name}')
+
+    problems = []
+    if total / 1000 > args.budget_ms:
+        problems.append(f'import took {total / 1000:.1f} ms, over the {args.budget_ms:.0f} ms budget')
+    if eager:
+        problems.append(f"imported eagerly: {', '.join(eager)}")
+    if problems:
+        sys.exit('; '.join(problems))
+
+
+# ---------------------------------------------------------------------------
+# Reports
+# ---------------------------------------------------------------------------
+
+def print_result(name, result):
+    print(f"{name:28s} p50 {result['p50_ms']:>9} ms  p95 {result['p95_ms']:>9} ms  p99 {result['p99_ms']:>9} ms  "
+          f"{result['throughput_rps']:>8} req/s  errors {result['errors']}")
+
+
+def write_report(args, mode, results):
+    report = {
+        'meta': {
+            'mode': mode,
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': args.url if mode == 'http' else os.path.basename(args.db) if getattr(args, 'db', None) else None,
+            'cold_cache': getattr(args, 'cold', False),
+            'concurrency': getattr(args, 'concurrency', 1),
+            'peak_rss_mb': peak_rss_mb(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f'Wrote {args.output}')
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.current) as f:
+        current = json.load(f)['results']
+
+    regressions = []
+    for name, result in sorted(current.items()):
+        before = baseline.get(name)
+        if not before:
+            continue
+
+        # A page's query count must not grow, whatever the data volume (catches N+1 loads)
+        if before.get('db_queries') is not None and result.get('db_queries') is not None:
+            more_queries = result['db_queries'] > before['db_queries']
+            print(f"{name:28s} queries {before['db_queries']:>5} -> {result['db_queries']:>5}"
+                  f"{'  REGRESSION' if more_queries else ''}")
+            if more_queries:
+                regressions.append(f'{name} (queries)')
+
+        if args.queries_only or before.get('p95_ms') is None or result.get('p95_ms') is None:
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        # Sub-millisecond differences are noise, whatever the ratio
+        regressed = change > args.tolerance and result['p95_ms'] - before['p95_ms'] > args.min_delta_ms
+        print(f"{name:28s} p95 {before['p95_ms']:>9} -> {result['p95_ms']:>9} ms ({change:+.1%})"
+              f"{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(f'{name} (p95)')
+    if regressions:
+        sys.exit(f"Regressed against {args.baseline}: {', '.join(regressions)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='Create a database with synthetic data.')
+    seed_parser.add_argument('--db', default=DEFAULT_DB)
+    seed_parser.add_argument('--users', type=int, default=100000)
+    seed_parser.add_argument('--hospitals', type=int, default=50)
+    seed_parser.add_argument('--records', type=int, default=1000000, help='usage + donation rows')
+    seed_parser.add_argument('--days', type=int, default=730, help='history length the records are spread over')
+    seed_parser.add_argument('--verified-ratio', type=float, default=0.6)
+    seed_parser.add_argument('--seed', type=int, default=42)
+    seed_parser.add_argument('--skip-derived', action='store_true', help='skip eligibility and rollup rebuilds')
+    seed_parser.add_argument('--force', action='store_true', help='replace an existing database')
+    seed_parser.set_defaults(func=seed)
+
+    run_parser = commands.add_parser('run', help='Time routes in process through the test client.')
+    run_parser.add_argument('--db', default=DEFAULT_DB)
+    run_parser.add_argument('--iterations', type=int, default=200)
+    run_parser.add_argument('--warmup', type=int, default=5)
+    run_parser.add_argument('--cold', action='store_true', help='clear the fragment cache before every request')
+    run_parser.add_argument('--scenario', action='append', help='only run this scenario (repeatable)')
+    run_parser.add_argument('--output', default='benchmark-results.json')
+    run_parser.set_defaults(func=run)
+
+    http_parser = commands.add_parser('http', help='Concurrent load against a running server.')
+    http_parser.add_argument('--url', default='http://127.0.0.1:8000')
+    http_parser.add_argument('--concurrency', type=int, default=16)
+    http_parser.add_argument('--duration', type=float, default=10.0, help='seconds per scenario')
+    http_parser.add_argument('--scenario', action='append', help='only run this scenario (repeatable)')
+    http_parser.add_argument('--output', default='benchmark-http.json')
+    http_parser.set_defaults(func=http)
+
+    compare_parser = commands.add_parser('compare', help='Fail when p95 latency or query counts regressed.')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 increase (0.2 = 20%%)')
+    compare_parser.add_argument('--min-delta-ms', type=float, default=1.0)
+    compare_parser.add_argument('--queries-only', action='store_true',
+                                help='only compare query counts, e.g. a small seed against a large one')
+    compare_parser.set_defaults(func=compare)
+
+    import_parser = commands.add_parser('import-time', help='Fail when importing app.py exceeds its time budget.')
+    import_parser.add_argument('--budget-ms', type=float, default=800.0)
+    import_parser.add_argument('--runs', type=int, default=3)
+    import_parser.add_argument('--top', type=int, default=10, help='slowest modules to list (self time)')
+    import_parser.set_defaults(func=import_time)
+
+    shards_parser = commands.add_parser('shards', help='Compare donor search on the single file and on region shards.')
+    shards_parser.add_argument('--db', default=DEFAULT_DB)
+    shards_parser.add_argument('--shard-dir', default=os.path.join(BASE_DIR, 'instance', 'benchmark-shards'))
+    shards_parser.add_argument('--max-shards', type=int, default=None)
+    shards_parser.add_argument('--concurrency', type=int, default=8, help='reader threads')
+    shards_parser.add_argument('--writers', type=int, default=2, help='threads recording usage meanwhile')
+    shards_parser.add_argument('--duration', type=float, default=10.0, help='seconds per layout and workload')
+    shards_parser.add_argument('--output', default='benchmark-shards.json')
+    shards_parser.set_defaults(func=shards)
+
+    donor_parser = commands.add_parser('donor-search', help='Compare donor matching in SQL and in the donor snapshot.')
+    donor_parser.add_argument('--db', default=DEFAULT_DB)
+    donor_parser.add_argument('--iterations', type=int, default=50, help='per filter (SQL runs a tenth of them)')
+    donor_parser.add_argument('--output', default='benchmark-donor-search.json')
+    donor_parser.set_defaults(func=donor_search)
+
+    transfers_parser = commands.add_parser('transfers', help='Time the transfer planner on synthetic hospitals.')
+    transfers_parser.add_argument('--hospitals', type=int, default=500)
+    transfers_parser.add_argument('--runs', type=int, default=5)
+    transfers_parser.add_argument('--seed', type=int, default=1)
+    transfers_parser.add_argument('--output', default='benchmark-transfers.json')
+    transfers_parser.set_defaults(func=transfer_planning)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
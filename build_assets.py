@@ -0,0 +1,182 @@
+"""Build fingerprinted, precompressed copies of everything under static/.
+
+Run it before deploying:
+
+    python build_assets.py
+
+Each CSS/JS/JSON file is minified, written to static/build/ with a content
+hash in its name and stored next to .gz (and .br when the `brotli` package is
+installed) copies. static/build/manifest.json maps the original path to the
+hashed one; app.py uses it for url_for('static', ...) and the service worker.
+
+A rebuild never removes what running servers still link to. Workers read the
+manifest once at startup, so files are added next to the previous build's
+(each written to a temporary name first), the manifest is swapped in with one
+rename, and files of earlier builds are only deleted once no build has used
+them for KEEP_DAYS (--keep-days).
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always produced
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+BUILD_DIR_NAME = 'build'
+BUILD_DIR = os.path.join(STATIC_DIR, BUILD_DIR_NAME)
+
+# Never fingerprint the service worker (its URL must stay stable) or user uploads
+SKIP_DIRS = {BUILD_DIR_NAME, 'uploads'}
+SKIP_FILES = {'sw.js'}
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.html', '.txt'}
+HASH_LENGTH = 10
+# Files of earlier builds are kept this long after the last build that used them
+KEEP_DAYS = 7
+
+
+def minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    # Conservative: drop indentation, blank lines and whole-line comments only.
+    # Anything smarter needs a real tokenizer (strings, regex literals, template literals).
+    lines = []
+    in_block_comment = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if in_block_comment:
+            if '*/' in stripped:
+                in_block_comment = False
+            continue
+        if stripped.startswith('/*') and '*/' not in stripped:
+            in_block_comment = True
+            continue
+        if not stripped or stripped.startswith('//') or (stripped.startswith('/*') and stripped.endswith('*/')):
+            continue
+        lines.append(stripped)
+    return '\n'.join(lines) + '\n'
+
+
+def minify_json(text):
+    return json.dumps(json.loads(text), ensure_ascii=False, separators=(',', ':'))
+
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+    '.json': minify_json,
+}
+
+
+def iter_static_files():
+    for root, dirs, files in os.walk(STATIC_DIR):
+        dirs[:] = sorted(d for d in dirs if os.path.relpath(os.path.join(root, d), STATIC_DIR) not in SKIP_DIRS)
+        for name in sorted(files):
+            if name in SKIP_FILES:
+                continue
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, STATIC_DIR).replace(os.sep, '/'), path
+
+
+def write_atomic(path, data):
+    # A worker serving the file never sees it half written
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_hashed(path, data, compress):
+    """Write a content-hashed file and its compressed copies, unless an earlier build already did."""
+    paths = [path]
+    if compress:
+        paths.append(path + '.gz')
+        if brotli is not None:
+            paths.append(path + '.br')
+    if not all(os.path.isfile(p) for p in paths):
+        write_atomic(path, data)
+        if compress:
+            write_atomic(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                write_atomic(path + '.br', brotli.compress(data, quality=11))
+    # The modification time records the last build that used the file (see prune)
+    now = time.time()
+    for p in paths:
+        os.utime(p, (now, now))
+
+
+def prune(keep_paths, keep_days):
+    """Delete build files that no build has used for keep_days; returns how many."""
+    cutoff = time.time() - keep_days * 24 * 60 * 60
+    removed = 0
+    for root, _, files in os.walk(BUILD_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            if path in keep_paths or os.path.getmtime(path) >= cutoff:
+                continue
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def build(keep_days=KEEP_DAYS):
+    """Build every asset and swap in the new manifest; returns (manifest, files pruned)."""
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    files = {}
+    keep_paths = {os.path.join(BUILD_DIR, 'manifest.json')}
+    for rel_path, src_path in iter_static_files():
+        root, ext = os.path.splitext(rel_path)
+        with open(src_path, 'rb') as f:
+            data = f.read()
+
+        minify = MINIFIERS.get(ext)
+        if minify:
+            data = minify(data.decode('utf-8')).encode('utf-8')
+
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        hashed_rel = f'{BUILD_DIR_NAME}/{root}.{digest}{ext}'
+        dest_path = os.path.join(STATIC_DIR, hashed_rel)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        write_hashed(dest_path, data, ext in COMPRESSIBLE)
+        keep_paths.update(dest_path + suffix for suffix in ('', '.gz', '.br'))
+
+        files[rel_path] = hashed_rel
+
+    # The manifest version changes whenever any asset changes; sw.js derives its cache name from it
+    version = hashlib.sha256(json.dumps(files, sort_keys=True).encode('utf-8')).hexdigest()[:HASH_LENGTH]
+    manifest = {'version': version, 'files': files}
+    # Every file it names is already in place when the new manifest appears
+    write_atomic(os.path.join(BUILD_DIR, 'manifest.json'),
+                 json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest, prune(keep_paths, keep_days)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build fingerprinted, precompressed static assets.')
+    parser.add_argument('--keep-days', type=float, default=KEEP_DAYS,
+                        help='keep files of earlier builds this long after the last build that used them '
+                             '(default %(default)s; servers started before then may still link to them)')
+    args = parser.parse_args()
+    manifest, pruned = build(args.keep_days)
+    print(f"Built {len(manifest['files'])} assets into static/{BUILD_DIR_NAME}/ (version {manifest['version']}), "
+          f"removed {pruned} files no build has used for {args.keep_days:g} days")
+    if brotli is None:
+        print('brotli not installed - only .gz copies were written', file=sys.stderr)
@@ -0,0 +1,128 @@
+"""Local TF-IDF retrieval over the chatbot's canned answers.
+
+Questions that match none of ChatbotAdapter's keyword branches are scored
+against a small corpus: every canned topic and the BloodLink FAQ below. Each
+phrasing of a question and each answer text is its own row, and an answer
+scores as its best row, so a short paraphrase is not drowned out by a long
+answer. The matrix
+is built once, the first time it is needed. A lookup tokenizes the question and
+takes one dot product per entry: cosine similarity of sublinear TF-IDF vectors,
+well under a millisecond. The adapter answers locally when the best score
+clears its threshold and only calls the remote model otherwise.
+"""
+import re
+
+import numpy as np
+
+_token_pattern = re.compile(r'[a-z0-9]+')
+
+STOPWORDS = frozenset('''
+a about am an and any are as at be been before being but by can could do does doing for from get
+had has have how i if in into is it its me my of on or our should so than that the their them then
+there these they this to too was we were what when where which who why will with would you your
+s t d m ll re ve
+'''.split())
+
+# Canned topics: the probe is sent to ChatbotAdapter._get_medical_response to fetch the
+# answer; the other phrasings (and the answer itself) are what questions are matched against
+TOPICS = (
+    ('age limit', ('how old do I need to be to donate blood', 'am I too young or too old to give blood',
+                   'youngest or oldest age to give blood')),
+    ('how often', ('how frequently can I give blood', 'time gap between two donations',
+                   'how long to wait between donations', 'months between donations')),
+    ('preparation', ('what should I eat before giving blood', 'get ready for my donation appointment',
+                     'meal breakfast before donating')),
+    ('after donation', ('what to do once I have donated', 'recovery after giving blood',
+                        'exercise gym lift weights workout after donating')),
+    ('blood group', ('which blood types are compatible', 'who can receive my blood', 'universal donor recipient',
+                     'rh positive negative')),
+    ('benefits', ('is giving blood good for my health', 'reasons to become a donor', 'saves lives')),
+    ('cannot donate', ('who is not allowed to donate blood', 'reasons I would be deferred or rejected',
+                       'tattoo piercing pregnancy malaria antibiotics deferral')),
+    ('donation process', ('what happens when I donate', 'how long does giving blood take',
+                          'steps of a blood donation appointment')),
+    ('does it hurt', ('is the needle painful', 'scared of needles')),
+    ('dizzy', ('I feel faint or lightheaded', 'passing out after donating')),
+    ('minimum weight', ('how heavy do I need to be', 'am I too light to donate', 'kg lbs requirement')),
+    ('hemoglobin', ('low iron levels', 'anemia and donating', 'iron rich food')),
+    ('cold', ('I have a cough or runny nose', 'sore throat')),
+    ('fever', ('high temperature', 'feeling feverish')),
+    ('headache', ('migraine relief', 'my head hurts')),
+    ('hydration', ('how much water should I drink', 'fluids')),
+    ('sleep', ("I can't sleep", 'feeling tired at night', 'insomnia')),
+)
+
+# Questions about using BloodLink itself, answered without a keyword branch
+FAQ = (
+    (('how do I register as a donor', 'sign up create account become a donor'),
+     """**Becoming a Donor on BloodLink:**
+1. Register with your details and blood group.
+2. Upload a recent blood test report and name the hospital that tested you.
+3. A hospital reviews the report and approves you as a verified donor.
+Hospitals can only find you in donor searches once you are verified."""),
+    (('what is my verification status', 'report pending approved rejected', 'when will my report be reviewed'),
+     """**Verification Status:**
+Your dashboard shows whether your blood test report is pending, approved or rejected.
+• **Pending:** a hospital has not reviewed it yet. You can remove it within 30 minutes of uploading and upload another.
+• **Approved:** you are a verified donor.
+• **Rejected:** contact the hospital that reviewed it."""),
+    (('how do I change my profile details', 'update phone number city address', 'edit my information'),
+     """**Updating Your Profile:**
+Open **Edit Profile** from your dashboard to change your contact number, city, state, pincode and health details."""),
+    (('when am I eligible to donate next', 'next eligible date', 'can I donate now'),
+     """**Your Next Donation:**
+After a hospital records your donation, BloodLink works out when you can donate again from the donation type (whole blood: 3 months for men, 4 months for women).
+Hospitals only contact donors who are eligible on the day."""),
+    (('how do emergency requests work', 'urgent blood needed notification', 'why did I get an sms from a hospital'),
+     """**Emergency Requests:**
+Hospitals can post an urgent request for a blood group. Verified donors with a compatible blood group, who are eligible to donate and live in the area, are notified with the hospital's contact number.
+If you can help, call the hospital directly."""),
+)
+
+
+def tokenize(text):
+    tokens = []
+    for token in _token_pattern.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        # Crude plural folding: donors -> donor, donations -> donation
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class AnswerIndex:
+    """TF-IDF matrix (rows x vocabulary), rows L2-normalized; each row belongs to one entry."""
+
+    def __init__(self, entries):
+        """entries: one sequence of texts (phrasings, answer) per entry."""
+        documents = [text for texts in entries for text in texts]
+        self.row_entries = np.fromiter((i for i, texts in enumerate(entries) for _ in texts), dtype=np.int64,
+                                       count=len(documents))
+        tokenized = [tokenize(document) for document in documents]
+        self.vocabulary = {token: i for i, token in enumerate(sorted({t for doc in tokenized for t in doc}))}
+        counts = np.zeros((len(tokenized), len(self.vocabulary)))
+        for row, doc in enumerate(tokenized):
+            for token in doc:
+                counts[row, self.vocabulary[token]] += 1
+        document_frequency = (counts > 0).sum(axis=0)
+        self.idf = np.log((1 + len(tokenized)) / (1 + document_frequency)) + 1
+        weights = np.log1p(counts) * self.idf
+        norms = np.linalg.norm(weights, axis=1, keepdims=True)
+        self.matrix = weights / np.where(norms > 0, norms, 1)
+
+    def search(self, text):
+        """(entry, score) of the best matching entry; (None, 0.0) when no word of the text is indexed."""
+        columns = {}
+        for token in tokenize(text):
+            column = self.vocabulary.get(token)
+            if column is not None:
+                columns[column] = columns.get(column, 0) + 1
+        if not columns:
+            return None, 0.0
+        index = np.fromiter(columns, dtype=np.int64, count=len(columns))
+        query = np.log1p(np.fromiter(columns.values(), dtype=np.float64, count=len(columns))) * self.idf[index]
+        scores = self.matrix[:, index] @ (query / np.linalg.norm(query))
+        row = int(scores.argmax())
+        return int(self.row_entries[row]), float(scores[row])
@@ -0,0 +1,99 @@
+"""Duplicate donor detection.
+
+Every donor row stores normalized keys next to the raw fields:
+
+- phone_key: the contact number's digits without the +91 / 0 prefix
+- name_key: the name lowercased, without titles and punctuation, tokens sorted
+  (so "Kumar, Ravi" and "ravi kumar" agree)
+- name_soundex: Soundex code of name_key, which survives most typos
+
+Candidates are found through two indexes instead of comparing every donor:
+the same phone_key, or the same (pincode, name_soundex) block. Only those few
+rows are scored, with trigram similarity of the name keys:
+
+- same phone and a similar name (PHONE_NAME_SIMILARITY, or one name contained
+  in the other): the same person. Registration is refused. A shared family
+  phone with a different name is not
+- same block, a near-identical name (BLOCK_NAME_SIMILARITY) and the same blood
+  group: a possible duplicate. It is recorded for hospital staff to review,
+  because two people with the same name can live in one pincode
+"""
+import re
+import unicodedata
+
+PHONE_NAME_SIMILARITY = 0.4
+BLOCK_NAME_SIMILARITY = 0.7
+# Blocks larger than this are placeholder data (e.g. "0000000000"), not people
+MAX_BLOCK_SIZE = 200
+
+TITLES = frozenset(('mr', 'mrs', 'ms', 'miss', 'dr', 'smt', 'shri', 'sri', 'kum', 'prof'))
+_SOUNDEX_CODES = {letter: str(code) for code, letters in enumerate(
+    ('aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r')) for letter in letters}
+
+
+def normalize_phone(value):
+    digits = re.sub(r'\D', '', value or '')
+    if len(digits) == 12 and digits.startswith('91'):
+        digits = digits[2:]
+    elif len(digits) == 11 and digits.startswith('0'):
+        digits = digits[1:]
+    # Too short to identify anyone
+    return digits if len(digits) >= 7 else ''
+
+
+def normalize_name(value):
+    ascii_name = unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode('ascii')
+    tokens = [token for token in re.findall(r'[a-z]+', ascii_name.lower()) if token not in TITLES]
+    return ' '.join(sorted(tokens))
+
+
+def soundex(text):
+    letters = [letter for letter in text if letter in _SOUNDEX_CODES]
+    if not letters:
+        return ''
+    code, previous = letters[0].upper(), _SOUNDEX_CODES[letters[0]]
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES[letter]
+        if digit != '0' and digit != previous:
+            code += digit
+        # h and w do not separate letters with the same code; vowels do
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def donor_keys(name, contact_number):
+    """(phone_key, name_key, name_soundex) for a donor."""
+    name_key = normalize_name(name)
+    return normalize_phone(contact_number), name_key, soundex(name_key.replace(' ', ''))
+
+
+def _trigrams(name_key):
+    padded = f'  {name_key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_similarity(a, b):
+    """Jaccard similarity of the two name keys' trigrams (0..1)."""
+    if not a or not b:
+        return 0.0
+    left, right = _trigrams(a), _trigrams(b)
+    return len(left & right) / len(left | right)
+
+
+def _same_tokens(a, b):
+    # "ravi" and "kumar ravi": one name is part of the other
+    left, right = set(a.split()), set(b.split())
+    return bool(left and right) and (left <= right or right <= left)
+
+
+def match_reason(donor, other):
+    """'phone', 'name' or None for two donors given as objects with the key columns and blood_group."""
+    similarity = name_similarity(donor.name_key, other.name_key)
+    if donor.phone_key and donor.phone_key == other.phone_key and (
+            similarity >= PHONE_NAME_SIMILARITY or _same_tokens(donor.name_key, other.name_key)):
+        return 'phone'
+    if (donor.name_soundex and donor.name_soundex == other.name_soundex and donor.pincode == other.pincode
+            and donor.blood_group == other.blood_group and similarity >= BLOCK_NAME_SIMILARITY):
+        return 'name'
+    return None
@@ -0,0 +1,176 @@
+"""Columnar in-memory snapshot of verified donors.
+
+Donor search and emergency matching only filter on a handful of columns, so
+the verified donors are held as parallel NumPy arrays sorted by donor id:
+
+- blood group code (index into forecasting.BLOOD_GROUPS)
+- city and state as interned ids (lowercased, so matching ignores case)
+- pincode as an integer (-1 when it is not numeric)
+- next eligible date in epoch microseconds (0 = eligible now)
+
+A search is a handful of vectorized masks; city and state substring filters
+are resolved against the small vocabularies first. Matching returns donor ids,
+and the caller loads the rows it displays.
+
+Changes are patched in place: `apply` upserts verified donors and marks
+donors that are no longer verified as removed. Removed slots are compacted away once
+they make up a quarter of the arrays.
+"""
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from forecasting import BLOOD_GROUPS, GROUP_INDEX
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_micros(value):
+    return 0 if value is None else (value - EPOCH) // MICROSECOND
+
+
+def parse_pincode(value):
+    value = (value or '').strip()
+    return int(value) if value.isdigit() and len(value) <= 9 else -1
+
+
+class Vocabulary:
+    """Interned lowercase strings; ids are positions in `values`."""
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def intern(self, value):
+        key = (value or '').lower()
+        vocab_id = self.ids.get(key)
+        if vocab_id is None:
+            vocab_id = self.ids[key] = len(self.values)
+            self.values.append(key)
+        return vocab_id
+
+    def containing(self, needle):
+        """Ids of the values containing needle (SQL ilike '%needle%')."""
+        needle = needle.lower()
+        return [i for i, value in enumerate(self.values) if needle in value]
+
+    def exact(self, value):
+        return self.ids.get((value or '').lower(), -1)
+
+
+class DonorSnapshot:
+    # Rows for load/apply: (id, blood_group, city, state, pincode, next_eligible_at, is_verified_donor)
+
+    def __init__(self):
+        self.cities = Vocabulary()
+        self.states = Vocabulary()
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.groups = np.zeros(0, dtype=np.int8)
+        self.city_ids = np.zeros(0, dtype=np.int32)
+        self.state_ids = np.zeros(0, dtype=np.int32)
+        self.pincodes = np.zeros(0, dtype=np.int32)
+        self.eligible_at = np.zeros(0, dtype=np.int64)
+        self.active = np.zeros(0, dtype=bool)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return int(self.active.sum())
+
+    def _columns(self, rows):
+        rows = list(rows)
+        count = len(rows)
+        return rows, {
+            'ids': np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+            'groups': np.fromiter((GROUP_INDEX.get(row[1], -1) for row in rows), dtype=np.int8, count=count),
+            'city_ids': np.fromiter((self.cities.intern(row[2]) for row in rows), dtype=np.int32, count=count),
+            'state_ids': np.fromiter((self.states.intern(row[3]) for row in rows), dtype=np.int32, count=count),
+            'pincodes': np.fromiter((parse_pincode(row[4]) for row in rows), dtype=np.int32, count=count),
+            'eligible_at': np.fromiter((to_micros(row[5]) for row in rows), dtype=np.int64, count=count),
+            'active': np.fromiter((bool(row[6]) for row in rows), dtype=bool, count=count),
+        }
+
+    def load(self, rows):
+        """Replace the contents with rows of verified donors."""
+        _, columns = self._columns(rows)
+        order = np.argsort(columns['ids'], kind='stable')
+        with self.lock:
+            for name, values in columns.items():
+                setattr(self, name, values[order])
+
+    def apply(self, rows):
+        """Patch in changed donors: verified ones are inserted or updated, the rest removed."""
+        rows, columns = self._columns(rows)
+        if not rows:
+            return
+        with self.lock:
+            positions = np.searchsorted(self.ids, columns['ids'])
+            in_range = positions < len(self.ids)
+            present = np.zeros(len(rows), dtype=bool)
+            present[in_range] = self.ids[positions[in_range]] == columns['ids'][in_range]
+
+            # Donors already in the arrays are updated in place (deactivated when no longer verified)
+            for name, values in columns.items():
+                getattr(self, name)[positions[present]] = values[present]
+
+            # Newly verified donors are inserted at their sorted position
+            new = ~present & columns['active']
+            if new.any():
+                new_ids, first = np.unique(columns['ids'][new], return_index=True)
+                at = np.searchsorted(self.ids, new_ids)
+                for name, values in columns.items():
+                    setattr(self, name, np.insert(getattr(self, name), at, values[new][first]))
+
+            if len(self.active) and (~self.active).sum() * 4 > len(self.active):
+                for name in columns:
+                    setattr(self, name, getattr(self, name)[self.active])
+
+    def match(self, blood_groups=None, city='', state='', city_exact=None, state_exact=None, pincode=None,
+              eligible_at=None):
+        """Ids of verified donors matching every given filter, in ascending order.
+
+        city/state are substring filters (dashboard search), city_exact/state_exact
+        case-insensitive equality (emergency matching), eligible_at keeps donors
+        whose next eligible date is at or before it.
+        """
+        with self.lock:
+            mask = self.active.copy()
+            if blood_groups:
+                mask &= self._any_equal(self.groups, [GROUP_INDEX[g] for g in blood_groups if g in GROUP_INDEX])
+            if city:
+                mask &= self._any_equal(self.city_ids, self.cities.containing(city))
+            if state:
+                mask &= self._any_equal(self.state_ids, self.states.containing(state))
+            if city_exact is not None:
+                mask &= self.city_ids == self.cities.exact(city_exact)
+            if state_exact is not None:
+                mask &= self.state_ids == self.states.exact(state_exact)
+            if pincode is not None:
+                mask &= self.pincodes == parse_pincode(pincode)
+            if eligible_at is not None:
+                mask &= self.eligible_at <= to_micros(eligible_at)
+            return self.ids.take(np.flatnonzero(mask))
+
+    @staticmethod
+    def _any_equal(column, codes):
+        # A few equality passes are much faster than np.isin or a lookup-table gather on small codes
+        if len(codes) > 16:
+            return np.isin(column, codes)
+        mask = np.zeros(len(column), dtype=bool)
+        for code in codes:
+            mask |= column == code
+        return mask
+
+    def stats(self):
+        with self.lock:
+            arrays = (self.ids, self.groups, self.city_ids, self.state_ids, self.pincodes, self.eligible_at, self.active)
+            return {
+                'donors': int(self.active.sum()),
+                'slots': len(self.ids),
+                'cities': len(self.cities.values),
+                'states': len(self.states.values),
+                'bytes': int(sum(array.nbytes for array in arrays)),
+                'blood_groups': {group: int(((self.groups == i) & self.active).sum())
+                                 for i, group in enumerate(BLOOD_GROUPS)},
+            }
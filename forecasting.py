@@ -0,0 +1,130 @@
+"""Blood demand / supply forecasting per hospital.
+
+Daily usage and donation units are kept as (blood group x day) NumPy matrices
+per hospital. New records are added to the matrices as they arrive (rows with
+an id above the last one seen, plus recently written rows, since a transaction
+that commits late holds a lower id; ids already counted are skipped), and every
+statistic is a vectorized operation over the matrices:
+
+- stock:       all donations minus all usage, per blood group
+- demand:      mean daily usage over the last WINDOW_DAYS days
+- supply:      mean daily donations over the same window
+- days left:   stock / (demand - supply) when usage outpaces donations
+
+Groups whose projected stock runs out within SHORTAGE_DAYS are reported as
+shortage warnings.
+"""
+import re
+import threading
+from datetime import date, datetime
+
+import numpy as np
+
+BLOOD_GROUPS = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+GROUP_INDEX = {group: i for i, group in enumerate(BLOOD_GROUPS)}
+WINDOW_DAYS = 28
+SHORTAGE_DAYS = 7
+CRITICAL_DAYS = 3
+
+_units_pattern = re.compile(r'\d+(?:\.\d+)?')
+
+
+def parse_units(text):
+    # Units are free text ("1", "0.5", "2 units"); a missing value counts as one unit
+    match = _units_pattern.search(text or '')
+    return float(match.group()) if match else 1.0
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+class HospitalSeries:
+    """Daily usage and supply matrices for one hospital, grown incrementally."""
+
+    def __init__(self):
+        self.start = None
+        self.usage = np.zeros((len(BLOOD_GROUPS), 0))
+        self.supply = np.zeros((len(BLOOD_GROUPS), 0))
+        self.last_ids = {'usage': 0, 'supply': 0}
+        self.counted = {'usage': set(), 'supply': set()}
+        self.loaded_at = None   # when the last finished load started reading
+        self.cached = None      # (cache_key, summary) of the last load
+        self.lock = threading.Lock()
+
+    def _ensure_range(self, first_day, last_day):
+        # Pads the matrices with empty days so both dates fall inside them
+        if self.start is None:
+            self.start = first_day
+        if first_day < self.start:
+            pad = (self.start - first_day).days
+            self.usage = np.pad(self.usage, ((0, 0), (pad, 0)))
+            self.supply = np.pad(self.supply, ((0, 0), (pad, 0)))
+            self.start = first_day
+        needed = (last_day - self.start).days + 1
+        if needed > self.usage.shape[1]:
+            extra = needed - self.usage.shape[1]
+            self.usage = np.pad(self.usage, ((0, 0), (0, extra)))
+            self.supply = np.pad(self.supply, ((0, 0), (0, extra)))
+
+    def add(self, kind, rows):
+        """Add (id, date, blood_group, units_text) rows to the 'usage' or 'supply' matrix.
+
+        Rows whose id was already added are skipped, so overlapping loads can run side by side.
+        """
+        rows = [row for row in rows if row[2] in GROUP_INDEX and row[1] is not None]
+        with self.lock:
+            counted = self.counted[kind]
+            rows = list({row[0]: row for row in rows if row[0] not in counted}.values())
+            if not rows:
+                return
+            ids, dates, groups, units = zip(*rows)
+            counted.update(ids)
+            days = [_as_date(d) for d in dates]
+            self._ensure_range(min(days), max(days))
+            offsets = np.fromiter(((d - self.start).days for d in days), dtype=np.int64, count=len(days))
+            group_idx = np.fromiter((GROUP_INDEX[g] for g in groups), dtype=np.int64, count=len(groups))
+            values = np.fromiter((parse_units(u) for u in units), dtype=np.float64, count=len(units))
+            np.add.at(getattr(self, kind), (group_idx, offsets), values)
+            self.last_ids[kind] = max(self.last_ids[kind], max(ids))
+
+    def loaded(self, started, cache_key, summary):
+        """Record a finished load that began reading at `started`."""
+        with self.lock:
+            self.loaded_at = max(self.loaded_at or started, started)
+            self.cached = (cache_key, summary)
+
+    def summary(self, today=None, window=WINDOW_DAYS):
+        today = today or date.today()
+        with self.lock:
+            if self.start is None:
+                return []
+            self._ensure_range(today, today)
+            end = (today - self.start).days + 1
+            usage = self.usage[:, :end]
+            supply = self.supply[:, :end]
+            stock = np.clip(supply.sum(axis=1) - usage.sum(axis=1), 0, None)
+            span = min(window, end)
+            demand = usage[:, -span:].sum(axis=1) / span
+            inflow = supply[:, -span:].sum(axis=1) / span
+
+        net_burn = demand - inflow
+        with np.errstate(divide='ignore'):
+            days_left = np.where(net_burn > 0, stock / np.where(net_burn > 0, net_burn, 1), np.inf)
+
+        return [{
+            'blood_group': group,
+            'stock_units': round(float(stock[i]), 2),
+            'daily_demand': round(float(demand[i]), 3),
+            'daily_supply': round(float(inflow[i]), 3),
+            'days_of_stock': None if np.isinf(days_left[i]) else round(float(days_left[i]), 1),
+        } for i, group in enumerate(BLOOD_GROUPS) if demand[i] > 0 or stock[i] > 0]
+
+
+def shortage_warnings(summary, threshold=SHORTAGE_DAYS):
+    warnings = []
+    for row in summary:
+        days = row['days_of_stock']
+        if row['daily_demand'] > 0 and days is not None and days < threshold:
+            warnings.append(dict(row, level='critical' if days < CRITICAL_DAYS else 'warning'))
+    return sorted(warnings, key=lambda row: row['days_of_stock'])
@@ -0,0 +1,42 @@
+"""gunicorn settings for BloodLink.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every value can be overridden through the environment (or gunicorn's own
+command line flags). Cache invalidation counters are always shared through
+SQLite (see shared_state.py); with more than one worker the rate limits are
+switched to the SQLite backend as well, so they agree across processes.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# Requests mostly wait on SQLite, bcrypt and outbound HTTP: (2 x cores) + 1 processes,
+# each with a few threads for the background broadcast and chatbot calls
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so per-process caches cannot grow without bound
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+# Load the app once in the master: tables are created a single time and workers share its memory
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+if workers > 1:
+    os.environ.setdefault('SHARED_STATE', 'sqlite')
+
+
+def post_fork(server, worker):
+    # Pooled database connections opened in the master must not be reused by the children
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,95 @@
+"""Unit-level blood inventory with shelf life and first-expiring-first allocation.
+
+Every donation is split into unit lots (one per started unit) whose expiry date
+depends on the component's shelf life. A hospital's available units sit in one
+min-heap per (blood group, component), ordered by expiry date, so picking the
+next unit to use costs O(log n) however much stock there is.
+
+The inventory_units table in app.py is the authority. The heaps only hold
+candidates: the caller claims each popped unit with a conditional UPDATE, so a
+unit that another worker process already used is simply skipped. Units that
+are already past expiry are skipped as well; `flask check-inventory` marks them
+expired and flags units that expire within NEAR_EXPIRY_DAYS.
+"""
+import heapq
+import math
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+# Storage shelf life in days (whole blood in CPDA-1, red cells in additive solution,
+# plasma frozen, platelets at room temperature)
+SHELF_LIFE_DAYS = {
+    'Whole Blood': 35,
+    'Double Red Cells': 42,
+    'Plasma': 365,
+    'Platelets': 5,
+}
+DEFAULT_COMPONENT = 'Whole Blood'
+
+# Units are flagged this many days before they expire
+NEAR_EXPIRY_DAYS = {
+    'Whole Blood': 7,
+    'Double Red Cells': 7,
+    'Plasma': 30,
+    'Platelets': 1,
+}
+
+
+def component_for(donation_type):
+    # Donations without a recognised type are stocked as whole blood
+    return donation_type if donation_type in SHELF_LIFE_DAYS else DEFAULT_COMPONENT
+
+
+def expiry_for(component, collected_at):
+    return collected_at + timedelta(days=SHELF_LIFE_DAYS[component])
+
+
+def near_expiry_window(component):
+    return timedelta(days=NEAR_EXPIRY_DAYS[component])
+
+
+def unit_count(units_text):
+    from forecasting import parse_units
+    # "0.5" still fills a bag; "2.5" is three
+    return max(1, math.ceil(parse_units(units_text)))
+
+
+def components_for_usage(usage_type):
+    # A usage recorded as a component draws on that component only, otherwise on any
+    return [usage_type] if usage_type in SHELF_LIFE_DAYS else list(SHELF_LIFE_DAYS)
+
+
+class HospitalStock:
+    """Min-heaps of (expires_at, unit_id) per (blood group, component) for one hospital."""
+
+    def __init__(self):
+        self.heaps = defaultdict(list)
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def add(self, rows):
+        """Push (unit_id, blood_group, component, expires_at) rows of available units."""
+        for unit_id, blood_group, component, expires_at in rows:
+            heapq.heappush(self.heaps[(blood_group, component)], (expires_at, unit_id))
+            self.last_id = max(self.last_id, unit_id)
+
+    def take(self, blood_group, components, count, now, claim):
+        """Pop first-expiring units until `count` were claimed; returns their ids.
+
+        claim(unit_id) must return False when the unit is no longer available
+        in the database. Call with `lock` held.
+        """
+        heaps = [self.heaps[(blood_group, component)] for component in components]
+        taken = []
+        while len(taken) < count:
+            for heap in heaps:
+                while heap and heap[0][0] <= now:
+                    heapq.heappop(heap)  # expired; check-inventory marks it
+            candidates = [heap for heap in heaps if heap]
+            if not candidates:
+                break
+            expires_at, unit_id = heapq.heappop(min(candidates, key=lambda heap: heap[0]))
+            if claim(unit_id):
+                taken.append(unit_id)
+        return taken
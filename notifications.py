@@ -0,0 +1,173 @@
+"""Emergency donor notification fan-out.
+
+Senders are pluggable: each one delivers a batch of notifications over one
+channel (SMS gateway, webhook, ...). The Broadcaster splits the recipient list
+into batches, runs them on a thread pool and throttles every channel with a
+shared token bucket so a large broadcast cannot exceed the provider's limits.
+
+LocalStubSender keeps messages in memory and is used in development, tests
+and the `flask emergency-benchmark` command.
+"""
+import math
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+Notification = namedtuple('Notification', 'id recipient message')
+DeliveryResult = namedtuple('DeliveryResult', 'notification_id ok error latency')
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        # Blocks until the tokens are available; requests larger than the bucket are split
+        while tokens > 0:
+            chunk = min(tokens, self.capacity)
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= chunk:
+                    self.tokens -= chunk
+                    tokens -= chunk
+                    continue
+                wait = (chunk - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class NotificationSender:
+    channel = 'base'
+    batch_size = 100
+    rate_per_second = 50
+
+    def send_batch(self, notifications):
+        """Deliver notifications; return {notification_id: error or None}."""
+        raise NotImplementedError
+
+
+class LocalStubSender(NotificationSender):
+    channel = 'local'
+    batch_size = 500
+    rate_per_second = 100000
+
+    def __init__(self, fail_recipients=()):
+        self.sent = []
+        self.fail_recipients = set(fail_recipients)
+        self.lock = threading.Lock()
+
+    def send_batch(self, notifications):
+        results = {}
+        with self.lock:
+            for notification in notifications:
+                if notification.recipient in self.fail_recipients:
+                    results[notification.id] = 'stub failure'
+                else:
+                    self.sent.append(notification)
+                    results[notification.id] = None
+        return results
+
+
+class WebhookSender(NotificationSender):
+    """Posts each batch as JSON to an SMS/notification gateway."""
+    channel = 'webhook'
+
+    def __init__(self, url, token=None, batch_size=100, rate_per_second=50, timeout=10):
+        import requests  # only webhook deployments pay for the HTTP client
+        self.url = url
+        self.batch_size = batch_size
+        self.rate_per_second = rate_per_second
+        self.timeout = timeout
+        self.session = requests.Session()
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def send_batch(self, notifications):
+        import requests
+        payload = {'messages': [{'id': n.id, 'to': n.recipient, 'body': n.message} for n in notifications]}
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            return {n.id: str(e) for n in notifications}
+        if response.status_code >= 300:
+            return {n.id: f'HTTP {response.status_code}' for n in notifications}
+        return {n.id: None for n in notifications}
+
+
+SENDERS = {
+    'local': LocalStubSender,
+    'webhook': WebhookSender,
+}
+
+_channel_buckets = {}
+_channel_buckets_lock = threading.Lock()
+
+
+def get_channel_bucket(sender):
+    # One bucket per channel, shared by every broadcast in the process
+    with _channel_buckets_lock:
+        bucket = _channel_buckets.get(sender.channel)
+        if bucket is None:
+            bucket = TokenBucket(sender.rate_per_second, max(sender.rate_per_second, sender.batch_size))
+            _channel_buckets[sender.channel] = bucket
+        return bucket
+
+
+class Broadcaster:
+    def __init__(self, sender, max_workers=8, bucket=None):
+        self.sender = sender
+        self.max_workers = max_workers
+        self.bucket = bucket  # defaults to the process-wide channel bucket
+
+    def _send(self, batch, bucket, started):
+        bucket.acquire(len(batch))
+        try:
+            errors = self.sender.send_batch(batch)
+        except Exception as e:  # a broken sender fails its batch, not the broadcast
+            errors = {n.id: str(e) for n in batch}
+        latency = time.monotonic() - started
+        return [DeliveryResult(n.id, errors.get(n.id) is None, errors.get(n.id), latency) for n in batch]
+
+    def broadcast(self, notifications, on_batch_done=None):
+        """Send all notifications; on_batch_done(results) runs in the calling thread per batch."""
+        started = time.monotonic()
+        bucket = self.bucket or get_channel_bucket(self.sender)
+        size = self.sender.batch_size
+        batches = [notifications[i:i + size] for i in range(0, len(notifications), size)]
+
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._send, batch, bucket, started) for batch in batches]
+            for future in as_completed(futures):
+                batch_results = future.result()
+                results.extend(batch_results)
+                if on_batch_done:
+                    on_batch_done(batch_results)
+        return results
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
@@ -0,0 +1,293 @@
+"""State-partitioned donor and activity data (PARTITIONING=state).
+
+With partitioning on, donor search and the hospital dashboard read from one
+SQLite file per region instead of the main database:
+
+- donors live in the shard of their own state
+- usage and donation records live in the shard of the recording hospital's
+  state, so a hospital's activity is always read from a single shard
+
+The main database stays the system of record for accounts and logins; app.py
+copies every committed donor, usage and donation change to its shard, and
+`flask rebalance-shards` rebuilds all shard files from it. A shard map
+(shard_map.json in SHARD_DIR) assigns regions to shards. Small states can
+share a shard. Regions missing from the map get a shard of their own on first
+write. Each rebalance writes a new generation directory and switches the map
+to it atomically, so workers never read a half-built shard. The previous
+generation is only deleted after a grace period, once every worker has seen
+the new map and finished the writes it had started on the old one.
+
+ShardRouter sends a query that names a single region to that region's shard,
+and runs cross-region searches on every matching shard in parallel, then
+merges the results.
+"""
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+MAP_FILE = 'shard_map.json'
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+DONOR_COLUMNS = ('id', 'name', 'age', 'gender', 'blood_group', 'city', 'state', 'pincode', 'contact_number',
+                 'diseases', 'email', 'is_verified_donor', 'next_eligible_at')
+USAGE_COLUMNS = ('id', 'donor_id', 'hospital_id', 'date', 'blood_units', 'usage_type', 'notes')
+DONATION_COLUMNS = ('id', 'donor_id', 'hospital_id', 'date', 'donation_units', 'donation_type', 'notes')
+
+# Attribute names match the ORM models, so the dashboard templates render either
+ShardDonor = namedtuple('ShardDonor', DONOR_COLUMNS)
+ShardUsage = namedtuple('ShardUsage', USAGE_COLUMNS)
+ShardDonation = namedtuple('ShardDonation', DONATION_COLUMNS)
+
+TABLES = {
+    'donors': (DONOR_COLUMNS, ShardDonor, ('next_eligible_at',)),
+    'blood_usage': (USAGE_COLUMNS, ShardUsage, ('date',)),
+    'donations': (DONATION_COLUMNS, ShardDonation, ('date',)),
+}
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS donors (id INTEGER PRIMARY KEY, name TEXT, age INTEGER, gender TEXT, '
+    'blood_group TEXT, city TEXT, state TEXT, pincode TEXT, contact_number TEXT, diseases TEXT, email TEXT, '
+    'is_verified_donor INTEGER, next_eligible_at TEXT)',
+    'CREATE INDEX IF NOT EXISTS ix_donors_verified_group ON donors (is_verified_donor, blood_group)',
+    'CREATE TABLE IF NOT EXISTS blood_usage (id INTEGER PRIMARY KEY, donor_id INTEGER, hospital_id INTEGER, '
+    'date TEXT, blood_units TEXT, usage_type TEXT, notes TEXT)',
+    'CREATE INDEX IF NOT EXISTS ix_blood_usage_hospital ON blood_usage (hospital_id, date)',
+    'CREATE TABLE IF NOT EXISTS donations (id INTEGER PRIMARY KEY, donor_id INTEGER, hospital_id INTEGER, '
+    'date TEXT, donation_units TEXT, donation_type TEXT, notes TEXT)',
+    'CREATE INDEX IF NOT EXISTS ix_donations_hospital ON donations (hospital_id)',
+)
+
+
+def region_key(state):
+    return ' '.join((state or '').split()).lower()
+
+
+def shard_name(region):
+    return re.sub(r'[^a-z0-9]+', '-', region_key(region)).strip('-') or 'unknown'
+
+
+def plan_shards(loads, max_shards=None):
+    """Assign regions to at most max_shards shards, balancing the row counts in `loads`.
+
+    Largest regions are placed first, each into the currently lightest shard. A
+    shard holding a single region is named after it; shared shards are numbered.
+    """
+    regions = sorted(loads, key=lambda region: (-loads[region], region))
+    if not max_shards or max_shards >= len(regions):
+        return {region: shard_name(region) for region in regions}
+    bins = [[0, []] for _ in range(max(1, max_shards))]
+    for region in regions:
+        lightest = min(bins, key=lambda b: b[0])
+        lightest[0] += loads[region]
+        lightest[1].append(region)
+    plan = {}
+    for i, (_, members) in enumerate(bins):
+        name = shard_name(members[0]) if len(members) == 1 else f'shard-{i:02d}'
+        for region in members:
+            plan[region] = name
+    return plan
+
+
+def format_datetime(value):
+    return value.strftime(DATETIME_FORMAT) if value is not None else None
+
+
+def _parse_datetime(value):
+    return datetime.strptime(value, DATETIME_FORMAT) if value else None
+
+
+def _to_tuple(table, row):
+    columns, tuple_type, datetime_columns = TABLES[table]
+    values = dict(zip(columns, row))
+    for column in datetime_columns:
+        values[column] = _parse_datetime(values[column])
+    return tuple_type(**values)
+
+
+class ShardRouter:
+    def __init__(self, directory, max_workers=8):
+        self.directory = os.path.abspath(directory)
+        self.map_path = os.path.join(self.directory, MAP_FILE)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.map_mtime = None
+        self.generation = 0
+        self.regions = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='shard')
+        os.makedirs(self.directory, exist_ok=True)
+        self._refresh()
+
+    # -- shard map -------------------------------------------------------------
+
+    def _refresh(self):
+        # A rebalance in any process replaces the map file; stat() on every call picks it up
+        try:
+            mtime = os.stat(self.map_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.map_mtime:
+            return
+        with self.lock:
+            if mtime is None:
+                self.generation, self.regions = 0, {}
+            else:
+                with open(self.map_path) as f:
+                    shard_map = json.load(f)
+                self.generation, self.regions = shard_map['generation'], shard_map['regions']
+            self.map_mtime = mtime
+
+    def generation_dir(self, generation=None):
+        return os.path.join(self.directory, f'gen-{self.generation if generation is None else generation}')
+
+    def shard_for(self, state):
+        self._refresh()
+        region = region_key(state)
+        return self.regions.get(region) or shard_name(region)
+
+    def shards(self):
+        """Every shard of the current generation: mapped ones and those created on first write."""
+        self._refresh()
+        names = set(self.regions.values())
+        directory = self.generation_dir()
+        if os.path.isdir(directory):
+            names.update(name[:-3] for name in os.listdir(directory) if name.endswith('.db'))
+        return sorted(names)
+
+    def shards_matching(self, state_filter):
+        # The dashboard filters states by substring, so route to every region containing it
+        needle = region_key(state_filter)
+        if not needle:
+            return self.shards()
+        matching = {shard for region, shard in self.regions.items() if needle in region}
+        matching.update(shard for shard in self.shards() if shard not in self.regions.values()
+                        and needle.replace(' ', '-') in shard)
+        return sorted(matching)
+
+    # -- connections -----------------------------------------------------------
+
+    def connect(self, shard, generation=None):
+        generation = self.generation if generation is None else generation
+        path = os.path.join(self.generation_dir(generation), f'{shard}.db')
+        connections = getattr(self.local, 'connections', None)
+        if connections is None or self.local.pid != os.getpid():
+            connections = self.local.connections = {}
+            self.local.pid = os.getpid()
+        # Connections to generations that were switched away from would keep deleted files open
+        for key in [key for key in connections if key[0] not in (generation, self.generation)]:
+            connections.pop(key).close()
+        conn = connections.get((generation, path))
+        if conn is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = sqlite3.connect(path, timeout=10.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            connections[generation, path] = conn
+        return conn
+
+    def scatter(self, shards, query):
+        """Run query(connection) on every shard, in parallel when there is more than one."""
+        if len(shards) <= 1:
+            return [query(self.connect(shard)) for shard in shards]
+        generation = self.generation
+        return list(self.executor.map(lambda shard: query(self.connect(shard, generation)), shards))
+
+    # -- reads -----------------------------------------------------------------
+
+    def search_donors(self, blood_group='', city='', state='', eligible_at=None):
+        """Verified donors matching the dashboard filters (substring match on city and state)."""
+        sql = f"SELECT {', '.join(DONOR_COLUMNS)} FROM donors WHERE is_verified_donor = 1"
+        params = []
+        if blood_group:
+            sql += ' AND blood_group = ?'
+            params.append(blood_group)
+        if city:
+            sql += ' AND city LIKE ?'
+            params.append(f'%{city}%')
+        if state:
+            sql += ' AND state LIKE ?'
+            params.append(f'%{state}%')
+        if eligible_at is not None:
+            sql += ' AND (next_eligible_at IS NULL OR next_eligible_at <= ?)'
+            params.append(format_datetime(eligible_at))
+        results = self.scatter(self.shards_matching(state), lambda conn: conn.execute(sql, params).fetchall())
+        return sorted((_to_tuple('donors', row) for rows in results for row in rows), key=lambda d: d.id)
+
+    def verified_blood_groups(self):
+        results = self.scatter(self.shards(), lambda conn: conn.execute(
+            'SELECT DISTINCT blood_group FROM donors WHERE is_verified_donor = 1').fetchall())
+        return sorted({row[0] for rows in results for row in rows})
+
+    def hospital_activity(self, hospital_state, hospital_id):
+        """(usage, donations) recorded by one hospital; both live in the shard of its state."""
+        conn = self.connect(self.shard_for(hospital_state))
+        usage = conn.execute(f"SELECT {', '.join(USAGE_COLUMNS)} FROM blood_usage WHERE hospital_id = ? "
+                             'ORDER BY date DESC', (hospital_id,)).fetchall()
+        donations = conn.execute(f"SELECT {', '.join(DONATION_COLUMNS)} FROM donations WHERE hospital_id = ?",
+                                 (hospital_id,)).fetchall()
+        return [_to_tuple('blood_usage', row) for row in usage], [_to_tuple('donations', row) for row in donations]
+
+    # -- writes ----------------------------------------------------------------
+
+    def write(self, table, rows_by_shard, delete_ids=(), generation=None):
+        """Upsert rows (tuples in TABLES column order) into their shards.
+
+        delete_ids are removed from every other shard first, for rows whose
+        region changed and rows deleted from the main database.
+        """
+        columns = TABLES[table][0]
+        insert = (f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                  f"VALUES ({', '.join('?' * len(columns))})")
+        shards = set(rows_by_shard)
+        if delete_ids:
+            shards.update(self.shards() if generation is None else ())
+        for shard in sorted(shards):
+            conn = self.connect(shard, generation)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                keep = {row[0] for row in rows_by_shard.get(shard, ())}
+                stale = [(row_id,) for row_id in delete_ids if row_id not in keep]
+                if stale:
+                    conn.executemany(f'DELETE FROM {table} WHERE id = ?', stale)
+                conn.executemany(insert, rows_by_shard.get(shard, ()))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def activate(self, generation, regions):
+        """Point every process at a freshly built generation; the older ones stay until drop_old_generations()."""
+        tmp_path = self.map_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'generation': generation, 'regions': regions}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.map_path)
+        self._refresh()
+
+    def drop_old_generations(self):
+        """Delete every generation but the current one.
+
+        Only safe once workers had time to see the new map: a write that started
+        before the switch still goes to the old generation.
+        """
+        self._refresh()
+        for name in os.listdir(self.directory):
+            if name.startswith('gen-') and name != f'gen-{self.generation}':
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def next_generation(self):
+        self._refresh()
+        generation = self.generation + 1
+        shutil.rmtree(self.generation_dir(generation), ignore_errors=True)
+        return generation
+
+    def close(self):
+        for conn in (getattr(self.local, 'connections', None) or {}).values():
+            conn.close()
+        self.local.connections = {}
@@ -0,0 +1,161 @@
+"""State that has to agree across worker processes.
+
+Rendered fragments, forecasts and the donor snapshot are cached per process,
+but they are keyed on data-version counters. Those counters must be seen by
+every process that changes data: all gunicorn workers, and the `flask ...` jobs
+(archive-history, recompute-eligibility, dedup-donors) that run on their own.
+Otherwise a change made elsewhere would leave a process's caches stale. app.py
+therefore always keeps them in a SQLiteState.
+
+The token buckets that rate limit logins, the chatbot and outgoing
+notifications only need sharing under several workers:
+
+- MemoryState:  plain in-process dicts (development server, single worker)
+- SQLiteState:  a small SQLite file next to the database, safe across processes
+                and threads; it stands in for Redis on a single host
+
+Select one for the buckets with SHARED_STATE=memory|sqlite (see app.py).
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from notifications import TokenBucket
+
+
+class MemoryState:
+    def __init__(self, max_buckets=100000):
+        self.counters = {}
+        # Per-IP/per-account buckets come and go; the least recently used are dropped (a dropped bucket restarts full)
+        self.buckets = OrderedDict()
+        self.max_buckets = max_buckets
+        self.lock = threading.Lock()
+
+    def incr(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.counters[key] = self.counters.get(key, 0) + 1
+
+    def get_counters(self, *keys):
+        with self.lock:
+            return tuple(self.counters.get(key, 0) for key in keys)
+
+    def token_bucket(self, key, rate, capacity=None):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(rate, capacity)
+                if len(self.buckets) > self.max_buckets:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+            return bucket
+
+
+class SQLiteState:
+    # Buckets untouched for this long have refilled completely and are deleted
+    bucket_idle_seconds = 3600
+    prune_every = 1000
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        self.takes = 0
+
+    def _connect(self):
+        # One connection per thread and process; connections must not cross a fork.
+        # The file is created on first use, so importing app.py does not touch the disk.
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def incr(self, *keys):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for key in keys:
+                conn.execute('INSERT INTO counters (key, value) VALUES (?, 1) '
+                             'ON CONFLICT(key) DO UPDATE SET value = value + 1', (key,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get_counters(self, *keys):
+        placeholders = ','.join('?' * len(keys))
+        rows = dict(self._connect().execute(
+            f'SELECT key, value FROM counters WHERE key IN ({placeholders})', keys).fetchall())
+        return tuple(rows.get(key, 0) for key in keys)
+
+    def token_bucket(self, key, rate, capacity=None):
+        return SQLiteTokenBucket(self, key, rate, capacity)
+
+    def maybe_prune(self, conn):
+        # Called inside a bucket transaction; keeps one row per active IP/account only
+        self.takes += 1
+        if self.takes % self.prune_every == 0:
+            conn.execute('DELETE FROM buckets WHERE updated < ?', (time.time() - self.bucket_idle_seconds,))
+
+
+class SQLiteTokenBucket:
+    """Same interface as notifications.TokenBucket, with the bucket stored in SQLiteState."""
+
+    def __init__(self, state, key, rate, capacity=None):
+        self.state = state
+        self.key = key
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+
+    def _take(self, tokens):
+        # Returns 0 when the tokens were taken, otherwise the seconds to wait for them
+        conn = self.state._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (self.key,)).fetchone()
+            available = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+            wait = 0.0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait = (tokens - available) / self.rate
+            conn.execute('INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                         'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                         (self.key, available, now))
+            self.state.maybe_prune(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def try_acquire(self, tokens=1):
+        return self._take(tokens) == 0
+
+    def acquire(self, tokens=1):
+        while tokens > 0:
+            chunk = min(tokens, self.capacity)
+            wait = self._take(chunk)
+            if wait:
+                time.sleep(wait)
+            else:
+                tokens -= chunk
+
+
+def open_shared_state(backend, path=None):
+    if backend == 'sqlite':
+        return SQLiteState(path)
+    if backend == 'memory':
+        return MemoryState()
+    raise ValueError(f'Unknown SHARED_STATE backend: {backend}')
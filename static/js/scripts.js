@@ -1,7 +1,14 @@
 // Global variables
 let currentLanguage = 'en';
-let translations = {};
+let translations = window.I18N || {};
 let dashboardStatsInterval;
+let uploadAreaMarkup = null;
+
+// Resolve a static path to its fingerprinted build file when one exists
+function assetUrl(path) {
+    const manifest = window.ASSET_MANIFEST || {};
+    return '/static/' + (manifest[path] || path);
+}
 
 // Initialize the application
 document.addEventListener('DOMContentLoaded', function() {
@@ -57,9 +64,17 @@ function toggleTheme() {
 }
 
 // Enhanced Language Management
+// Pages are translated on the server from the `lang` cookie, so switching language
+// only stores the preference and reloads; no catalog is fetched on the client.
 function initializeLanguage() {
-    const savedLanguage = localStorage.getItem('language') || 'en';
-    changeLanguage(savedLanguage);
+    currentLanguage = document.documentElement.lang || 'en';
+
+    // Carry over a preference saved before the server rendered translations
+    const savedLanguage = localStorage.getItem('language');
+    if (savedLanguage && savedLanguage !== currentLanguage && !getLanguageCookie()) {
+        changeLanguage(savedLanguage);
+        return;
+    }
     
     // Add language change listeners
     const languageButtons = document.querySelectorAll('[data-lang]');
@@ -72,59 +87,26 @@ function initializeLanguage() {
     });
 }
 
-async function changeLanguage(lang) {
-    try {
-        const response = await fetch(`/static/i18n/${lang}.json`);
-        if (response.ok) {
-            translations = await response.json();
-            currentLanguage = lang;
-            localStorage.setItem('language', lang);
-            updatePageText();
-            updateLanguageDisplay(lang);
-            
-            // Update HTML lang attribute
-            document.documentElement.lang = lang;
-            
-            // Trigger custom event for language change
-            window.dispatchEvent(new CustomEvent('languageChanged', { detail: { language: lang } }));
-        }
-    } catch (error) {
-        console.error('Error loading language file:', error);
-        // Fallback to English if language file fails to load
-        if (lang !== 'en') {
-            changeLanguage('en');
-        }
-    }
+function getLanguageCookie() {
+    const match = document.cookie.match(/(?:^|;\s*)lang=([^;]+)/);
+    return match ? match[1] : null;
 }
 
-function updatePageText() {
-    const elements = document.querySelectorAll('[data-i18n]');
-    elements.forEach(element => {
-        const key = element.getAttribute('data-i18n');
-        if (translations[key]) {
-            if (element.tagName === 'INPUT' && element.type === 'submit') {
-                element.value = translations[key];
-            } else if (element.tagName === 'INPUT' && element.hasAttribute('placeholder')) {
-                element.placeholder = translations[key];
-            } else if (element.tagName === 'TEXTAREA' && element.hasAttribute('placeholder')) {
-                element.placeholder = translations[key];
-            } else {
-                element.textContent = translations[key];
-            }
-        }
-    });
-}
+function changeLanguage(lang) {
+    if (lang === currentLanguage && getLanguageCookie() === lang) {
+        return;
+    }
+    localStorage.setItem('language', lang);
+    document.cookie = `lang=${lang}; path=/; max-age=31536000; SameSite=Lax`;
+
+    // Trigger custom event for language change
+    window.dispatchEvent(new CustomEvent('languageChanged', { detail: { language: lang } }));
 
-function updateLanguageDisplay(lang) {
-    const currentLangElement = document.getElementById('currentLang');
-    if (currentLangElement) {
-        const langMap = {
-            'en': 'EN',
-            'kn': 'ಕನ್ನಡ',
-            'hi': 'हिं'
-        };
-        currentLangElement.textContent = langMap[lang] || 'EN';
+    // Cached dashboards were rendered in the previous language
+    if (navigator.serviceWorker && navigator.serviceWorker.controller) {
+        navigator.serviceWorker.controller.postMessage({ type: 'clear-pages' });
     }
+    window.location.reload();
 }
 
 // Enhanced Chatbot Management
@@ -523,6 +505,9 @@ function initializeFileUpload() {
     const uploadArea = document.querySelector('.file-upload-area');
     
     if (fileInput && uploadArea) {
+        // Keep the server-rendered (translated) markup so it can be restored after clearing
+        uploadAreaMarkup = uploadArea.innerHTML;
+
         // Drag and drop functionality
         uploadArea.addEventListener('dragover', (e) => {
             e.preventDefault();
@@ -597,13 +582,8 @@ function clearFileSelection() {
         fileInput.value = '';
     }
     
-    if (uploadArea) {
-        uploadArea.innerHTML = `
-            <i class="fas fa-cloud-upload-alt fa-3x text-muted mb-3"></i>
-            <h5 data-i18n="upload_blood_report">Upload Blood Test Report</h5>
-            <p class="text-muted" data-i18n="drag_drop_or_click">Drag & drop your file here or click to browse</p>
-            <small class="text-muted" data-i18n="supported_formats">Supported formats: PNG, JPG, PDF (Max 16MB)</small>
-        `;
+    if (uploadArea && uploadAreaMarkup) {
+        uploadArea.innerHTML = uploadAreaMarkup;
     }
 }
 
@@ -1133,14 +1113,86 @@ window.addEventListener('beforeunload', function() {
 // Service Worker Registration for PWA capabilities
 if ('serviceWorker' in navigator) {
     window.addEventListener('load', function() {
-        navigator.serviceWorker.register('/static/sw.js')
+        navigator.serviceWorker.register('/sw.js')
             .then(function(registration) {
                 console.log('ServiceWorker registration successful');
             })
             .catch(function(err) {
                 console.log('ServiceWorker registration failed');
             });
+
+        if (new URLSearchParams(window.location.search).get('queued') === '1') {
+            showToast('You are offline. The record was saved and will be sent when the connection returns.', 'warning');
+        }
+
+        // Show queued records the server rejected while this page was closed, and send the
+        // records this account queued before it signed out or another account signed in
+        if (navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage({ type: 'list-failed' });
+            navigator.serviceWorker.controller.postMessage({ type: 'replay-queue' });
+        }
+    });
+
+    navigator.serviceWorker.addEventListener('message', function(event) {
+        if (!event.data) {
+            return;
+        }
+        if (event.data.type === 'replay-saved') {
+            event.data.messages.forEach(function(message) {
+                showToast(escapeHtml(message.text), message.category === 'error' ? 'danger' : message.category);
+            });
+        } else if (event.data.type === 'replay-failed') {
+            showFailedReplays(event.data.entries);
+        }
+    });
+
+    // Replay records that were queued by the service worker while offline
+    window.addEventListener('online', function() {
+        if (navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage({ type: 'replay-queue' });
+        }
+    });
+}
+
+function escapeHtml(text) {
+    const element = document.createElement('div');
+    element.textContent = text;
+    return element.innerHTML;
+}
+
+// Records queued offline that the server rejected; they stay listed until dismissed
+function showFailedReplays(entries) {
+    const main = document.getElementById('main-content');
+    if (!main || !entries.length) {
+        return;
+    }
+    const alert = document.createElement('div');
+    alert.className = 'alert alert-danger alert-dismissible fade show mt-3';
+    alert.setAttribute('role', 'alert');
+    const items = entries.map(function(entry) {
+        const fields = new URLSearchParams(entry.body);
+        const kind = entry.url.indexOf('/donation/') !== -1 ? 'Donation' : 'Blood usage';
+        const units = fields.get('donation_units') || fields.get('blood_units') || '?';
+        const when = [fields.get('donation_date') || fields.get('usage_date'),
+                      fields.get('donation_time') || fields.get('usage_time')].join(' ');
+        return `<li>${kind} for donor #${escapeHtml(fields.get('donor_id') || '?')}, ${escapeHtml(units)} units, ` +
+               `${escapeHtml(when)}: ${escapeHtml(entry.error)}</li>`;
+    });
+    alert.innerHTML = `
+        <i class="fas fa-exclamation-circle me-2"></i>
+        These records were saved offline but the server rejected them. Please enter them again:
+        <ul class="mb-0 mt-2">${items.join('')}</ul>
+        <button type="button" class="btn-close" data-bs-dismiss="alert" aria-label="Close"></button>
+    `;
+    alert.addEventListener('closed.bs.alert', function() {
+        if (navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage({
+                type: 'clear-failed',
+                ids: entries.map(function(entry) { return entry.id; })
+            });
+        }
     });
+    main.prepend(alert);
 }
 
 // Add CSS for animations
@@ -1,55 +1,347 @@
 // Service Worker for BloodLink PWA
-const CACHE_NAME = 'bloodlink-v1.0.0';
+// ASSET_MANIFEST / ASSET_VERSION are prepended by the /sw.js route from static/build/manifest.json
+const ASSET_MANIFEST = self.ASSET_MANIFEST || {};
+const CACHE_VERSION = self.ASSET_VERSION || 'dev';
+const STATIC_CACHE = `bloodlink-static-${CACHE_VERSION}`;
+const PAGES_CACHE = `bloodlink-pages-${CACHE_VERSION}`;
+const staticAssets = [
+  'css/styles.css',
+  'js/scripts.js'
+];
 const urlsToCache = [
   '/',
-  '/static/css/styles.css',
-  '/static/js/scripts.js',
-  '/static/i18n/en.json',
-  '/static/i18n/hi.json',
-  '/static/i18n/kn.json',
+  ...staticAssets.map(assetUrl),
   'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
   'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
   'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css'
 ];
 
+function assetUrl(path) {
+  return '/static/' + (ASSET_MANIFEST[path] || path);
+}
+
+// Dashboards and stats come from the network; the last copy is only used while offline.
+// They hold one account's data, so the copies are dropped when the account changes.
+const networkFirstPaths = [
+  '/dashboard',
+  '/hospital/dashboard',
+  '/api/dashboard_stats'
+];
+
+const loginPaths = ['/login', '/Hospital-Login'];
+
+// Writes that are queued while offline and replayed when connectivity returns
+const queuedPostPaths = [
+  '/hospital/usage/create',
+  '/hospital/donation/create'
+];
+
+const SYNC_TAG = 'bloodlink-replay';
+const QUEUE_DB = 'bloodlink-queue';
+const QUEUE_STORE = 'requests';
+// Queued writes the server rejected, kept until the user has seen them
+const FAILED_STORE = 'failed';
+const ACCOUNT_HEADER = 'X-BloodLink-Account';
+const ACCOUNT_KEY = '/__account__';
+// Which account is signed in now; queued writes only replay for the account that queued them
+const ACCOUNT_URL = '/api/offline-account';
+
 // Install event
 self.addEventListener('install', function(event) {
   event.waitUntil(
-    caches.open(CACHE_NAME)
+    caches.open(STATIC_CACHE)
       .then(function(cache) {
-        console.log('Opened cache');
         return cache.addAll(urlsToCache);
       })
-  );
-});
-
-// Fetch event
-self.addEventListener('fetch', function(event) {
-  event.respondWith(
-    caches.match(event.request)
-      .then(function(response) {
-        // Return cached version or fetch from network
-        if (response) {
-          return response;
-        }
-        return fetch(event.request);
-      }
-    )
+      .then(function() {
+        return self.skipWaiting();
+      })
   );
 });
 
 // Activate event
 self.addEventListener('activate', function(event) {
+  const currentCaches = [STATIC_CACHE, PAGES_CACHE];
   event.waitUntil(
     caches.keys().then(function(cacheNames) {
       return Promise.all(
         cacheNames.map(function(cacheName) {
-          if (cacheName !== CACHE_NAME) {
+          if (!currentCaches.includes(cacheName)) {
             console.log('Deleting old cache:', cacheName);
             return caches.delete(cacheName);
           }
         })
       );
+    }).then(function() {
+      return self.clients.claim();
+    }).then(function() {
+      return replayQueue().catch(function() {});
     })
   );
-});
\ No newline at end of file
+});
+
+// Fetch event
+self.addEventListener('fetch', function(event) {
+  const request = event.request;
+  const url = new URL(request.url);
+  const sameOrigin = url.origin === self.location.origin;
+
+  if (request.method === 'POST') {
+    if (sameOrigin && queuedPostPaths.includes(url.pathname)) {
+      event.respondWith(postOrQueue(request));
+    }
+    return;
+  }
+
+  if (request.method !== 'GET') {
+    return;
+  }
+
+  // Cached pages hold per-user data, drop them when the session ends. Queued writes stay,
+  // but are held back until the account that queued them signs in again.
+  if (sameOrigin && url.pathname === '/logout') {
+    event.waitUntil(caches.delete(PAGES_CACHE));
+    return;
+  }
+
+  if (sameOrigin && networkFirstPaths.includes(url.pathname)) {
+    event.respondWith(networkFirst(request));
+    return;
+  }
+
+  event.respondWith(
+    caches.match(request)
+      .then(function(response) {
+        // Return cached version or fetch from network
+        if (response) {
+          return response;
+        }
+        return fetch(request).catch(function() {
+          return caches.match('/');
+        });
+      })
+  );
+});
+
+// Background sync event
+self.addEventListener('sync', function(event) {
+  if (event.tag === SYNC_TAG) {
+    event.waitUntil(replayQueue());
+  }
+});
+
+// Pages ask for a replay when the browser reports that it is back online, for the
+// rejected writes when they load, and drop cached pages after switching language
+self.addEventListener('message', function(event) {
+  if (!event.data) {
+    return;
+  }
+  if (event.data.type === 'replay-queue') {
+    event.waitUntil(replayQueue().catch(function() {}));
+  } else if (event.data.type === 'clear-pages') {
+    event.waitUntil(caches.delete(PAGES_CACHE));
+  } else if (event.data.type === 'list-failed' && event.source) {
+    event.waitUntil(Promise.all([currentAccount(), readStore(FAILED_STORE)]).then(function(results) {
+      const entries = results[1].filter(function(entry) { return entry.account === results[0]; });
+      if (entries.length) {
+        event.source.postMessage({ type: 'replay-failed', entries: entries });
+      }
+    }));
+  } else if (event.data.type === 'clear-failed') {
+    event.waitUntil(Promise.all((event.data.ids || []).map(function(id) {
+      return deleteFrom(FAILED_STORE, id);
+    })));
+  }
+});
+
+function networkFirst(request) {
+  return fetch(request).then(function(response) {
+    if (response.redirected && loginPaths.includes(new URL(response.url).pathname)) {
+      // Signed out: nobody's dashboards may stay on this device
+      return caches.delete(PAGES_CACHE).then(function() { return response; });
+    }
+    const account = response.headers.get(ACCOUNT_HEADER);
+    // A redirected response (a hospital opening /dashboard) would be stored under the wrong URL
+    if (!response.ok || !account || response.redirected) {
+      return response;
+    }
+    const copy = response.clone();
+    return caches.open(PAGES_CACHE).then(function(cache) {
+      return cache.match(ACCOUNT_KEY).then(function(stored) {
+        return stored ? stored.text() : null;
+      }).then(function(previous) {
+        if (previous === account) {
+          return cache;
+        }
+        // Another account signed in: start over with an empty cache
+        return caches.delete(PAGES_CACHE).then(function() {
+          return caches.open(PAGES_CACHE);
+        }).then(function(fresh) {
+          return fresh.put(ACCOUNT_KEY, new Response(account)).then(function() { return fresh; });
+        });
+      }).then(function(current) {
+        return current.put(request, copy);
+      });
+    }).then(function() {
+      return response;
+    }, function() {
+      return response;
+    });
+  }).catch(function() {
+    return caches.open(PAGES_CACHE).then(function(cache) {
+      return cache.match(request);
+    }).then(function(cached) {
+      return cached || caches.match('/');
+    });
+  });
+}
+
+function postOrQueue(request) {
+  const queuedCopy = request.clone();
+  return fetch(request).catch(function() {
+    return queuedCopy.text().then(function(body) {
+      const params = new URLSearchParams(body);
+      return enqueue({
+        url: queuedCopy.url,
+        contentType: queuedCopy.headers.get('Content-Type'),
+        body: body,
+        idempotencyKey: params.get('idempotency_key') || self.crypto.randomUUID(),
+        account: params.get('account_tag'),
+        queuedAt: Date.now()
+      });
+    }).then(function() {
+      if (self.registration.sync) {
+        return self.registration.sync.register(SYNC_TAG).catch(function() {});
+      }
+    }).then(function() {
+      return Response.redirect('/hospital/dashboard?queued=1', 303);
+    });
+  });
+}
+
+function currentAccount() {
+  return fetch(ACCOUNT_URL, { credentials: 'same-origin', cache: 'no-store' }).then(function(response) {
+    return response.json();
+  }).then(function(data) {
+    return data.account;
+  });
+}
+
+function replayQueue() {
+  const saved = [];
+  const failed = [];
+  return Promise.all([currentAccount(), readStore(QUEUE_STORE)]).then(function(results) {
+    const account = results[0];
+    // Replay in submission order, only the entries of the signed-in account; the others wait
+    // for their account. Stop at the first network failure, server error or lost session
+    // (redirect to the login page) and retry later.
+    const entries = results[1].filter(function(entry) { return account && entry.account === account; });
+    return entries.reduce(function(chain, entry) {
+      return chain.then(function() {
+        return fetch(entry.url, {
+          method: 'POST',
+          body: entry.body,
+          credentials: 'same-origin',
+          redirect: 'manual',
+          headers: {
+            'Content-Type': entry.contentType || 'application/x-www-form-urlencoded',
+            'Idempotency-Key': entry.idempotencyKey,
+            'X-Offline-Replay': '1'
+          }
+        }).then(function(response) {
+          if (response.ok) {
+            return replayMessages(response).then(function(messages) {
+              saved.push.apply(saved, messages);
+              return deleteFrom(QUEUE_STORE, entry.id);
+            });
+          }
+          if (response.status === 409) {
+            // The account changed since the check above: keep the entry for its own account
+            return;
+          }
+          const rejected = response.status >= 400 && response.status < 500 &&
+            response.status !== 401 && response.status !== 403;
+          if (!rejected) {
+            throw new Error('Replay stopped with status ' + response.status);
+          }
+          // The record itself is invalid: retrying cannot help, so hand it back to the user
+          return replayMessages(response).then(function(messages) {
+            const text = messages.map(function(message) { return message.text; }).join(' ') ||
+              'Rejected by the server (' + response.status + ')';
+            const record = Object.assign({}, entry, { error: text, failedAt: Date.now() });
+            delete record.id;
+            return addTo(FAILED_STORE, record).then(function(id) {
+              failed.push(Object.assign(record, { id: id }));
+              return deleteFrom(QUEUE_STORE, entry.id);
+            });
+          });
+        });
+      });
+    }, Promise.resolve());
+  }).finally(function() {
+    if (!saved.length && !failed.length) {
+      return;
+    }
+    return caches.delete(PAGES_CACHE).then(function() {
+      return self.clients.matchAll({ type: 'window' });
+    }).then(function(clients) {
+      clients.forEach(function(client) {
+        client.postMessage({ type: 'replay-saved', messages: saved });
+        if (failed.length) {
+          client.postMessage({ type: 'replay-failed', entries: failed });
+        }
+      });
+    });
+  });
+}
+
+function replayMessages(response) {
+  return response.json().then(function(data) {
+    return data.messages || [];
+  }, function() {
+    return [];
+  });
+}
+
+// Minimal IndexedDB wrapper for the offline write queue
+function openQueue() {
+  return new Promise(function(resolve, reject) {
+    const open = indexedDB.open(QUEUE_DB, 2);
+    open.onupgradeneeded = function() {
+      [QUEUE_STORE, FAILED_STORE].forEach(function(name) {
+        if (!open.result.objectStoreNames.contains(name)) {
+          open.result.createObjectStore(name, { keyPath: 'id', autoIncrement: true });
+        }
+      });
+    };
+    open.onsuccess = function() { resolve(open.result); };
+    open.onerror = function() { reject(open.error); };
+  });
+}
+
+function queueTransaction(storeName, mode, action) {
+  return openQueue().then(function(database) {
+    return new Promise(function(resolve, reject) {
+      const tx = database.transaction(storeName, mode);
+      const result = action(tx.objectStore(storeName));
+      tx.oncomplete = function() { resolve(result.result); };
+      tx.onerror = function() { reject(tx.error); };
+    });
+  });
+}
+
+function enqueue(entry) {
+  return addTo(QUEUE_STORE, entry);
+}
+
+function addTo(storeName, entry) {
+  return queueTransaction(storeName, 'readwrite', function(store) { return store.add(entry); });
+}
+
+function readStore(storeName) {
+  return queueTransaction(storeName, 'readonly', function(store) { return store.getAll(); });
+}
+
+function deleteFrom(storeName, id) {
+  return queueTransaction(storeName, 'readwrite', function(store) { return store.delete(id); });
+}
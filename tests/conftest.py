@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py reads its settings at import time: point it at a scratch database first
+_scratch = tempfile.mkdtemp(prefix='bloodlink-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_scratch, 'test.db')
+os.environ['SHARED_STATE_PATH'] = os.path.join(_scratch, 'shared_state.db')
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+
+
+@pytest.fixture(scope='session')
+def bloodlink():
+    import app as bloodlink
+    bloodlink.create_app({'TESTING': True, 'EMERGENCY_DISPATCH_ASYNC': False})
+    return bloodlink
+
+
+@pytest.fixture
+def db(bloodlink):
+    """Empty tables for every test."""
+    with bloodlink.app.app_context():
+        bloodlink.db.drop_all()
+        bloodlink.db.create_all()
+        bloodlink.fragment_cache.clear()
+        yield bloodlink.db
+        bloodlink.db.session.remove()
+
+
+@pytest.fixture
+def client(bloodlink, db):
+    return bloodlink.app.test_client()
@@ -0,0 +1,103 @@
+"""Regional analytics come from daily rollups kept in step with every recorded usage and donation."""
+from datetime import datetime, timedelta
+
+import pytest
+
+PASSWORD = 'secret'
+TODAY = datetime.utcnow().date()
+
+
+@pytest.fixture
+def as_hospital(bloodlink, db):
+    # Every helper call logs in again (see login); few rounds keep that cheap
+    password_hash = bloodlink.bcrypt.generate_password_hash(PASSWORD, rounds=4).decode('utf-8')
+    for hospital_id, city, state in ((1, 'Bangalore', 'Karnataka'), (2, 'Mysore', 'Karnataka'),
+                                     (3, 'Chennai', 'Tamil Nadu')):
+        db.session.add(bloodlink.Hospital(id=hospital_id, name=f'Hosp {hospital_id}', hospital_code=f'H{hospital_id}',
+                                          city=city, state=state, contact_number='1',
+                                          email=f'h{hospital_id}@x.com', password_hash=password_hash))
+    for donor_id, blood_group in ((1, 'O+'), (2, 'A-')):
+        db.session.add(bloodlink.User(
+            id=donor_id, name=f'Donor {donor_id}', age=30, gender='Male', blood_group=blood_group,
+            city='Bangalore', state='Karnataka', pincode='560001', contact_number=f'900000000{donor_id}',
+            email=f'd{donor_id}@x.com', password_hash='x', role='user', is_verified_donor=True))
+    db.session.commit()
+    return lambda hospital_id: login(bloodlink, hospital_id)
+
+
+def login(bloodlink, hospital_id):
+    # Requests share the test's app context, and with it the logged-in user Flask-Login keeps in g
+    client = bloodlink.app.test_client()
+    client.post('/Hospital-Login', data={'email': f'h{hospital_id}@x.com', 'password': PASSWORD})
+    return client
+
+
+def record(client, kind, donor_id, units, days_ago=0, record_type=None):
+    day = (TODAY - timedelta(days=days_ago)).isoformat()
+    if kind == 'usage':
+        data = {'donor_id': donor_id, 'blood_units': units, 'usage_type': record_type or 'Surgery', 'notes': '',
+                'usage_date': day, 'usage_time': '10:30'}
+    else:
+        data = {'donor_id': donor_id, 'donation_units': units, 'donation_type': record_type or 'Plasma',
+                'notes': '', 'donation_date': day, 'donation_time': '10:30'}
+    response = client.post(f'/hospital/{kind}/create', headers={'X-Offline-Replay': '1'}, data=data)
+    assert response.status_code == 201, response.get_data(as_text=True)
+
+
+def analytics(client, **params):
+    return client.get('/api/analytics/regional', query_string=params)
+
+
+def test_rollups_total_the_recorded_records(bloodlink, db, as_hospital):
+    record(as_hospital(1), 'donation', 1, '2 units')
+    record(as_hospital(2), 'donation', 1, '1')
+    record(as_hospital(2), 'donation', 2, '0.5', record_type='Platelets')
+    record(as_hospital(3), 'donation', 1, '1')
+    record(as_hospital(1), 'usage', 2, '3')
+
+    rows = analytics(as_hospital(1), kind='donation').get_json()['rows']
+    assert rows == [
+        {'state': 'Karnataka', 'blood_group': 'A-', 'records': 1, 'units': 0.5},
+        {'state': 'Karnataka', 'blood_group': 'O+', 'records': 2, 'units': 3.0},
+        {'state': 'Tamil Nadu', 'blood_group': 'O+', 'records': 1, 'units': 1.0},
+    ]
+    by_city = analytics(as_hospital(1), kind='usage', group_by='city,record_type').get_json()['rows']
+    assert by_city == [{'city': 'Bangalore', 'record_type': 'Surgery', 'records': 1, 'units': 3.0}]
+
+
+def test_incremental_rollups_match_a_full_rebuild(bloodlink, db, as_hospital):
+    for days_ago, (hospital_id, donor_id, units) in enumerate([(1, 1, '1'), (2, 2, '2'), (1, 1, '1'), (3, 2, '1')]):
+        record(as_hospital(hospital_id), 'donation', donor_id, units, days_ago=days_ago)
+        record(as_hospital(hospital_id), 'usage', donor_id, '1', days_ago=days_ago)
+    params = {'group_by': 'day,hospital_id,blood_group,record_type', 'from': (TODAY - timedelta(days=10)).isoformat()}
+    incremental = {kind: analytics(as_hospital(1), kind=kind, **params).get_json()['rows'] for kind in ('donation', 'usage')}
+
+    bloodlink.rebuild_rollups()
+    rebuilt = {kind: analytics(as_hospital(1), kind=kind, **params).get_json()['rows'] for kind in ('donation', 'usage')}
+
+    assert incremental == rebuilt
+    assert sum(row['records'] for row in rebuilt['donation']) == 4
+
+
+def test_date_range_and_filters(bloodlink, db, as_hospital):
+    record(as_hospital(1), 'donation', 1, '1', days_ago=40)
+    record(as_hospital(3), 'donation', 1, '1', days_ago=1)
+    since = (TODAY - timedelta(days=60)).isoformat()
+
+    rows = analytics(as_hospital(1), group_by='state', **{'from': since}).get_json()['rows']
+    assert [row['state'] for row in rows] == ['Karnataka', 'Tamil Nadu']
+    rows = analytics(as_hospital(1), group_by='state', state='Tamil Nadu', **{'from': since}).get_json()['rows']
+    assert [row['state'] for row in rows] == ['Tamil Nadu']
+    recent = analytics(as_hospital(1), group_by='', **{'from': (TODAY - timedelta(days=7)).isoformat()}).get_json()
+    assert recent['rows'] == [{'records': 1, 'units': 1.0}]
+
+
+@pytest.mark.parametrize('params, error', [
+    ({'kind': 'stock'}, 'kind must be "donation" or "usage"'),
+    ({'group_by': 'state,donor_id'}, 'Unknown group_by: donor_id'),
+    ({'from': '01/02/2025'}, 'Dates must be YYYY-MM-DD'),
+])
+def test_bad_parameters(bloodlink, db, as_hospital, params, error):
+    response = analytics(as_hospital(1), **params)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
@@ -0,0 +1,104 @@
+"""JSON API pagination and incremental sync."""
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+PASSWORD = 'secret'
+
+
+@pytest.fixture
+def hospital_client(bloodlink, db, client):
+    password_hash = bloodlink.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    db.session.add(bloodlink.Hospital(name='Hosp', hospital_code='HOSP001', city='Bangalore', state='Karnataka',
+                                      contact_number='1', email='h@x.com', password_hash=password_hash))
+    for i in range(3):
+        db.session.add(bloodlink.User(
+            name=f'Donor {i}', age=30, gender='Male', blood_group='O+', city='Bangalore', state='Karnataka',
+            pincode='560001', contact_number=f'900000000{i}', email=f'd{i}@x.com', password_hash='x', role='user'))
+    db.session.commit()
+    client.post('/Hospital-Login', data={'email': 'h@x.com', 'password': PASSWORD})
+    return client
+
+
+def encode(value):
+    return base64.urlsafe_b64encode(value).decode('ascii').rstrip('=')
+
+
+def test_pages_follow_the_cursor(hospital_client):
+    first = hospital_client.get('/api/v1/donors?limit=2&fields=name').get_json()
+    second = hospital_client.get(f"/api/v1/donors?limit=2&fields=name&cursor={first['next_cursor']}").get_json()
+    assert [d['name'] for d in first['data'] + second['data']] == ['Donor 0', 'Donor 1', 'Donor 2']
+    assert second['next_cursor'] is None
+
+
+@pytest.mark.parametrize('cursor', ['%%%', 'abc', encode(b'not json'), encode(b'5'), encode(b'["yesterday", 1]'),
+                                    encode(json.dumps([None, 'x']).encode()), encode(b'\xff\xfe'),
+                                    encode(json.dumps([None, 1, None, 'extra']).encode())])
+def test_malformed_cursor_gets_a_fixed_error(hospital_client, cursor):
+    response = hospital_client.get(f'/api/v1/donors?cursor={cursor}')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'invalid cursor'}
+
+
+def add_donor(bloodlink, db, name, updated_at):
+    donor = bloodlink.User(name=name, age=30, gender='Male', blood_group='O+', city='Bangalore', state='Karnataka',
+                           pincode='560001', contact_number='9000000099', email=f'{name}@x.com', password_hash='x',
+                           role='user')
+    db.session.add(donor)
+    db.session.flush()
+    # updated_at as the writing transaction set it, before its commit
+    db.session.execute(bloodlink.update(bloodlink.User).where(bloodlink.User.id == donor.id)
+                       .values(updated_at=updated_at))
+    db.session.commit()
+
+
+def sync(client, **params):
+    """All pages of one sync: (names, last page)."""
+    names, query = [], '&'.join(f'{key}={value}' for key, value in params.items())
+    page = client.get(f'/api/v1/donors?limit=2&fields=name&{query}').get_json()
+    names += [d['name'] for d in page['data']]
+    while page['has_more']:
+        page = client.get(f"/api/v1/donors?limit=2&fields=name&cursor={page['next_cursor']}").get_json()
+        names += [d['name'] for d in page['data']]
+    return names, page
+
+
+def test_late_commit_arrives_in_the_next_sync(bloodlink, db, hospital_client):
+    newest = db.session.query(bloodlink.func.max(bloodlink.User.updated_at)).scalar()
+    names, last = sync(hospital_client)
+    assert names == ['Donor 0', 'Donor 1', 'Donor 2']
+    assert last['next_cursor'] is None
+    assert last['next_updated_since'] == (newest - bloodlink.SNAPSHOT_SYNC_OVERLAP).isoformat()
+
+    # Written before the sync read it, committed after: behind everything already paged past
+    add_donor(bloodlink, db, 'Late', newest - timedelta(seconds=5))
+    names, _ = sync(hospital_client, updated_since=last['next_updated_since'])
+    assert 'Late' in names
+
+
+def test_horizon_is_kept_from_the_first_page(bloodlink, db, hospital_client):
+    newest = db.session.query(bloodlink.func.max(bloodlink.User.updated_at)).scalar()
+    first = hospital_client.get('/api/v1/donors?limit=2&fields=name').get_json()
+    # Changes during the sync do not move the point the next sync resumes from
+    add_donor(bloodlink, db, 'During', newest + timedelta(hours=1))
+    last = hospital_client.get(f"/api/v1/donors?limit=2&fields=name&cursor={first['next_cursor']}").get_json()
+
+    assert [d['name'] for d in last['data']] == ['Donor 2', 'During']
+    assert last['next_updated_since'] == (newest - bloodlink.SNAPSHOT_SYNC_OVERLAP).isoformat()
+
+
+def test_cursor_without_a_horizon_is_still_accepted(hospital_client):
+    first = hospital_client.get('/api/v1/donors?limit=2&fields=name').get_json()
+    updated_at, record_id, _ = json.loads(base64.urlsafe_b64decode(first['next_cursor'] + '=='))
+    old = encode(json.dumps([updated_at, record_id]).encode())
+    last = hospital_client.get(f'/api/v1/donors?limit=2&fields=name&cursor={old}').get_json()
+    assert [d['name'] for d in last['data']] == ['Donor 2']
+    assert last['next_updated_since'] is not None
+
+
+def test_repeated_sync_keeps_its_etag(hospital_client):
+    first = hospital_client.get('/api/v1/donors?limit=5')
+    again = hospital_client.get('/api/v1/donors?limit=5', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
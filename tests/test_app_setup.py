@@ -0,0 +1,28 @@
+"""Every entry point gets create_app()'s setup, including `flask run` on the module-level app."""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What `flask --app app run` does: import the module and serve its `app` without calling create_app()
+SERVE_MODULE_APP = '''
+import app as bloodlink
+from sqlalchemy import inspect
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+client = bloodlink.app.test_client()
+print(client.get('/').status_code)
+with bloodlink.app.app_context():
+    print('users' in inspect(bloodlink.db.engine).get_table_names())
+print(isinstance(bloodlink.app.wsgi_app, ProxyFix))
+'''
+
+
+def test_module_level_app_is_set_up_before_its_first_request(tmp_path):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + str(tmp_path / 'fresh.db'),
+               SHARED_STATE_PATH=str(tmp_path / 'shared_state.db'), TRUSTED_PROXIES='1')
+    result = subprocess.run([sys.executable, '-c', SERVE_MODULE_APP], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ['200', 'True', 'True']
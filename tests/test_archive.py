@@ -0,0 +1,93 @@
+"""Archiving: chunks restore exactly the rows they replace, and totals do not move."""
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+
+from archive import DONATION_FIELDS, USAGE_FIELDS, ArchivedUsage, pack_chunk, unpack_chunk
+
+PASSWORD = 'secret'
+
+
+def test_pack_unpack_round_trip():
+    rows = [(1, 7, 2, datetime(2020, 1, 31, 8, 30, 15, 250), '2 units', 'Surgery', 'Café, "quoted"'),
+            (4, 8, 2, None, None, None, None)]
+    payload = pack_chunk(rows)
+
+    assert zlib.decompress(payload).startswith(b'{"version":1,')
+    assert unpack_chunk('usage', payload) == [ArchivedUsage(*row) for row in rows]
+
+
+@pytest.fixture
+def history(bloodlink, db, monkeypatch):
+    password_hash = bloodlink.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    for hospital_id in (1, 2):
+        db.session.add(bloodlink.Hospital(id=hospital_id, name=f'Hosp {hospital_id}', hospital_code=f'H{hospital_id}',
+                                          city='Bangalore', state='Karnataka', contact_number='1',
+                                          email=f'h{hospital_id}@x.com', password_hash=password_hash))
+    for donor_id, blood_group in ((1, 'O+'), (2, 'A-')):
+        db.session.add(bloodlink.User(
+            id=donor_id, name=f'Donor {donor_id}', age=30, gender='Male', blood_group=blood_group,
+            city='Bangalore', state='Karnataka', pincode='560001', contact_number=f'900000000{donor_id}',
+            email=f'd{donor_id}@x.com', password_hash=password_hash, role='user', is_verified_donor=True))
+    now = datetime.utcnow()
+    for i, days_ago in enumerate((1000, 950, 900, 880, 30, 5)):
+        fields = {'donor_id': 1 + i % 2, 'hospital_id': 1 + i // 3 % 2, 'date': now - timedelta(days=days_ago),
+                  'notes': f'record {i}'}
+        db.session.add(bloodlink.Donation(donation_units=str(2 + i), donation_type='Whole Blood', **fields))
+        db.session.add(bloodlink.BloodUsage(blood_units='1', usage_type='Surgery', **fields))
+    db.session.commit()
+    monkeypatch.setattr(bloodlink, 'forecast_series', {})
+
+
+def hot_rows(bloodlink, model, fields):
+    return bloodlink.db.session.query(*[getattr(model, name) for name in fields]).order_by(model.id).all()
+
+
+def archive(bloodlink, db):
+    result = bloodlink.app.test_cli_runner().invoke(args=['archive-history', '--days', '800', '--batch-size', '3'])
+    assert result.exit_code == 0, result.output
+    db.session.expire_all()
+    return result.output
+
+
+def test_chunks_restore_exactly_the_removed_rows(bloodlink, db, history):
+    before = {'usage': hot_rows(bloodlink, bloodlink.BloodUsage, USAGE_FIELDS),
+              'donation': hot_rows(bloodlink, bloodlink.Donation, DONATION_FIELDS)}
+
+    output = archive(bloodlink, db)
+
+    assert 'Archived 4 usage records' in output and 'Archived 4 donation records' in output
+    for kind, model, fields in (('usage', bloodlink.BloodUsage, USAGE_FIELDS),
+                                ('donation', bloodlink.Donation, DONATION_FIELDS)):
+        chunks = bloodlink.ArchiveChunk.query.filter_by(kind=kind).order_by(bloodlink.ArchiveChunk.id).all()
+        # Batches of three, split per hospital
+        assert [(chunk.hospital_id, chunk.row_count) for chunk in chunks] == [(1, 3), (2, 1)]
+        archived = [record[:len(fields)] for chunk in chunks for record in unpack_chunk(kind, chunk.payload)]
+        remaining = hot_rows(bloodlink, model, fields)
+        assert sorted(archived) == [tuple(row) for row in before[kind][:4]]
+        assert [tuple(row) for row in remaining] == [tuple(row) for row in before[kind][4:]]
+
+
+def totals(bloodlink, client):
+    seen = {}
+    for email in ('h1@x.com', 'h2@x.com', 'd1@x.com', 'd2@x.com'):
+        login = '/Hospital-Login' if email.startswith('h') else '/login'
+        client.post(login, data={'email': email, 'password': PASSWORD})
+        seen[email] = client.get('/api/dashboard_stats').get_json()
+        if email.startswith('h'):
+            seen[email, 'forecast'] = client.get('/api/forecast').get_json()['forecast']
+        client.get('/logout')
+    return seen
+
+
+def test_dashboard_totals_are_unchanged_by_archiving(bloodlink, db, client, history):
+    before = totals(bloodlink, client)
+    assert before['h1@x.com']['donation_count'] == 3 and before['d1@x.com']['usage_count'] == 3
+    assert before['h1@x.com', 'forecast'] != before['h2@x.com', 'forecast']
+
+    archive(bloodlink, db)
+    assert totals(bloodlink, client) == before
+    # A new process reads the archived records back from the chunks
+    bloodlink.forecast_series.clear()
+    assert totals(bloodlink, client) == before
@@ -0,0 +1,73 @@
+"""Benchmark harness: synthetic seed, route timings and the regression gate."""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from benchmark import query_count, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_summarize():
+    result = summarize([0.001 * i for i in range(1, 101)], errors=2, elapsed=2.0, queries=[3, None, 5])
+    assert result == {'requests': 100, 'errors': 2, 'db_queries': 5, 'p50_ms': 50.0, 'p95_ms': 95.0,
+                      'p99_ms': 99.0, 'mean_ms': 50.5, 'throughput_rps': 50.0}
+    assert summarize([], errors=1, elapsed=0)['p95_ms'] is None
+
+
+def test_query_count_from_server_timing():
+    assert query_count({'Server-Timing': 'app;dur=3.1, db;dur=0.4;desc="7 queries"'}) == 7
+    assert query_count({}) is None
+
+
+def benchmark(tmp_path, *args):
+    env = dict(os.environ, SHARED_STATE_PATH=str(tmp_path / 'shared_state.db'))
+    return subprocess.run([sys.executable, 'benchmark.py', *args], cwd=ROOT, env=env,
+                          capture_output=True, text=True, timeout=300)
+
+
+@pytest.fixture(scope='module')
+def seeded(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('benchmark')
+    db_path = tmp_path / 'bench.db'
+    result = benchmark(tmp_path, 'seed', '--db', str(db_path), '--users', '40', '--hospitals', '3',
+                       '--records', '300', '--days', '60', '--seed', '7')
+    assert result.returncode == 0, result.stderr
+    return tmp_path, db_path
+
+
+def test_seed_writes_the_requested_rows_and_derived_tables(seeded):
+    tmp_path, db_path = seeded
+    with sqlite3.connect(db_path) as conn:
+        count = lambda table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        assert (count('hospitals'), count('users'), count('blood_usage') + count('donations')) == (3, 40, 300)
+        assert count('daily_rollups') > 0
+        assert conn.execute('SELECT COUNT(*) FROM users WHERE next_eligible_at IS NOT NULL').fetchone()[0] > 0
+    # An existing database is only replaced with --force
+    assert benchmark(tmp_path, 'seed', '--db', str(db_path)).returncode != 0
+
+
+def test_run_and_compare(seeded):
+    tmp_path, db_path = seeded
+    report = tmp_path / 'run.json'
+    result = benchmark(tmp_path, 'run', '--db', str(db_path), '--iterations', '3', '--warmup', '0',
+                       '--scenario', 'index', '--scenario', 'hospital_dashboard', '--output', str(report))
+    assert result.returncode == 0, result.stderr
+    results = json.loads(report.read_text())['results']
+    assert set(results) == {'index', 'hospital_dashboard'}
+    assert results['hospital_dashboard']['errors'] == 0 and results['hospital_dashboard']['db_queries'] > 0
+
+    assert benchmark(tmp_path, 'compare', str(report), str(report)).returncode == 0
+
+    # A baseline that needed fewer queries makes the current run a regression
+    baseline = json.loads(report.read_text())
+    baseline['results']['hospital_dashboard']['db_queries'] -= 1
+    baseline_path = tmp_path / 'baseline.json'
+    baseline_path.write_text(json.dumps(baseline))
+    result = benchmark(tmp_path, 'compare', str(baseline_path), str(report), '--queries-only')
+    assert result.returncode == 1
+    assert 'hospital_dashboard (queries)' in result.stderr
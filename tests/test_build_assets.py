@@ -0,0 +1,105 @@
+"""Static asset build: minifiers, manifest, and rebuilds that never break running servers."""
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+import build_assets
+
+
+def test_minify_css():
+    css = '/* header */\nbody {\n    color : red;\n    margin: 0 auto;\n}\na > b , i { x: 1; }\n'
+    assert build_assets.minify_css(css) == 'body{color : red;margin: 0 auto}a>b,i{x: 1}'
+
+
+def test_minify_js_drops_comments_and_indentation_only():
+    js = ('// leading comment\n'
+          'function f() {\n'
+          '    /* one line */\n'
+          '    /*\n'
+          '     * block\n'
+          '     */\n'
+          "    const url = 'http://example.com'; // trailing comment stays\n"
+          '\n'
+          '    return url;\n'
+          '}\n')
+    assert build_assets.minify_js(js) == ("function f() {\n"
+                                          "const url = 'http://example.com'; // trailing comment stays\n"
+                                          "return url;\n}\n")
+
+
+def test_minify_json_keeps_non_ascii():
+    assert build_assets.minify_json('{\n  "hello": "ನಮಸ್ಕಾರ",\n  "n": [1, 2]\n}') == '{"hello":"ನಮಸ್ಕಾರ","n":[1,2]}'
+
+
+@pytest.fixture
+def static_dir(tmp_path, monkeypatch):
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    (static / 'uploads').mkdir()
+    (static / 'css' / 'style.css').write_text('body {\n    color: red;\n}\n')
+    (static / 'img.png').write_bytes(b'\x89PNG')
+    (static / 'sw.js').write_text('self.addEventListener("fetch", () => {});\n')
+    (static / 'uploads' / 'report.pdf').write_bytes(b'%PDF')
+    monkeypatch.setattr(build_assets, 'STATIC_DIR', str(static))
+    monkeypatch.setattr(build_assets, 'BUILD_DIR', str(static / 'build'))
+    return static
+
+
+def read_manifest(static):
+    return json.loads((static / 'build' / 'manifest.json').read_text())
+
+
+def test_manifest_maps_sources_to_hashed_minified_files(static_dir):
+    manifest, _ = build_assets.build()
+
+    assert manifest == read_manifest(static_dir)
+    # The service worker keeps its URL and uploads are not assets
+    assert set(manifest['files']) == {'css/style.css', 'img.png'}
+    hashed = static_dir / manifest['files']['css/style.css']
+    assert hashed.name.startswith('style.') and hashed.suffix == '.css'
+    assert hashed.read_text() == 'body{color: red}'
+    assert gzip.decompress((static_dir / (manifest['files']['css/style.css'] + '.gz')).read_bytes()) == \
+        b'body{color: red}'
+    # Binary files are copied as they are, without compressed copies
+    assert (static_dir / manifest['files']['img.png']).read_bytes() == b'\x89PNG'
+    assert not (static_dir / (manifest['files']['img.png'] + '.gz')).exists()
+
+
+def test_unchanged_sources_build_the_same_manifest(static_dir):
+    first, _ = build_assets.build()
+    second, _ = build_assets.build()
+    assert first == second
+
+
+def test_rebuild_keeps_files_running_servers_link_to(static_dir):
+    old, _ = build_assets.build()
+    (static_dir / 'css' / 'style.css').write_text('body { color: blue; }\n')
+
+    new, pruned = build_assets.build()
+
+    assert new['version'] != old['version']
+    assert new['files']['css/style.css'] != old['files']['css/style.css']
+    # A worker that loaded the old manifest still finds every file it names
+    assert pruned == 0
+    assert all((static_dir / path).is_file() for path in old['files'].values())
+    assert (static_dir / new['files']['css/style.css']).read_text() == 'body{color: blue}'
+
+
+def test_files_unused_for_keep_days_are_pruned(static_dir):
+    old, _ = build_assets.build()
+    (static_dir / 'css' / 'style.css').write_text('body { color: blue; }\n')
+    stale = static_dir / old['files']['css/style.css']
+    eight_days_ago = time.time() - 8 * 24 * 60 * 60
+    for path in (stale, stale.with_name(stale.name + '.gz')):
+        os.utime(path, (eight_days_ago, eight_days_ago))
+
+    new, pruned = build_assets.build(keep_days=7)
+
+    assert pruned == 2
+    assert not stale.exists()
+    # Still in the new build: used again, so kept however old the file is
+    assert (static_dir / new['files']['img.png']).is_file()
+    assert not [name for name in os.listdir(static_dir / 'build') if name.startswith('.tmp-')]
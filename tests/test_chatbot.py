@@ -0,0 +1,67 @@
+"""Questions no keyword branch catches are answered from the local index, never skipped past it."""
+import threading
+import time
+
+import pytest
+
+import chatbot_retrieval
+
+
+@pytest.fixture
+def chatbot(bloodlink, monkeypatch):
+    adapter = bloodlink.ChatbotAdapter()
+    remote_calls = []
+    monkeypatch.setattr(adapter, '_query_huggingface', lambda message: remote_calls.append(message) or 'remote')
+    adapter.remote_calls = remote_calls
+    return adapter
+
+
+@pytest.mark.parametrize('question, topic', [
+    ('is the needle painful', 'does it hurt'),
+    ('how frequently can I give', 'how often'),
+    ('I feel faint or lightheaded', 'dizzy'),
+    ('universal recipient', 'blood group'),
+    ('got a tattoo or piercing recently', 'cannot donate'),
+    ('is my iron too low', 'hemoglobin'),
+])
+def test_paraphrase_ranks_its_topic_first(chatbot, question, topic):
+    assert not chatbot._should_use_fallback(question)
+    entry, score = chatbot._get_answer_index().search(question)
+    assert chatbot._answers[entry] == topic
+    assert score >= chatbot.retrieval_threshold
+
+
+def test_site_question_ranks_the_faq_answer_first(chatbot):
+    entry, score = chatbot._get_answer_index().search('sign up on the website')
+    assert chatbot._answers[entry].startswith('**Becoming a Donor on BloodLink:**')
+    assert chatbot.send('sign up on the website', {}) == chatbot._answers[entry]
+
+
+def test_every_probe_is_answered_by_its_keyword_branch(chatbot):
+    for probe, _ in chatbot_retrieval.TOPICS:
+        assert not chatbot._get_medical_response(probe, retrieve=False).startswith('**Health Information Request:**')
+
+
+def test_unrelated_question_goes_to_the_remote_model(chatbot):
+    assert chatbot.send('quantum chromodynamics lattice', {}) == 'remote'
+    assert chatbot.remote_calls == ['quantum chromodynamics lattice']
+
+
+def test_questions_during_the_first_build_wait_for_the_index(chatbot, monkeypatch):
+    class SlowTopics(tuple):
+        def __iter__(self):
+            time.sleep(0.2)
+            return super().__iter__()
+
+    monkeypatch.setattr(chatbot_retrieval, 'TOPICS', SlowTopics(chatbot_retrieval.TOPICS))
+    answers = []
+    threads = [threading.Thread(target=lambda: answers.append(chatbot.send('is the needle painful', {})))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert chatbot.remote_calls == []
+    assert len(answers) == 4 and len(set(answers)) == 1
+    assert answers[0] == chatbot._get_medical_response('does it hurt')
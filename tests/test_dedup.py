@@ -0,0 +1,109 @@
+"""Duplicate donors: normalized keys, match reasons and what registration tells the applicant."""
+from types import SimpleNamespace
+
+import pytest
+
+from dedup import donor_keys, match_reason, normalize_name, normalize_phone, soundex
+
+PASSWORD = 'secret'
+
+
+@pytest.mark.parametrize('raw, key', [
+    ('+91 98450 12345', '9845012345'),
+    ('919845012345', '9845012345'),
+    ('098450-12345', '9845012345'),
+    ('(080) 2345 6789', '8023456789'),
+    ('12345', ''),
+    (None, ''),
+])
+def test_normalize_phone(raw, key):
+    assert normalize_phone(raw) == key
+
+
+@pytest.mark.parametrize('raw, key', [
+    ('Ravi Kumar', 'kumar ravi'),
+    ('Kumar, Ravi', 'kumar ravi'),
+    ('Dr. RAVI  kumar', 'kumar ravi'),
+    ('Smt. Lakshmi', 'lakshmi'),
+    ('José Álvarez', 'alvarez jose'),
+    ('', ''),
+])
+def test_normalize_name(raw, key):
+    assert normalize_name(raw) == key
+
+
+@pytest.mark.parametrize('text, code', [
+    ('robert', 'R163'), ('rupert', 'R163'), ('ashcraft', 'A261'), ('tymczak', 'T522'), ('pfister', 'P236'),
+    ('lee', 'L000'), ('', ''),
+])
+def test_soundex(text, code):
+    assert soundex(text) == code
+
+
+def test_blocking_keys_survive_typos_and_word_order():
+    assert donor_keys('Ravi Kumar', '+91 98450 12345') == ('9845012345', 'kumar ravi', soundex('kumarravi'))
+    assert donor_keys('Kumaar, Ravi', '09845012345')[2] == donor_keys('Ravi Kumar', '')[2]
+
+
+def donor(name, phone='9845012345', pincode='560001', blood_group='O+'):
+    phone_key, name_key, name_soundex = donor_keys(name, phone)
+    return SimpleNamespace(phone_key=phone_key, name_key=name_key, name_soundex=name_soundex,
+                           pincode=pincode, blood_group=blood_group)
+
+
+@pytest.mark.parametrize('left, right, reason', [
+    (donor('Ravi Kumar'), donor('R. Kumar'), 'phone'),
+    (donor('Ravi Kumar'), donor('Ravi'), 'phone'),
+    (donor('Ravi Kumar'), donor('Sunita Kumar'), None),        # a family sharing one phone
+    (donor('Ravi Kumar', phone=''), donor('Ravi Kumaar', phone='9000000000'), 'name'),
+    (donor('Ravi Kumar', phone=''), donor('Ravi Kumaar', phone='', blood_group='A+'), None),
+    (donor('Ravi Kumar', phone=''), donor('Ravi Kumaar', phone='', pincode='560002'), None),
+    (donor('Ravi Kumar', phone=''), donor('Ravi Kumar', phone=''), 'name'),
+])
+def test_match_reason(left, right, reason):
+    assert match_reason(left, right) == reason
+    assert match_reason(right, left) == reason
+
+
+@pytest.fixture
+def existing_donor(bloodlink, db):
+    user = bloodlink.User(name='Ravi Kumar', age=30, gender='Male', blood_group='O+', city='Bangalore',
+                          state='Karnataka', pincode='560001', contact_number='+91 98450 12345',
+                          email='ravi@x.com', password_hash='x', role='user')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def register(client, name, contact_number, email):
+    return client.post('/register', follow_redirects=True, data={
+        'name': name, 'age': '31', 'gender': 'Male', 'blood_group': 'O+', 'city': 'Bangalore',
+        'state': 'Karnataka', 'pincode': '560001', 'contact_number': contact_number, 'diseases': 'None',
+        'email': email, 'password': PASSWORD, 'test_hospital_name': 'Hosp'})
+
+
+def test_phone_match_is_refused_without_details(bloodlink, db, client, existing_donor):
+    page = register(client, 'Kumar Ravi', '09845012345', 'ravi2@x.com').get_data(as_text=True)
+
+    assert 'possible duplicate of an existing donor account' in page
+    assert '98450' not in page and 'Ravi Kumar' not in page and 'ravi@x.com' not in page
+    assert bloodlink.User.query.filter_by(email='ravi2@x.com').first() is None
+
+
+def test_name_match_is_flagged_and_shown_to_hospitals(bloodlink, db, client, existing_donor):
+    register(client, 'Ravi Kumaar', '9000000009', 'ravi3@x.com')
+    flagged = bloodlink.User.query.filter_by(email='ravi3@x.com').one()
+    assert flagged.possible_duplicate_of_id == existing_donor.id
+    flagged.report_status = 'pending'
+    db.session.commit()
+    bloodlink.bump_data_version('donors')
+
+    password_hash = bloodlink.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    db.session.add(bloodlink.Hospital(name='Hosp', hospital_code='HOSP001', city='Bangalore', state='Karnataka',
+                                      contact_number='1', email='h@x.com', password_hash=password_hash))
+    db.session.commit()
+    client.post('/Hospital-Login', data={'email': 'h@x.com', 'password': PASSWORD})
+    page = client.get('/hospital/dashboard').get_data(as_text=True)
+
+    assert f'Possible duplicate of #{existing_donor.id}' in page
+    assert 'Similar to:' in page and '+91 98450 12345' in page
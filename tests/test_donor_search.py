@@ -0,0 +1,26 @@
+"""Which backend answers donor search: the donor snapshot or the region shards."""
+import pytest
+
+
+class FakeRouter:
+    def search_donors(self, blood_group, city, state, eligible_at):
+        return ['from shards']
+
+
+@pytest.fixture
+def partitioned(bloodlink, db, monkeypatch):
+    monkeypatch.setitem(bloodlink.app.config, 'PARTITIONING', 'state')
+    monkeypatch.setattr(bloodlink, 'get_shard_router', lambda: FakeRouter())
+    monkeypatch.setattr(bloodlink, '_donor_snapshot', None)
+
+
+def test_shards_win_over_snapshot_by_default(bloodlink, partitioned, monkeypatch):
+    monkeypatch.setitem(bloodlink.app.config, 'DONOR_SNAPSHOT', None)
+    assert bloodlink.get_donor_snapshot() is None
+    assert bloodlink.search_verified_donors('O+') == ['from shards']
+
+
+def test_explicit_snapshot_setting_wins_over_shards(bloodlink, partitioned, monkeypatch):
+    monkeypatch.setitem(bloodlink.app.config, 'DONOR_SNAPSHOT', True)
+    assert bloodlink.get_donor_snapshot() is not None
+    assert bloodlink.search_verified_donors('O+') == []
@@ -0,0 +1,92 @@
+"""Donation intervals, the eligible-now boundary and rebuilding next eligible dates in bulk."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+NOW = datetime(2025, 6, 1, 12, 0, 0)
+
+
+@pytest.mark.parametrize('donation_type, gender, interval', [
+    ('Whole Blood', 'Male', timedelta(weeks=12)),
+    ('Whole Blood', 'male', timedelta(weeks=12)),
+    ('Whole Blood', 'Female', timedelta(weeks=16)),
+    ('Whole Blood', None, timedelta(weeks=16)),
+    (None, 'Male', timedelta(weeks=12)),
+    ('Something new', 'Female', timedelta(weeks=16)),
+    ('Plasma', 'Female', timedelta(weeks=4)),
+    ('Platelets', 'Male', timedelta(weeks=2)),
+    ('Double Red Cells', 'Male', timedelta(days=180)),
+])
+def test_donation_interval(bloodlink, donation_type, gender, interval):
+    assert bloodlink.get_donation_interval(donation_type, gender) == interval
+
+
+def add_donor(bloodlink, db, donor_id, gender='Male', next_eligible_at=None):
+    db.session.add(bloodlink.User(
+        id=donor_id, name=f'Donor {donor_id}', age=30, gender=gender, blood_group='O+', city='Bangalore',
+        state='Karnataka', pincode='560001', contact_number=f'9{donor_id:09d}', email=f'd{donor_id}@x.com',
+        password_hash='x', role='user', is_verified_donor=True, next_eligible_at=next_eligible_at))
+
+
+@pytest.mark.parametrize('next_eligible_at, eligible', [
+    (None, True),
+    (NOW - timedelta(seconds=1), True),
+    (NOW, True),
+    (NOW + timedelta(seconds=1), False),
+])
+def test_eligible_now_boundary(bloodlink, db, next_eligible_at, eligible):
+    add_donor(bloodlink, db, 1, next_eligible_at=next_eligible_at)
+    db.session.commit()
+    assert (bloodlink.User.query.filter(bloodlink.eligible_now_filter(NOW)).count() == 1) is eligible
+
+
+def add_donation(bloodlink, db, donor_id, donation_type, date):
+    db.session.add(bloodlink.Donation(donor_id=donor_id, hospital_id=1, donation_type=donation_type,
+                                      donation_units='1', date=date))
+
+
+def test_recompute_takes_the_latest_window_across_types(bloodlink, db):
+    add_donor(bloodlink, db, 1)                                     # whole blood ends after the later plasma
+    add_donor(bloodlink, db, 2, gender='Female')
+    add_donor(bloodlink, db, 3, next_eligible_at=NOW)               # no donations left: eligible now
+    add_donor(bloodlink, db, 4)
+    add_donation(bloodlink, db, 1, 'Whole Blood', NOW - timedelta(days=30))
+    add_donation(bloodlink, db, 1, 'Plasma', NOW - timedelta(days=10))
+    add_donation(bloodlink, db, 1, 'Whole Blood', NOW - timedelta(days=200))
+    add_donation(bloodlink, db, 2, 'Whole Blood', NOW - timedelta(weeks=16))
+    add_donation(bloodlink, db, 4, 'Platelets', NOW - timedelta(days=14, seconds=1))
+    db.session.commit()
+
+    assert bloodlink.recompute_eligibility() == 3
+    db.session.expire_all()
+    dates = {user.id: user.next_eligible_at for user in bloodlink.User.query}
+    assert dates == {1: NOW - timedelta(days=30) + timedelta(weeks=12), 2: NOW, 3: None,
+                     4: NOW - timedelta(seconds=1)}
+    eligible = {user.id for user in bloodlink.User.query.filter(bloodlink.eligible_now_filter(NOW))}
+    assert eligible == {2, 3, 4}
+
+
+def test_recompute_writes_only_changed_rows_in_one_statement(bloodlink, db):
+    stale = datetime(2020, 1, 1)
+    for donor_id in range(1, 41):
+        add_donor(bloodlink, db, donor_id, next_eligible_at=NOW if donor_id % 2 else None)
+        add_donation(bloodlink, db, donor_id, 'Plasma', NOW - timedelta(weeks=4))
+    db.session.commit()
+    db.session.execute(bloodlink.update(bloodlink.User).values(updated_at=stale))
+    db.session.commit()
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement.split()[0])
+    event.listen(bloodlink.db.engine, 'before_cursor_execute', listener)
+    try:
+        assert bloodlink.recompute_eligibility() == 40
+    finally:
+        event.remove(bloodlink.db.engine, 'before_cursor_execute', listener)
+
+    assert statements.count('UPDATE') == 1
+    db.session.expire_all()
+    users = bloodlink.User.query.order_by(bloodlink.User.id).all()
+    assert all(user.next_eligible_at == NOW for user in users)
+    # Donors whose date was already right are left alone
+    assert [user.updated_at == stale for user in users[:4]] == [True, False, True, False]
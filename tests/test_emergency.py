@@ -0,0 +1,79 @@
+"""Emergency broadcasts that stop part-way are marked failed and resume on retry."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from notifications import DeliveryResult, LocalStubSender
+
+DONORS = [(donor_id, f'90000000{donor_id:02d}') for donor_id in range(1, 6)]
+
+
+class CrashingBroadcaster:
+    """Delivers the first batch, then fails the way a lost gateway or worker pool would."""
+
+    def __init__(self, sender, max_workers=8, bucket=None):
+        self.sender = sender
+
+    def broadcast(self, notifications, on_batch_done=None):
+        batch = notifications[:2]
+        self.sender.send_batch(batch)
+        on_batch_done([DeliveryResult(n.id, True, None, 0.1) for n in batch])
+        raise ConnectionError('gateway down')
+
+
+@pytest.fixture
+def emergency(bloodlink, db, monkeypatch):
+    hospital = bloodlink.Hospital(name='Hosp', hospital_code='HOSP001', city='Bangalore', state='Karnataka',
+                                  contact_number='1', email='h@x.com', password_hash='x')
+    db.session.add(hospital)
+    db.session.flush()
+    emergency = bloodlink.EmergencyRequest(hospital_id=hospital.id, blood_group='O+', city='Bangalore',
+                                           state='Karnataka')
+    db.session.add(emergency)
+    db.session.commit()
+    monkeypatch.setattr(bloodlink, 'select_emergency_donors', lambda emergency: DONORS)
+    return emergency
+
+
+def test_failed_broadcast_is_marked_failed_and_retry_sends_the_rest(bloodlink, db, emergency, monkeypatch):
+    sender = LocalStubSender()
+    monkeypatch.setattr(bloodlink, 'get_notification_sender', lambda: sender)
+    monkeypatch.setattr(bloodlink, 'Broadcaster', CrashingBroadcaster)
+
+    assert bloodlink.dispatch_emergency_broadcast(emergency.id) is False
+    db.session.expire_all()
+    assert emergency.status == 'failed'
+    assert emergency.sent_count == 2
+    assert emergency.last_error == 'Stopped after notifying 2 of 5 donors: gateway down'
+
+    monkeypatch.undo()
+    monkeypatch.setattr(bloodlink, 'get_notification_sender', lambda: sender)
+    monkeypatch.setattr(bloodlink, 'select_emergency_donors', lambda emergency: pytest.fail('recipients reselected'))
+    result = bloodlink.app.test_cli_runner().invoke(args=['retry-emergencies'])
+    assert 'Request 1: completed, 5 of 5 donors notified.' in result.output
+    db.session.expire_all()
+    assert emergency.status == 'completed'
+    assert emergency.last_error is None
+    # Every donor got exactly one message
+    assert sorted(n.recipient for n in sender.sent) == sorted(recipient for _, recipient in DONORS)
+
+
+def test_broadcast_stalled_by_a_worker_restart_is_retried(bloodlink, db, emergency, monkeypatch):
+    sender = LocalStubSender()
+    monkeypatch.setattr(bloodlink, 'get_notification_sender', lambda: sender)
+    stall = timedelta(seconds=bloodlink.app.config['EMERGENCY_STALL_SECONDS'])
+    # The worker that was sending it died: the status never left 'sending'
+    emergency.status = 'sending'
+    emergency.heartbeat_at = datetime.utcnow() - stall / 2
+    db.session.commit()
+    runner = bloodlink.app.test_cli_runner()
+
+    assert not emergency.can_retry()
+    assert runner.invoke(args=['retry-emergencies']).output == ''
+
+    emergency.heartbeat_at = datetime.utcnow() - stall - timedelta(seconds=1)
+    db.session.commit()
+    assert emergency.can_retry()
+    assert 'Request 1: completed, 5 of 5 donors notified.' in runner.invoke(args=['retry-emergencies']).output
+    # Claimed once: a second retry finds nothing to do
+    assert not bloodlink.claim_emergency_retry(emergency.id)
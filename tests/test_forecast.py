@@ -0,0 +1,82 @@
+"""Shortage forecasts: warnings from usage outpacing stock, and rows that commit out of id order."""
+from datetime import datetime, timedelta
+
+import pytest
+
+PASSWORD = 'secret'
+
+
+@pytest.fixture
+def hospital(bloodlink, db, monkeypatch):
+    password_hash = bloodlink.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    db.session.add(bloodlink.Hospital(id=1, name='Hosp', hospital_code='HOSP001', city='Bangalore',
+                                      state='Karnataka', contact_number='1', email='h@x.com',
+                                      password_hash=password_hash))
+    for donor_id, blood_group in enumerate(('O+', 'A+', 'B+'), start=1):
+        db.session.add(bloodlink.User(
+            id=donor_id, name=f'Donor {donor_id}', age=30, gender='Male', blood_group=blood_group,
+            city='Bangalore', state='Karnataka', pincode='560001', contact_number=f'900000000{donor_id}',
+            email=f'd{donor_id}@x.com', password_hash='x', role='user', is_verified_donor=True))
+    db.session.commit()
+    # Series are per process and would still hold the previous test's rows
+    monkeypatch.setattr(bloodlink, 'forecast_series', {})
+    return 1
+
+
+def add(bloodlink, db, model, donor_id, units, days_ago, **fields):
+    units_field = 'blood_units' if model is bloodlink.BloodUsage else 'donation_units'
+    db.session.add(model(donor_id=donor_id, hospital_id=1, date=datetime.utcnow() - timedelta(days=days_ago),
+                         **{units_field: units}, **fields))
+    db.session.commit()
+    bloodlink.bump_data_version('usage' if model is bloodlink.BloodUsage else 'donations')
+
+
+def stock(summary, blood_group):
+    return next(row['stock_units'] for row in summary if row['blood_group'] == blood_group)
+
+
+def test_shortage_warnings_from_usage_outpacing_stock(bloodlink, db, client, hospital):
+    # O+: 30 units in, one a day used for 25 days -> 5 left at 25/28 a day, under a week
+    add(bloodlink, db, bloodlink.Donation, 1, '30', days_ago=60)
+    for day in range(1, 26):
+        add(bloodlink, db, bloodlink.BloodUsage, 1, '1', days_ago=day)
+    # A+: 1 unit left at 2/28 a day, two weeks
+    add(bloodlink, db, bloodlink.Donation, 2, '3', days_ago=60)
+    add(bloodlink, db, bloodlink.BloodUsage, 2, '2 units', days_ago=2)
+    # B+: half a unit left at 9.5/28 a day, under three days
+    add(bloodlink, db, bloodlink.Donation, 3, '10', days_ago=60)
+    add(bloodlink, db, bloodlink.BloodUsage, 3, '9.5', days_ago=1)
+
+    client.post('/Hospital-Login', data={'email': 'h@x.com', 'password': PASSWORD})
+    body = client.get('/api/forecast').get_json()
+
+    assert stock(body['forecast'], 'A+') == 1
+    assert [(row['blood_group'], row['level'], row['days_of_stock']) for row in body['warnings']] == [
+        ('B+', 'critical', 1.5), ('O+', 'warning', 5.6)]
+
+
+def test_row_committed_late_with_a_lower_id_is_counted_once(bloodlink, db, hospital):
+    add(bloodlink, db, bloodlink.Donation, 1, '5', days_ago=3, id=10)
+    assert stock(bloodlink.get_hospital_forecast(1), 'O+') == 5
+
+    # Id 3 was taken before id 10 but its transaction only commits now
+    add(bloodlink, db, bloodlink.Donation, 1, '2', days_ago=3, id=3)
+    assert stock(bloodlink.get_hospital_forecast(1), 'O+') == 7
+
+    # Later loads read the same recent rows again without counting them twice
+    add(bloodlink, db, bloodlink.BloodUsage, 1, '1', days_ago=0)
+    assert stock(bloodlink.get_hospital_forecast(1), 'O+') == 6
+
+
+def test_rows_older_than_the_last_load_are_not_read_again(bloodlink, db, hospital):
+    add(bloodlink, db, bloodlink.Donation, 1, '5', days_ago=3, updated_at=datetime.utcnow() - timedelta(hours=2))
+    bloodlink.get_hospital_forecast(1)
+    series = bloodlink.forecast_series[1]
+    read = []
+    original_add = series.add
+    series.add = lambda kind, rows: read.extend(rows) or original_add(kind, rows)
+
+    add(bloodlink, db, bloodlink.Donation, 1, '1', days_ago=0)
+    bloodlink.get_hospital_forecast(1)
+
+    assert [row[0] for row in read] == [2]
@@ -0,0 +1,57 @@
+"""Cached dashboard fragments are rendered again when what they show changes."""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+PASSWORD = 'secret'
+
+
+@pytest.fixture
+def hospital_client(bloodlink, db, client, monkeypatch):
+    monkeypatch.setitem(bloodlink.app.config, 'DONOR_SNAPSHOT', False)
+    password_hash = bloodlink.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    db.session.add(bloodlink.Hospital(name='Hosp', hospital_code='HOSP001', city='Bangalore', state='Karnataka',
+                                      contact_number='1', email='h@x.com', password_hash=password_hash))
+    db.session.commit()
+    client.post('/Hospital-Login', data={'email': 'h@x.com', 'password': PASSWORD})
+    return client
+
+
+def add_donor(bloodlink, db, next_eligible_at):
+    db.session.add(bloodlink.User(
+        name='Waiting Donor', age=30, gender='Male', blood_group='O+', city='Bangalore', state='Karnataka',
+        pincode='560001', contact_number='9000000001', email='d@x.com', password_hash='x', role='user',
+        report_status='approved', is_verified_donor=True, next_eligible_at=next_eligible_at))
+    db.session.commit()
+    bloodlink.bump_data_version('donors')
+
+
+def test_entry_expires_at_the_time_render_gives(bloodlink):
+    cache = bloodlink.FragmentCache(10)
+    renders = []
+
+    def render():
+        renders.append(1)
+        return 'html', {'expires_at': datetime.utcnow() + timedelta(seconds=0.2)}
+
+    cache.get_or_render('key', render)
+    cache.get_or_render('key', render)
+    assert len(renders) == 1
+    time.sleep(0.3)
+    cache.get_or_render('key', render)
+    assert len(renders) == 2
+
+
+@pytest.mark.parametrize('query', ['', '?eligible=1'])
+def test_donor_turns_eligible_without_waiting_for_a_write(bloodlink, db, hospital_client, query):
+    add_donor(bloodlink, db, datetime.utcnow() + timedelta(seconds=1))
+    page = hospital_client.get('/hospital/dashboard' + query).get_data(as_text=True)
+    if query:
+        assert 'Waiting Donor' not in page
+    else:
+        assert 'Eligible from' in page and 'Eligible now' not in page
+
+    time.sleep(1.1)
+    page = hospital_client.get('/hospital/dashboard' + query).get_data(as_text=True)
+    assert 'Waiting Donor' in page and 'Eligible now' in page
@@ -0,0 +1,48 @@
+"""Server-side translations: complete catalogs and the language each request gets."""
+import os
+import re
+
+import pytest
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+KEY_PATTERN = re.compile(r'''["']([a-z0-9_]+)["']\s*\|\s*t\b''')
+
+
+def template_keys():
+    keys = set()
+    for root, _, files in os.walk(TEMPLATE_DIR):
+        for name in files:
+            with open(os.path.join(root, name), encoding='utf-8') as f:
+                keys.update(KEY_PATTERN.findall(f.read()))
+    return keys
+
+
+def test_every_catalog_has_every_key_the_templates_use(bloodlink):
+    keys = template_keys() | set(bloodlink.CLIENT_TRANSLATION_KEYS)
+    assert keys
+    for lang, catalog in bloodlink.translation_catalogs.items():
+        assert keys <= set(catalog), (lang, sorted(keys - set(catalog)))
+        assert set(catalog) == set(bloodlink.translation_catalogs['en']), lang
+
+
+def test_missing_translation_falls_back_to_english_then_the_key(bloodlink, monkeypatch):
+    monkeypatch.setitem(bloodlink.translation_catalogs, 'kn', {'login': 'ಲಾಗಿನ್'})
+    assert bloodlink.translate('login', 'kn') == 'ಲಾಗಿನ್'
+    assert bloodlink.translate('logout', 'kn') == bloodlink.translation_catalogs['en']['logout']
+    assert bloodlink.translate('no_such_key', 'kn') == 'no_such_key'
+
+
+@pytest.mark.parametrize('cookie, accept_language, lang', [
+    ('kn', None, 'kn'),
+    (None, 'hi-IN,hi;q=0.9,en;q=0.5', 'hi'),
+    ('kn', 'hi', 'kn'),
+    ('xx', 'hi', 'hi'),
+    (None, 'fr-FR', 'en'),
+])
+def test_language_from_cookie_then_accept_language(bloodlink, client, cookie, accept_language, lang):
+    if cookie:
+        client.set_cookie(bloodlink.LANGUAGE_COOKIE, cookie)
+    headers = {'Accept-Language': accept_language} if accept_language else {}
+    page = client.get('/login', headers=headers).get_data(as_text=True)
+    assert f'<html lang="{lang}">' in page
+    assert bloodlink.translation_catalogs[lang]['login'] in page
@@ -0,0 +1,16 @@
+"""Importing app.py must stay fast and must not load the modules that only load on first use."""
+import os
+
+from benchmark import LAZY_MODULES, measure_import
+
+# Same default as `python benchmark.py import-time`; raise it on slow CI machines
+BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', 800))
+RUNS = 3
+
+
+def test_import_stays_lazy_and_within_budget():
+    # Each run is a fresh interpreter; the fastest counts, since noise only ever adds time
+    runs = [measure_import() for _ in range(RUNS)]
+    total, _, eager = min(runs, key=lambda run: run[0])
+    assert not eager, f'imported eagerly: {eager} (should load on first use: {LAZY_MODULES})'
+    assert total / 1000 <= BUDGET_MS, f'import app took {total / 1000:.1f} ms, over the {BUDGET_MS:.0f} ms budget'
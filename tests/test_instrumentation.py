@@ -0,0 +1,62 @@
+"""Request instrumentation: Server-Timing, Prometheus metrics, slow-query and N+1 logs."""
+import logging
+import re
+
+from sqlalchemy import event
+
+SERVER_TIMING = re.compile(r'^app;dur=\d+\.\d, db;dur=\d+\.\d;desc="(\d+) queries"$')
+
+
+def test_server_timing_counts_the_queries_a_request_issues(bloodlink, db, client):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(bloodlink.db.engine, 'before_cursor_execute', listener)
+    try:
+        response = client.post('/login', data={'email': 'nobody@x.com', 'password': 'x'})
+    finally:
+        event.remove(bloodlink.db.engine, 'before_cursor_execute', listener)
+
+    match = SERVER_TIMING.match(response.headers['Server-Timing'])
+    assert match and int(match.group(1)) == len(statements) > 0
+
+
+def test_metrics_count_requests_per_route(bloodlink, db, client, monkeypatch):
+    client.get('/login')
+    client.get('/no-such-page')
+    monkeypatch.setitem(bloodlink.app.config, 'METRICS_TOKEN', 'scrape')
+    assert client.get('/metrics').status_code == 403
+
+    body = client.get('/metrics', headers={'Authorization': 'Bearer scrape'}).get_data(as_text=True)
+    assert re.search(r'^bloodlink_http_requests_total\{route="/login",method="GET",status="200"\} \d+$', body, re.M)
+    assert re.search(r'^bloodlink_http_requests_total\{route="unmatched",method="GET",status="404"\} \d+$', body, re.M)
+    assert re.search(r'^bloodlink_http_request_duration_seconds_count\{route="/login",method="GET"\} \d+$', body, re.M)
+    assert '# TYPE bloodlink_request_db_queries histogram' in body
+
+
+def test_slow_queries_are_logged_with_their_plan(bloodlink, db, client, monkeypatch, caplog):
+    monkeypatch.setitem(bloodlink.app.config, 'SLOW_QUERY_SECONDS', 0)
+    with caplog.at_level(logging.WARNING, logger='bloodlink.sql'):
+        client.post('/login', data={'email': 'nobody@x.com', 'password': 'x'})
+
+    slow = [record.getMessage() for record in caplog.records if record.getMessage().startswith('Slow query')]
+    assert slow and 'on /login' in slow[0]
+    assert any(re.search(r'\n[\d ]*(SEARCH|SCAN) users', message) for message in slow)
+
+
+def test_repeated_lazy_loads_are_reported_as_n_plus_one(bloodlink, db, caplog):
+    for donor_id in range(1, 6):
+        db.session.add(bloodlink.User(
+            id=donor_id, name=f'Donor {donor_id}', age=30, gender='Male', blood_group='O+', city='Bangalore',
+            state='Karnataka', pincode='560001', contact_number=f'900000000{donor_id}', email=f'd{donor_id}@x.com',
+            password_hash='x', role='user'))
+    db.session.commit()
+    db.session.expire_all()
+
+    with bloodlink.app.test_request_context('/donors'), caplog.at_level(logging.WARNING, logger='bloodlink.sql'):
+        bloodlink.start_request_timer()
+        for donor in bloodlink.User.query.all():
+            donor.donations
+        bloodlink.record_request_metrics(bloodlink.app.response_class())
+
+    assert any(record.getMessage() == 'Possible N+1 on unmatched: User.donations lazy loaded 5 times'
+               for record in caplog.records)
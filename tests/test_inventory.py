@@ -0,0 +1,105 @@
+"""Unit inventory: first-expiring-first allocation and claims that never double-allocate a unit."""
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from inventory import HospitalStock
+
+PASSWORD = 'secret'
+
+
+@pytest.fixture
+def hospital_client(bloodlink, db, client):
+    password_hash = bloodlink.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    db.session.add(bloodlink.Hospital(id=1, name='Hosp', hospital_code='HOSP001', city='Bangalore',
+                                      state='Karnataka', contact_number='1', email='h@x.com',
+                                      password_hash=password_hash))
+    db.session.add(bloodlink.User(id=1, name='Donor', age=30, gender='Male', blood_group='O+', city='Bangalore',
+                                  state='Karnataka', pincode='560001', contact_number='9000000001',
+                                  email='d@x.com', password_hash='x', role='user', is_verified_donor=True))
+    db.session.commit()
+    # Heaps are per process and would still hold the previous test's units
+    bloodlink.inventory_stock.clear()
+    client.post('/Hospital-Login', data={'email': 'h@x.com', 'password': PASSWORD})
+    return client
+
+
+def add_units(bloodlink, db, days_left, blood_group='O+', component='Whole Blood'):
+    now = datetime.utcnow()
+    units = [bloodlink.BloodUnit(donation_id=1, hospital_id=1, blood_group=blood_group, component=component,
+                                 collected_at=now - timedelta(days=30), expires_at=now + timedelta(days=days))
+             for days in days_left]
+    db.session.add_all(units)
+    db.session.commit()
+    return [unit.id for unit in units]
+
+
+def record_usage(client, units):
+    response = client.post('/hospital/usage/create', headers={'X-Offline-Replay': '1'}, data={
+        'donor_id': 1, 'blood_units': str(units), 'usage_type': 'Surgery', 'notes': '',
+        'usage_date': '2026-01-05', 'usage_time': '10:30'})
+    assert response.status_code == 201
+    return [message['text'] for message in response.get_json()['messages']]
+
+
+def allocated_to(bloodlink, usage_id):
+    return sorted(unit.id for unit in bloodlink.BloodUnit.query.filter_by(usage_id=usage_id))
+
+
+def test_first_expiring_units_are_used_and_expired_ones_skipped(bloodlink, db, hospital_client):
+    expired, later, soon, latest = add_units(bloodlink, db, [-1, 10, 3, 20])
+    record_usage(hospital_client, 2)
+    assert allocated_to(bloodlink, 1) == sorted([soon, later])
+    assert db.session.get(bloodlink.BloodUnit, expired).status == 'available'  # check-inventory expires it
+    record_usage(hospital_client, 1)
+    assert allocated_to(bloodlink, 2) == [latest]
+
+
+def test_short_stock_allocates_what_there_is_and_warns(bloodlink, db, hospital_client):
+    add_units(bloodlink, db, [5])
+    add_units(bloodlink, db, [5], blood_group='A+')  # another blood group does not count
+    messages = record_usage(hospital_client, 3)
+    assert 'Only 1 of 3 O+ units were in stock; the rest were not taken from inventory.' in messages
+    assert len(allocated_to(bloodlink, 1)) == 1
+
+
+def test_unit_used_by_another_worker_is_skipped(bloodlink, db, hospital_client):
+    first, second = add_units(bloodlink, db, [3, 10])
+    bloodlink.get_hospital_stock(1)
+    # Another process used the first unit after this one loaded it into its heap
+    db.session.execute(update(bloodlink.BloodUnit).where(bloodlink.BloodUnit.id == first)
+                       .values(status='allocated'))
+    db.session.commit()
+
+    record_usage(hospital_client, 1)
+    assert allocated_to(bloodlink, 1) == [second]
+
+
+def test_concurrent_claims_on_one_unit_allocate_it_once(bloodlink, db, hospital_client):
+    unit_id, = add_units(bloodlink, db, [10])
+    now = datetime.utcnow()
+    barrier = threading.Barrier(2)
+    taken = {}
+
+    def worker(usage_id):
+        # Two worker processes: each has its own heaps holding the same unit, and its own session
+        stock = HospitalStock()
+        stock.add([(unit_id, 'O+', 'Whole Blood', now + timedelta(days=10))])
+        with bloodlink.app.app_context():
+            barrier.wait()
+            taken[usage_id] = stock.take('O+', ['Whole Blood'], 1, now,
+                                         lambda unit: bloodlink.claim_unit(unit, usage_id, now))
+            bloodlink.db.session.commit()
+
+    threads = [threading.Thread(target=worker, args=(usage_id,)) for usage_id in (1, 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(taken.values()) == [[], [unit_id]]
+    winner = next(usage_id for usage_id, units in taken.items() if units)
+    db.session.expire_all()
+    assert db.session.get(bloodlink.BloodUnit, unit_id).usage_id == winner
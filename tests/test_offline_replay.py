@@ -0,0 +1,56 @@
+"""Writes queued offline are only saved for the account that queued them."""
+import re
+
+import pytest
+
+PASSWORD = 'secret'
+REPLAY = {'X-Offline-Replay': '1'}
+
+
+@pytest.fixture
+def donor_id(bloodlink, db):
+    password_hash = bloodlink.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    for i in (1, 2):
+        db.session.add(bloodlink.Hospital(name=f'Hosp {i}', hospital_code=f'HOSP00{i}', city='Bangalore',
+                                          state='Karnataka', contact_number=str(i), email=f'h{i}@x.com',
+                                          password_hash=password_hash))
+    donor = bloodlink.User(name='Donor', age=30, gender='Male', blood_group='O+', city='Bangalore',
+                           state='Karnataka', pincode='560001', contact_number='9000000001', email='d@x.com',
+                           password_hash='x', role='user', report_status='approved', is_verified_donor=True)
+    db.session.add(donor)
+    db.session.commit()
+    return donor.id
+
+
+def login(client, number):
+    client.get('/logout')
+    client.post('/Hospital-Login', data={'email': f'h{number}@x.com', 'password': PASSWORD})
+
+
+def queued_form(client, donor_id):
+    # What the service worker stores: the form as rendered for the signed-in hospital
+    page = client.get(f'/hospital/usage/new?donor_id={donor_id}').get_data(as_text=True)
+    fields = dict(re.findall(r'name="(idempotency_key|account_tag)" value="([^"]*)"', page))
+    return dict(fields, donor_id=donor_id, blood_units='1', usage_type='Surgery', notes='',
+                usage_date='2026-01-05', usage_time='10:30')
+
+
+def test_replay_under_another_account_is_refused(bloodlink, client, donor_id):
+    login(client, 1)
+    form = queued_form(client, donor_id)
+    own_account = client.get('/api/offline-account').get_json()['account']
+    assert own_account == form['account_tag']
+
+    login(client, 2)
+    assert client.get('/api/offline-account').get_json()['account'] != own_account
+    response = client.post('/hospital/usage/create', data=form, headers=REPLAY)
+    assert response.status_code == 409
+    assert bloodlink.BloodUsage.query.count() == 0
+
+    login(client, 1)
+    assert client.post('/hospital/usage/create', data=form, headers=REPLAY).status_code == 201
+    assert [usage.hospital_id for usage in bloodlink.BloodUsage.query.all()] == [1]
+
+
+def test_signed_out_has_no_account(client, donor_id):
+    assert client.get('/api/offline-account').get_json() == {'account': None}
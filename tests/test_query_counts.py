@@ -0,0 +1,78 @@
+"""Pages must need the same number of queries however many rows there are (no N+1 loads)."""
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from benchmark import (BLOOD_GROUPS, DONATION_TYPES, DONOR_EMAIL, GENDERS, HOSPITAL_EMAIL, PASSWORD, PLACES,
+                       SCENARIOS, USAGE_TYPES, call, logged_in_client, query_count)
+
+
+def seed(bloodlink, db, scale, password_hash):
+    """5 x scale hospitals, 20 x scale donors and 60 x scale usage and donation records, many of
+    them on the accounts the scenarios log in with (donor 1, hospital 1). Related rows are spread
+    over all hospitals and donors, so a lazy load per row costs more queries on a larger seed."""
+    rng = random.Random(scale)
+    now = datetime.utcnow()
+    db.drop_all()
+    db.create_all()
+    hospitals = [{
+        'id': i, 'name': f'Hospital {i}', 'hospital_code': f'HOSP{i:03d}', 'city': 'Bangalore', 'state': 'Karnataka',
+        'contact_number': f'80{i:08d}', 'email': HOSPITAL_EMAIL if i == 1 else f'hospital{i}@test.local',
+        'password_hash': password_hash, 'role': 'hospital', 'updated_at': now,
+    } for i in range(1, 5 * scale + 1)]
+    donors = []
+    for i in range(1, 20 * scale + 1):
+        city, state = rng.choice(PLACES)
+        donors.append({
+            'id': i, 'name': f'Donor {i}', 'age': 30, 'gender': rng.choice(GENDERS),
+            'blood_group': rng.choice(BLOOD_GROUPS), 'city': city, 'state': state, 'pincode': '560001',
+            'contact_number': f'9{i:09d}', 'diseases': '', 'email': DONOR_EMAIL if i == 1 else f'donor{i}@test.local',
+            'password_hash': password_hash, 'role': 'user', 'test_hospital_name': 'Lab',
+            'report_status': 'approved' if i % 2 else 'pending', 'report_submitted_at': now,
+            'approved_by_hospital_id': 1 if i % 2 else None, 'is_verified_donor': bool(i % 2), 'updated_at': now,
+        })
+    db.session.execute(insert(bloodlink.Hospital), hospitals)
+    db.session.execute(insert(bloodlink.User), donors)
+    for model, units_column, type_column, types in ((bloodlink.BloodUsage, 'blood_units', 'usage_type', USAGE_TYPES),
+                                                    (bloodlink.Donation, 'donation_units', 'donation_type', DONATION_TYPES)):
+        rows = []
+        for i in range(60 * scale):
+            when = now - timedelta(days=rng.random() * 60)
+            rows.append({
+                'donor_id': 1 if i % 3 == 0 else rng.randint(1, len(donors)),
+                'hospital_id': 1 if i % 2 else rng.randint(1, len(hospitals)),
+                units_column: '1', type_column: rng.choice(types), 'notes': '', 'date': when, 'updated_at': when,
+            })
+        db.session.execute(insert(model), rows)
+    db.session.commit()
+    bloodlink.rebuild_rollups()
+    bloodlink.recompute_eligibility()
+    bloodlink.bump_data_version('usage', 'donations', 'donors')
+    # Per-process state loaded from the previous dataset
+    bloodlink._donor_snapshot = None
+    bloodlink.inventory_stock.clear()
+
+
+def query_counts(bloodlink):
+    counts = {}
+    for name, role, method, path, data in SCENARIOS:
+        client = logged_in_client(bloodlink, role)
+        # The first request also loads per-process state (donor snapshot, lazy modules); the
+        # fragment cache is emptied each time, since a cache hit would hide an N+1 load
+        for _ in range(2):
+            bloodlink.fragment_cache.clear()
+            response = call(client, method, path, data)
+        assert response.status_code < 400, (name, response.status_code)
+        counts[name] = query_count(response.headers)
+    return counts
+
+
+def test_query_counts_do_not_grow_with_rows(bloodlink, db):
+    password_hash = bloodlink.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    seed(bloodlink, db, 1, password_hash)
+    small = query_counts(bloodlink)
+    seed(bloodlink, db, 3, password_hash)
+    large = query_counts(bloodlink)
+    assert None not in small.values()
+    assert large == small
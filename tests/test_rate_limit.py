@@ -0,0 +1,40 @@
+"""Rate limits key on the real client address behind trusted proxies, never on the submitted email."""
+import pytest
+
+
+@pytest.fixture
+def limited_client(bloodlink, client, monkeypatch):
+    monkeypatch.setitem(bloodlink.app.config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(bloodlink.app, 'wsgi_app', bloodlink.app.wsgi_app)
+    monkeypatch.setitem(bloodlink.app.config, 'TRUSTED_PROXIES', 1)
+    bloodlink.create_app()
+    return client
+
+
+def login_statuses(client, attempts, forwarded_for):
+    return [client.post('/login', data={'email': f'{forwarded_for(i)}-{i}@x.com', 'password': 'x'},
+                        headers={'X-Forwarded-For': forwarded_for(i)}).status_code for i in range(attempts)]
+
+
+def test_clients_behind_the_proxy_get_separate_limits(limited_client):
+    assert 429 not in login_statuses(limited_client, 25, lambda i: f'10.1.0.{i}')
+
+
+def test_one_client_behind_the_proxy_is_limited(limited_client):
+    statuses = login_statuses(limited_client, 25, lambda i: '10.2.0.1')
+    assert statuses[:20] == [200] * 20
+    assert statuses[20:] == [429] * 5
+
+
+def test_failed_logins_from_others_do_not_lock_the_account_out(bloodlink, db, limited_client):
+    password_hash = bloodlink.bcrypt.generate_password_hash('secret').decode('utf-8')
+    db.session.add(bloodlink.Hospital(name='Hosp', hospital_code='HOSP001', city='Bangalore', state='Karnataka',
+                                      contact_number='1', email='h@x.com', password_hash=password_hash))
+    db.session.commit()
+    for i in range(10):
+        limited_client.post('/Hospital-Login', data={'email': 'h@x.com', 'password': 'guess'},
+                            headers={'X-Forwarded-For': f'10.3.0.{i}'})
+
+    response = limited_client.post('/Hospital-Login', data={'email': 'h@x.com', 'password': 'secret'},
+                                   headers={'X-Forwarded-For': '10.4.0.1'})
+    assert response.status_code == 302
@@ -0,0 +1,62 @@
+"""Region shards: rebalancing must not lose writes or leak connections."""
+import os
+from datetime import datetime
+
+import pytest
+
+from sharding import ShardRouter
+
+
+@pytest.fixture
+def partitioned(bloodlink, db, monkeypatch, tmp_path):
+    monkeypatch.setitem(bloodlink.app.config, 'PARTITIONING', 'state')
+    monkeypatch.setitem(bloodlink.app.config, 'DONOR_SNAPSHOT', False)
+    monkeypatch.setitem(bloodlink.app.config, 'SHARD_DIR', str(tmp_path))
+    monkeypatch.setattr(bloodlink, '_shard_router', None)
+    hospital = bloodlink.Hospital(name='Hosp', hospital_code='HOSP001', city='Bangalore', state='Karnataka',
+                                  contact_number='1', email='h@x.com', password_hash='x')
+    donor = bloodlink.User(name='Donor', age=30, gender='Male', blood_group='O+', city='Bangalore',
+                           state='Karnataka', pincode='560001', contact_number='9000000001', email='d@x.com',
+                           password_hash='x', role='user', report_status='approved', is_verified_donor=True)
+    db.session.add_all([hospital, donor])
+    db.session.commit()
+    add_usage(bloodlink, db, hospital, donor)
+    return bloodlink.get_shard_router(), hospital, donor
+
+
+def add_usage(bloodlink, db, hospital, donor):
+    db.session.add(bloodlink.BloodUsage(donor_id=donor.id, hospital_id=hospital.id, blood_units='1',
+                                        date=datetime.utcnow()))
+    db.session.commit()
+
+
+def test_rebalance_keeps_writes_made_while_switching(bloodlink, db, partitioned, monkeypatch):
+    router, hospital, donor = partitioned
+    first = router.generation
+
+    def write_during_switch(seconds):
+        assert router.generation == first + 1
+        assert os.path.isdir(router.generation_dir(first))
+        # A worker that still had the old map commits a record; its shard copy goes to the old
+        # generation, which is about to be deleted, so here it is simply not copied anywhere
+        bloodlink.app.config['PARTITIONING'] = 'off'
+        add_usage(bloodlink, db, hospital, donor)
+        bloodlink.app.config['PARTITIONING'] = 'state'
+    monkeypatch.setattr(bloodlink.time, 'sleep', write_during_switch)
+    bloodlink.rebalance_shards()
+
+    usage, _ = router.hospital_activity(hospital.state, hospital.id)
+    assert len(usage) == 2
+    assert not os.path.isdir(router.generation_dir(first))
+
+
+def test_connections_to_old_generations_are_closed(tmp_path):
+    router = ShardRouter(str(tmp_path))
+    old = router.connect('karnataka')
+    router.activate(router.next_generation(), {'karnataka': 'karnataka'})
+    router.connect('karnataka')
+    assert list(router.local.connections) == [(1, os.path.join(router.generation_dir(1), 'karnataka.db'))]
+    with pytest.raises(Exception):
+        old.execute('SELECT 1')
+    router.drop_old_generations()
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith('gen-')) == ['gen-1']
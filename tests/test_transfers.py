@@ -0,0 +1,138 @@
+"""Transfer planning: the min-cost flow plan against brute force on small instances."""
+import itertools
+import random
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import pytest
+
+from forecasting import WINDOW_DAYS
+from transfers import (CITY_LEG_COST, NATIONAL_LEG_COST, STATE_LEG_COST, Position, _solve_group, balance,
+                       plan_transfers)
+
+UNIT_COST = {
+    'city': 2 * CITY_LEG_COST,
+    'state': 2 * (CITY_LEG_COST + STATE_LEG_COST),
+    'national': 2 * (CITY_LEG_COST + STATE_LEG_COST + NATIONAL_LEG_COST),
+}
+PLACES = [('bangalore', 'karnataka'), ('mysore', 'karnataka'), ('chennai', 'tamil nadu')]
+
+
+def distance(places, a, b):
+    if places[a] == places[b]:
+        return 'city'
+    return 'state' if places[a][1] == places[b][1] else 'national'
+
+
+def brute_force(balances, places):
+    """(units moved, cost) of the cheapest plan that moves as many units as possible."""
+    suppliers = [(hospital, surplus) for hospital, (surplus, _) in sorted(balances.items()) if surplus]
+    receivers = [hospital for hospital, (_, deficit) in sorted(balances.items()) if deficit]
+
+    @lru_cache(maxsize=None)
+    def best(i, deficits):
+        # {units moved: lowest cost} for suppliers i.. given the receivers' remaining deficits
+        if i == len(suppliers):
+            return {0: 0}
+        supplier, surplus = suppliers[i]
+        results = {}
+        for sent in itertools.product(*(range(min(surplus, d) + 1) for d in deficits)):
+            if sum(sent) > surplus:
+                continue
+            cost = sum(units * UNIT_COST[distance(places, supplier, receiver)]
+                       for units, receiver in zip(sent, receivers))
+            rest = best(i + 1, tuple(d - units for d, units in zip(deficits, sent)))
+            for moved, rest_cost in rest.items():
+                total = moved + sum(sent)
+                results[total] = min(results.get(total, float('inf')), cost + rest_cost)
+        return results
+
+    results = best(0, tuple(balances[hospital][1] for hospital in receivers))
+    moved = max(results)
+    return moved, results[moved]
+
+
+def check_feasible(transfers, balances, places):
+    sent, received = {}, {}
+    for transfer in transfers:
+        assert transfer.units > 0
+        assert transfer.distance == distance(places, transfer.from_hospital_id, transfer.to_hospital_id)
+        sent[transfer.from_hospital_id] = sent.get(transfer.from_hospital_id, 0) + transfer.units
+        received[transfer.to_hospital_id] = received.get(transfer.to_hospital_id, 0) + transfer.units
+    for hospital, units in sent.items():
+        assert units <= balances[hospital][0]
+    for hospital, units in received.items():
+        assert units <= balances[hospital][1]
+
+
+@pytest.mark.parametrize('seed', range(150))
+def test_plan_matches_brute_force(seed):
+    rng = random.Random(seed)
+    hospitals = range(1, rng.randint(2, 5) + 1)
+    places = {hospital: rng.choice(PLACES) for hospital in hospitals}
+    balances = {}
+    for hospital in hospitals:
+        units = rng.randint(0, 3)
+        balances[hospital] = (units, 0) if rng.random() < 0.5 else (0, units)
+
+    transfers = _solve_group('O+', balances, places)
+    check_feasible(transfers, balances, places)
+    moved, cost = brute_force(balances, places)
+    assert sum(t.units for t in transfers) == moved
+    assert sum(t.units * UNIT_COST[t.distance] for t in transfers) == cost
+
+
+def test_nothing_to_move_without_surplus_or_deficit():
+    places = {1: PLACES[0], 2: PLACES[2]}
+    assert _solve_group('O+', {1: (0, 3), 2: (0, 2)}, places) == []
+    assert _solve_group('O+', {1: (3, 0), 2: (2, 0)}, places) == []
+    assert _solve_group('O+', {}, places) == []
+
+
+def position(hospital_id, place, blood_group, expiries=(), daily_demand=0.0):
+    return Position(hospital_id, place[0].title(), place[1].title(), blood_group, list(expiries), daily_demand, 0.0)
+
+
+def test_units_only_move_within_their_blood_group():
+    # Hospital 1's A+ surplus cannot reach hospital 2's B+ shortage; only the O+ one is met
+    positions = [
+        position(1, PLACES[0], 'A+', expiries=[10] * 5),
+        position(2, PLACES[2], 'B+', daily_demand=1.0),
+        position(1, PLACES[0], 'O+', expiries=[10] * 3),
+        position(3, PLACES[1], 'O+', daily_demand=1.0),
+    ]
+    assert balance(positions[1]) == (0, 7)
+    transfers = plan_transfers(positions)
+    assert [(t.blood_group, t.from_hospital_id, t.to_hospital_id, t.units, t.distance) for t in transfers] == \
+        [('O+', 1, 3, 3, 'state')]
+
+
+def test_nearest_surplus_is_used_first():
+    positions = [
+        position(1, PLACES[2], 'O+', expiries=[10] * 4),   # another state
+        position(2, PLACES[0], 'O+', expiries=[10] * 4),   # same city as the receiver
+        position(3, PLACES[0], 'O+', daily_demand=1.0),    # needs 7
+    ]
+    transfers = plan_transfers(positions)
+    assert [(t.from_hospital_id, t.units, t.distance) for t in transfers] == [(1, 3, 'national'), (2, 4, 'city')]
+
+
+def test_suggest_transfers_stores_the_plan(bloodlink, db):
+    now = datetime.utcnow()
+    for i, (city, state) in enumerate((('Bangalore', 'Karnataka'), ('Mysore', 'Karnataka')), 1):
+        db.session.add(bloodlink.Hospital(id=i, name=f'Hosp {i}', hospital_code=f'HOSP00{i}', city=city,
+                                          state=state, contact_number=str(i), email=f'h{i}@x.com', password_hash='x'))
+    # Hospital 1 has stock and no demand, hospital 2 uses two units a day and has none
+    db.session.add_all(bloodlink.BloodUnit(donation_id=1, hospital_id=1, blood_group='O+', component='Whole Blood',
+                                           collected_at=now, expires_at=now + timedelta(days=20))
+                       for _ in range(5))
+    for day in range(WINDOW_DAYS):
+        db.session.add(bloodlink.DailyRollup(kind='usage', day=(now - timedelta(days=day)).date(), hospital_id=2,
+                                             state='Karnataka', city='Mysore', blood_group='O+', record_count=1,
+                                             units=2))
+    db.session.commit()
+
+    transfers = bloodlink.suggest_transfers(now)
+    assert [(t.from_hospital_id, t.to_hospital_id, t.units, t.distance) for t in transfers] == [(1, 2, 5, 'state')]
+    stored = bloodlink.TransferSuggestion.query.all()
+    assert [(s.from_hospital_id, s.to_hospital_id, s.units) for s in stored] == [(1, 2, 5)]
@@ -0,0 +1,132 @@
+"""Webhook delivery against a local HTTP receiver."""
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from webhooks import DELIVERY_HEADER, SIGNATURE_HEADER, WebhookClient, sign
+
+SECRET = 'test-secret'
+
+
+class StubReceiver:
+    """Records every POST and answers with the next queued status (200 once the queue is empty)."""
+
+    def __init__(self):
+        self.requests = []
+        self.statuses = []
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.requests.append((dict(self.headers), body))
+                status = receiver.statuses.pop(0) if receiver.statuses else 200
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/hook'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def batches(self):
+        return [json.loads(body) for _, body in self.requests]
+
+
+@pytest.fixture
+def receiver():
+    stub = StubReceiver()
+    stub.thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+@pytest.fixture
+def subscription(bloodlink, db, receiver):
+    hospital = bloodlink.Hospital(name='Hosp', hospital_code='HOSP001', city='Bangalore', state='Karnataka',
+                                  contact_number='1', email='h@x.com', password_hash='x')
+    db.session.add(hospital)
+    db.session.flush()
+    subscription = bloodlink.WebhookSubscription(hospital_id=hospital.id, url=receiver.url, secret=SECRET)
+    db.session.add(subscription)
+    # Five events: four for this hospital, one for another hospital that must never be sent
+    for record_id in range(1, 6):
+        db.session.add(bloodlink.OutboxEvent(
+            event_type='usage.created', resource='usages', record_id=record_id,
+            hospital_id=hospital.id if record_id != 3 else hospital.id + 1, payload=json.dumps({'id': record_id})))
+    db.session.commit()
+    return subscription
+
+
+def test_delivers_signed_batches_in_order(bloodlink, subscription, receiver):
+    client = WebhookClient(timeout=5)
+    now = datetime.utcnow()
+    assert bloodlink.dispatch_webhooks_once(client, batch_size=2, now=now) == 2
+    assert bloodlink.dispatch_webhooks_once(client, batch_size=2, now=now) == 2
+    assert bloodlink.dispatch_webhooks_once(client, batch_size=2, now=now) == 0
+
+    batches = receiver.batches()
+    assert [[event['record_id'] for event in batch['events']] for batch in batches] == [[1, 2], [4, 5]]
+    event_ids = [event['id'] for batch in batches for event in batch['events']]
+    assert event_ids == sorted(event_ids)
+    for (headers, body), batch in zip(receiver.requests, batches):
+        assert headers[SIGNATURE_HEADER] == sign(SECRET, body)
+        assert headers[DELIVERY_HEADER] == f"{subscription.id}:{batch['cursor']}"
+    assert subscription.cursor == event_ids[-1]
+
+
+def test_backs_off_after_server_error_and_only_advances_on_2xx(bloodlink, subscription, receiver):
+    client = WebhookClient(timeout=5)
+    now = datetime.utcnow()
+    receiver.statuses = [500, 503]
+
+    assert bloodlink.dispatch_webhooks_once(client, batch_size=2, now=now) == 0
+    assert subscription.cursor == 0
+    assert subscription.failure_count == 1
+    assert subscription.last_error == 'HTTP 500'
+    assert now < subscription.next_attempt_at <= now + timedelta(seconds=2)
+
+    # Not due yet: nothing is sent while backing off
+    assert bloodlink.dispatch_webhooks_once(client, batch_size=2, now=now) == 0
+    assert len(receiver.requests) == 1
+
+    later = subscription.next_attempt_at
+    assert bloodlink.dispatch_webhooks_once(client, batch_size=2, now=later) == 0
+    assert subscription.cursor == 0
+    assert subscription.failure_count == 2
+    assert subscription.next_attempt_at > later
+
+    # The same batch is retried until it is acknowledged, then the cursor moves past it
+    assert bloodlink.dispatch_webhooks_once(client, batch_size=2, now=subscription.next_attempt_at) == 2
+    batches = receiver.batches()
+    assert len(batches) == 3
+    assert batches[0]['events'] == batches[1]['events'] == batches[2]['events']
+    assert subscription.cursor == batches[2]['cursor']
+    assert subscription.failure_count == 0
+    assert subscription.next_attempt_at is None
+
+
+def test_event_committed_late_with_a_lower_id_is_still_delivered(bloodlink, db, subscription, receiver):
+    # With concurrent writers an id is taken at insert time, so id 3 can commit after ids 4 and 5 were sent
+    client = WebhookClient(timeout=5)
+    now = datetime.utcnow()
+    db.session.delete(db.session.get(bloodlink.OutboxEvent, 3))
+    db.session.commit()
+    assert bloodlink.dispatch_webhooks_once(client, batch_size=10, now=now) == 4
+
+    db.session.add(bloodlink.OutboxEvent(id=3, event_type='usage.created', resource='usages', record_id=3,
+                                         hospital_id=subscription.hospital_id, payload=json.dumps({'id': 3})))
+    db.session.commit()
+    assert bloodlink.dispatch_webhooks_once(client, batch_size=10, now=now) == 1
+
+    batches = receiver.batches()
+    assert [[event['id'] for event in batch['events']] for batch in batches] == [[1, 2, 4, 5], [3]]
+    assert [batch['cursor'] for batch in batches] == [4, 5]
+    assert subscription.cursor == 5
@@ -0,0 +1,247 @@
+"""Inter-hospital blood transfer suggestions.
+
+For every hospital and blood group, the stock of available units is compared
+with forecast demand (mean daily usage minus mean daily donations over the
+forecasting window):
+
+- a hospital should hold enough units for COVER_DAYS of net demand; what it
+  lacks is its deficit
+- units that will expire before local usage reaches them, and units beyond
+  the cover, are its surplus. Only units with at least MIN_SHELF_DAYS of
+  shelf life left are worth moving
+
+Surplus is matched to deficits as a min-cost flow problem per blood group.
+Hospitals only have a city and a state, so distance is hierarchical: hospitals
+connect to a hub for their city, cities to a hub for their state, and states
+to one national hub. Moving a unit costs the legs it travels (2 within a city,
+10 within a state, 50 across states), so the solver uses the nearest surplus
+first. With hubs the network has O(hospitals) edges instead of one per
+(supplier, receiver) pair, and the primal-dual solver augments every shortest
+path of a given cost in one pass. Hundreds of hospitals solve in well under a
+second.
+"""
+import heapq
+import math
+from collections import defaultdict, namedtuple
+
+COVER_DAYS = 7
+MIN_SHELF_DAYS = 2
+
+# Cost per unit of each leg; a transfer goes up to the lowest shared hub and back down
+CITY_LEG_COST = 1
+STATE_LEG_COST = 4
+NATIONAL_LEG_COST = 20
+
+# One hospital's stock of one blood group. expiries: days of shelf life left per available unit
+Position = namedtuple('Position', 'hospital_id city state blood_group expiries daily_demand daily_supply')
+Transfer = namedtuple('Transfer', 'blood_group from_hospital_id to_hospital_id units distance')
+
+
+def place_key(value):
+    return ' '.join((value or '').split()).lower()
+
+
+def balance(position, cover_days=COVER_DAYS, min_shelf_days=MIN_SHELF_DAYS):
+    """(surplus, deficit) units of one position."""
+    expiries = sorted(position.expiries)
+    demand = max(position.daily_demand, 0.0)
+    # Used first-expiring-first, unit k is reached after about (k + 1) / demand days
+    wasted = sum(1 for k, days in enumerate(expiries) if demand <= 0 or days < (k + 1) / demand)
+    usable = len(expiries) - wasted
+    required = math.ceil(max(demand - position.daily_supply, 0.0) * cover_days)
+    sendable = sum(1 for days in expiries if days >= min_shelf_days)
+    surplus = min(sendable, wasted + max(0, usable - required))
+    deficit = max(0, required - usable)
+    # Units about to expire can still cover part of a shortfall; a hospital either sends or receives
+    return max(0, surplus - deficit), max(0, deficit - surplus)
+
+
+class _Network:
+    """Residual graph for the min-cost flow solver; edges are stored in pairs (edge, reverse)."""
+
+    def __init__(self):
+        self.adjacency = []
+        self.heads = []
+        self.capacities = []
+        self.costs = []
+
+    def add_node(self):
+        self.adjacency.append([])
+        return len(self.adjacency) - 1
+
+    def add_edge(self, tail, head, capacity, cost):
+        for a, b, cap, c in ((tail, head, capacity, cost), (head, tail, 0, -cost)):
+            self.adjacency[a].append(len(self.heads))
+            self.heads.append(b)
+            self.capacities.append(cap)
+            self.costs.append(c)
+        return len(self.heads) - 2
+
+    def flow(self, edge):
+        # Flow on a forward edge is the capacity gained by its reverse
+        return self.capacities[edge ^ 1]
+
+    def min_cost_flow(self, source, sink):
+        """Push the maximum flow from source to sink at minimum cost (primal-dual).
+
+        Each phase runs Dijkstra on reduced costs, then saturates the shortest
+        paths it found with blocking flows (as in Dinic's algorithm). Costs
+        here take few distinct values, so there are only a handful of phases.
+        """
+        node_count = len(self.adjacency)
+        potential = [0] * node_count
+        while True:
+            dist = [math.inf] * node_count
+            dist[source] = 0
+            heap = [(0, source)]
+            while heap:
+                d, node = heapq.heappop(heap)
+                if d > dist[node]:
+                    continue
+                for edge in self.adjacency[node]:
+                    if self.capacities[edge] <= 0:
+                        continue
+                    head = self.heads[edge]
+                    nd = d + self.costs[edge] + potential[node] - potential[head]
+                    if nd < dist[head]:
+                        dist[head] = nd
+                        heapq.heappush(heap, (nd, head))
+            if dist[sink] == math.inf:
+                return
+            for node in range(node_count):
+                if dist[node] < math.inf:
+                    potential[node] += dist[node]
+
+            # Blocking flow over edges with zero reduced cost
+            def admissible(edge, node):
+                head = self.heads[edge]
+                return (self.capacities[edge] > 0 and dist[head] < math.inf
+                        and self.costs[edge] + potential[node] - potential[head] == 0)
+
+            while True:
+                level = [-1] * node_count
+                level[source] = 0
+                queue = [source]
+                for node in queue:
+                    for edge in self.adjacency[node]:
+                        head = self.heads[edge]
+                        if level[head] < 0 and admissible(edge, node):
+                            level[head] = level[node] + 1
+                            queue.append(head)
+                if level[sink] < 0:
+                    break
+                cursor = [0] * node_count
+                while self._augment(source, sink, level, cursor, admissible):
+                    pass
+
+    def _augment(self, source, sink, level, cursor, admissible):
+        # One augmenting path in the level graph, found iteratively (paths can be long)
+        path, node = [], source
+        while node != sink:
+            edges = self.adjacency[node]
+            while cursor[node] < len(edges):
+                edge = edges[cursor[node]]
+                if admissible(edge, node) and level[self.heads[edge]] == level[node] + 1:
+                    break
+                cursor[node] += 1
+            else:
+                if not path:
+                    return False
+                # Dead end: retreat and skip the edge that led here
+                node = self.heads[path.pop() ^ 1]
+                cursor[node] += 1
+                continue
+            path.append(edge)
+            node = self.heads[edge]
+        pushed = min(self.capacities[edge] for edge in path)
+        for edge in path:
+            self.capacities[edge] -= pushed
+            self.capacities[edge ^ 1] += pushed
+        return True
+
+
+def _solve_group(blood_group, balances, places):
+    """Transfers for one blood group; balances: {hospital_id: (surplus, deficit)}."""
+    network = _Network()
+    source, sink = network.add_node(), network.add_node()
+    national = network.add_node()
+    state_hubs, city_hubs, hospital_nodes = {}, {}, {}
+    total_surplus = sum(surplus for surplus, _ in balances.values())
+    total_deficit = sum(deficit for _, deficit in balances.values())
+    if not total_surplus or not total_deficit:
+        return []
+    unbounded = total_surplus
+
+    for hospital_id, (surplus, deficit) in balances.items():
+        if not surplus and not deficit:
+            continue
+        city, state = places[hospital_id]
+        state_hub = state_hubs.get(state)
+        if state_hub is None:
+            state_hub = state_hubs[state] = network.add_node()
+            network.add_edge(state_hub, national, unbounded, NATIONAL_LEG_COST)
+            network.add_edge(national, state_hub, unbounded, NATIONAL_LEG_COST)
+        city_hub = city_hubs.get((state, city))
+        if city_hub is None:
+            city_hub = city_hubs[(state, city)] = network.add_node()
+            network.add_edge(city_hub, state_hub, unbounded, STATE_LEG_COST)
+            network.add_edge(state_hub, city_hub, unbounded, STATE_LEG_COST)
+        node = hospital_nodes[hospital_id] = network.add_node()
+        if surplus:
+            network.add_edge(source, node, surplus, 0)
+            network.add_edge(node, city_hub, unbounded, CITY_LEG_COST)
+        if deficit:
+            network.add_edge(city_hub, node, unbounded, CITY_LEG_COST)
+            network.add_edge(node, sink, deficit, 0)
+
+    network.min_cost_flow(source, sink)
+
+    # Decompose the flow into hospital-to-hospital paths: follow edges carrying flow
+    # from each supplier until reaching a receiver. Optimal flows have no cycles.
+    carrying = defaultdict(list)
+    for tail, edges in enumerate(network.adjacency):
+        if tail in (source, sink):
+            continue
+        for edge in edges:
+            if edge % 2 == 0 and network.heads[edge] != sink and network.flow(edge) > 0:
+                carrying[tail].append([network.heads[edge], network.flow(edge)])
+    receivers = {node: hospital_id for hospital_id, node in hospital_nodes.items()
+                 if balances[hospital_id][1]}
+    suppliers = [(node, hospital_id) for hospital_id, node in hospital_nodes.items() if balances[hospital_id][0]]
+
+    moved = defaultdict(int)
+    for start, from_hospital in suppliers:
+        while carrying.get(start):
+            path, node = [], start
+            while node not in receivers:
+                branch = carrying[node][-1]
+                path.append((node, branch))
+                node = branch[0]
+            units = min(branch[1] for _, branch in path)
+            for tail, branch in path:
+                branch[1] -= units
+                if not branch[1]:
+                    carrying[tail].pop()
+            moved[(from_hospital, receivers[node])] += units
+
+    transfers = []
+    for (from_hospital, to_hospital), units in sorted(moved.items()):
+        from_city, from_state = places[from_hospital]
+        to_city, to_state = places[to_hospital]
+        distance = ('city' if (from_city, from_state) == (to_city, to_state)
+                    else 'state' if from_state == to_state else 'national')
+        transfers.append(Transfer(blood_group, from_hospital, to_hospital, units, distance))
+    return transfers
+
+
+def plan_transfers(positions, cover_days=COVER_DAYS, min_shelf_days=MIN_SHELF_DAYS):
+    """Suggested transfers for a list of Positions, nearest surplus first."""
+    places = {}
+    by_group = defaultdict(dict)
+    for position in positions:
+        places[position.hospital_id] = (place_key(position.city), place_key(position.state))
+        by_group[position.blood_group][position.hospital_id] = balance(position, cover_days, min_shelf_days)
+    transfers = []
+    for blood_group in sorted(by_group):
+        transfers.extend(_solve_group(blood_group, by_group[blood_group], places))
+    return transfers
@@ -0,0 +1,77 @@
+"""Change-feed webhook delivery for subscribing hospital systems.
+
+app.py writes an OutboxEvent row in the same transaction as every change and
+`flask dispatch-webhooks` turns unsent events into deliveries. Each subscriber
+gets its events in commit order (OutboxEvent.sequence), in batches, one batch in flight at a time, and
+its cursor only moves forward once the receiver acknowledged a batch with a
+2xx response.
+
+This module holds the HTTP side: signing, keep-alive sessions per receiving
+host, parallel delivery across subscribers and the retry backoff schedule.
+"""
+import hashlib
+import hmac
+import random
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+Delivery = namedtuple('Delivery', 'subscription_id url secret body cursor')
+DeliveryOutcome = namedtuple('DeliveryOutcome', 'subscription_id cursor ok error')
+
+SIGNATURE_HEADER = 'X-BloodLink-Signature'
+DELIVERY_HEADER = 'X-BloodLink-Delivery'
+
+
+def backoff_seconds(failures, base=2.0, cap=600.0):
+    # Exponential with jitter: 1-2s, 2-4s, 4-8s ... so failing receivers are not retried in lockstep
+    delay = min(cap, base ** max(failures, 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def sign(secret, body):
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+class WebhookClient:
+    """Posts batches; connections to each receiving host are pooled and kept alive between rounds."""
+
+    def __init__(self, timeout=10, max_workers=8):
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def _session(self, url):
+        import requests  # only the dispatcher process needs the HTTP client
+        host = urlsplit(url).netloc
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = self.sessions[host] = requests.Session()
+                session.headers['Content-Type'] = 'application/json'
+            return session
+
+    def deliver(self, delivery):
+        import requests
+        headers = {
+            SIGNATURE_HEADER: sign(delivery.secret, delivery.body),
+            # Receivers can use it to drop a batch they already processed (we retry after timeouts)
+            DELIVERY_HEADER: f'{delivery.subscription_id}:{delivery.cursor}',
+        }
+        try:
+            response = self._session(delivery.url).post(delivery.url, data=delivery.body, headers=headers,
+                                                        timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            return DeliveryOutcome(delivery.subscription_id, delivery.cursor, False, str(e))
+        if response.status_code >= 300:
+            return DeliveryOutcome(delivery.subscription_id, delivery.cursor, False,
+                                   f'HTTP {response.status_code}')
+        return DeliveryOutcome(delivery.subscription_id, delivery.cursor, True, None)
+
+    def deliver_all(self, deliveries):
+        if len(deliveries) <= 1:
+            return [self.deliver(d) for d in deliveries]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(deliveries))) as executor:
+            return list(executor.map(self.deliver, deliveries))